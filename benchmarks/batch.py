@@ -0,0 +1,43 @@
+import os
+import tempfile
+from pathlib import Path
+
+from xicam.XPCS.ingestors.batch import ingest_nxXPCS_batch
+from xicam.XPCS.testing import write_synthetic_nxXPCS
+
+
+def write_series(directory, num_files, **kwargs):
+    return [write_synthetic_nxXPCS(Path(directory) / f'series_{i:04d}.nxs', seed=i, **kwargs)
+            for i in range(num_files)]
+
+
+class BatchIngest:
+    """Scaling of batch ingestion over a synthetic temperature series with the number of worker processes."""
+    params = ([1, 2, 4, 8],)
+    param_names = ['max_workers']
+    timeout = 300
+
+    def setup(self, max_workers):
+        self._tmpdir = tempfile.TemporaryDirectory()
+        self.paths = write_series(self._tmpdir.name, 64, num_q=200, num_frames=20)
+
+    def teardown(self, max_workers):
+        self._tmpdir.cleanup()
+
+    def time_batch_ingest(self, max_workers):
+        ingest_nxXPCS_batch(self.paths, max_workers=max_workers)
+
+    def track_files_per_second(self, max_workers):
+        return ingest_nxXPCS_batch(self.paths, max_workers=max_workers).files_per_second
+
+    track_files_per_second.unit = 'files/s'
+
+
+if __name__ == '__main__':
+    benchmark = BatchIngest()
+    print(f"{os.cpu_count()} cores")
+    for max_workers in BatchIngest.params[0]:
+        benchmark.setup(max_workers)
+        report = ingest_nxXPCS_batch(benchmark.paths, max_workers=max_workers)
+        benchmark.teardown(max_workers)
+        print(f"{max_workers:>3} workers: {report}")
@@ -0,0 +1,51 @@
+import tempfile
+import time
+from pathlib import Path
+
+from xicam.XPCS.ingestors.catalog import CatalogIndex
+from xicam.XPCS.testing import write_synthetic_nxXPCS
+
+
+class IndexDirectory:
+    """Time indexing the headers of a directory of nxXPCS files, from scratch and when nothing changed."""
+    params = ([100, 1000],)
+    param_names = ['num_files']
+    timeout = 600
+
+    def setup(self, num_files):
+        self._tmpdir = tempfile.TemporaryDirectory()
+        self.directory = Path(self._tmpdir.name) / 'data'
+        self.directory.mkdir()
+        for i in range(num_files):
+            write_synthetic_nxXPCS(self.directory / f'{i}.nxs', num_q=20, num_frames=16, detector_shape=(64, 64),
+                                   seed=i)
+        self._index_number = 0
+        self.index = self._index()
+        self.index.update(self.directory)
+
+    def teardown(self, num_files):
+        self.index.close()
+        self._tmpdir.cleanup()
+
+    def _index(self) -> CatalogIndex:
+        self._index_number += 1
+        return CatalogIndex(Path(self._tmpdir.name) / f'index_{self._index_number}.sqlite')
+
+    def time_update(self, num_files):
+        with self._index() as index:
+            index.update(self.directory)
+
+    def time_update_unchanged(self, num_files):
+        self.index.update(self.directory)
+
+
+if __name__ == '__main__':
+    benchmark = IndexDirectory()
+    print(f"{'files':>8} {'scan (files/s)':>15} {'rescan (files/s)':>17}")
+    for num_files in IndexDirectory.params[0]:
+        benchmark.setup(num_files)
+        with benchmark._index() as index:
+            scan = index.update(benchmark.directory)
+        rescan = benchmark.index.update(benchmark.directory)
+        benchmark.teardown(num_files)
+        print(f"{num_files:>8} {scan.files_per_second:>15.1f} {rescan.files_per_second:>17.1f}")
@@ -0,0 +1,106 @@
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from xicam.XPCS.correlation.multitau import multi_tau_correlation
+from xicam.XPCS.correlation.twotime import create_two_time_output, two_time_correlation
+from xicam.XPCS.testing import synthetic_speckle
+
+
+def fft_correlation(frames: np.ndarray, labels: np.ndarray, lags: np.ndarray) -> np.ndarray:
+    """Naive reference: linear-lag g2 of every pixel from FFTs over the full time axis, averaged per ROI."""
+    num_frames = len(frames)
+    pixels = frames.reshape(num_frames, -1)[:, labels.ravel() > 0]
+    roi = labels.ravel()[labels.ravel() > 0]
+    spectrum = np.fft.rfft(pixels, n=2 * num_frames, axis=0)
+    products = np.fft.irfft(spectrum * spectrum.conj(), axis=0)[:num_frames]
+    cumulative = np.concatenate([np.zeros((1, pixels.shape[1])), np.cumsum(pixels, axis=0)])
+    g2 = []
+    for lag in lags:
+        count = num_frames - lag
+        G = products[lag] / count
+        past = cumulative[count] / count
+        future = (cumulative[num_frames] - cumulative[lag]) / count
+        g2.append([G[roi == r].mean() / (past[roi == r].mean() * future[roi == r].mean()) for r in np.unique(roi)])
+    return np.asarray(g2)
+
+
+def _labels(shape, num_rois):
+    yy, xx = np.indices(shape)
+    r = np.hypot(yy - shape[0] / 2, xx - shape[1] / 2)
+    return np.digitize(r, np.linspace(0, r.max(), num_rois + 1)[1:-1]) + 1
+
+
+class MultiTau:
+    """Multi-tau correlation of synthetic speckle against a naive FFT reference."""
+    params = ([1000, 10000], [(64, 64)])
+    param_names = ['num_frames', 'shape']
+    timeout = 600
+
+    def setup(self, num_frames, shape):
+        self.frames = synthetic_speckle(num_frames, shape, correlation_time=20)
+        self.labels = _labels(shape, 10)
+
+    def time_multi_tau(self, num_frames, shape):
+        multi_tau_correlation(self.frames, self.labels, num_levels=8, num_bufs=16)
+
+    def time_fft_reference(self, num_frames, shape):
+        fft_correlation(self.frames, self.labels, np.arange(1, 16))
+
+    def peakmem_multi_tau(self, num_frames, shape):
+        multi_tau_correlation(self.frames, self.labels, num_levels=8, num_bufs=16)
+
+
+class TwoTime:
+    """Blocked two-time correlation, in memory and written tile by tile to HDF5."""
+    params = ([2000, 8000], [256, 1024])
+    param_names = ['num_frames', 'tile_size']
+    timeout = 600
+
+    def setup(self, num_frames, tile_size):
+        self.frames = synthetic_speckle(num_frames, (32, 32), correlation_time=20)
+        self.labels = _labels((32, 32), 4)
+        self.tmpdir = tempfile.TemporaryDirectory()
+
+    def teardown(self, num_frames, tile_size):
+        self.tmpdir.cleanup()
+
+    def time_in_memory(self, num_frames, tile_size):
+        two_time_correlation(self.frames, self.labels, tile_size=tile_size)
+
+    def time_hdf5(self, num_frames, tile_size):
+        out = create_two_time_output(4, num_frames, path=os.path.join(self.tmpdir.name, 'two_time.h5'),
+                                     tile_size=tile_size)
+        two_time_correlation(self.frames, self.labels, tile_size=tile_size, out=out)
+        out.file.close()
+
+
+if __name__ == '__main__':
+    for num_frames in MultiTau.params[0]:
+        benchmark = MultiTau()
+        benchmark.setup(num_frames, (64, 64))
+
+        start = time.perf_counter()
+        g2, tau, _ = multi_tau_correlation(benchmark.frames, benchmark.labels, num_levels=8, num_bufs=16)
+        multi_tau_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        reference = fft_correlation(benchmark.frames, benchmark.labels, tau[tau < 16])
+        fft_time = time.perf_counter() - start
+
+        deviation = np.abs(g2[tau < 16] - reference).max()
+        print(f"{num_frames:>6} frames: multi-tau {multi_tau_time:.3f} s ({len(tau)} lags up to {tau.max()}), "
+              f"FFT reference {fft_time:.3f} s, max |g2 - reference| at tau < 16: {deviation:.2e}")
+
+    for num_frames in TwoTime.params[0]:
+        for tile_size in TwoTime.params[1]:
+            benchmark = TwoTime()
+            benchmark.setup(num_frames, tile_size)
+            for method in (benchmark.time_in_memory, benchmark.time_hdf5):
+                start = time.perf_counter()
+                method(num_frames, tile_size)
+                elapsed = time.perf_counter() - start
+                print(f"{num_frames:>6} frames, tile {tile_size:>4}: two-time {method.__name__[5:]} {elapsed:.3f} s")
+            benchmark.teardown(num_frames, tile_size)
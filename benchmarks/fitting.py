@@ -0,0 +1,48 @@
+import time
+
+import numpy as np
+
+from xicam.XPCS.fitting.g2 import fit_g2, models
+
+
+def synthetic_g2(model: str, num_q: int, num_tau: int = 64, noise: float = 1e-3):
+    """g2 curves of ``model`` with diffusive rates over q, plus gaussian noise."""
+    tau = np.logspace(-5, 1, num_tau)
+    q = np.linspace(0.002, 0.02, num_q)
+    rate = 2e4 * q ** 2
+    ones = np.ones(num_q)
+    params = {'single': [.3 * ones, rate, ones],
+              'stretched': [.3 * ones, rate, .7 * ones, ones],
+              'double': [.3 * ones, 10 * rate, rate, .4 * ones, ones]}[model]
+    g2 = models[model].evaluate(np.stack(params, axis=1), tau)
+    return g2 + np.random.default_rng(0).normal(scale=noise, size=g2.shape), tau, q
+
+
+class FitG2:
+    """Fit every g2 curve of a run, with and without warm starts and worker processes."""
+    params = (sorted(models), [256, 4096], [1, 4])
+    param_names = ['model', 'num_q', 'max_workers']
+    timeout = 600
+
+    def setup(self, model, num_q, max_workers):
+        self.g2, self.tau, self.q = synthetic_g2(model, num_q)
+
+    def time_fit(self, model, num_q, max_workers):
+        fit_g2(self.g2, self.tau, q=self.q, model=model, max_workers=max_workers)
+
+    def time_fit_cold(self, model, num_q, max_workers):
+        fit_g2(self.g2, self.tau, q=self.q, model=model, warm_start=False, max_workers=max_workers)
+
+
+if __name__ == '__main__':
+    print(f"{'model':>10} {'curves':>7} {'workers':>8} {'warm':>5} {'seconds':>9} {'fits/s':>9} {'converged':>10}")
+    for model in FitG2.params[0]:
+        for num_q in FitG2.params[1]:
+            g2, tau, q = synthetic_g2(model, num_q)
+            for max_workers in FitG2.params[2]:
+                for warm_start in (True, False):
+                    start = time.perf_counter()
+                    fit = fit_g2(g2, tau, q=q, model=model, warm_start=warm_start, max_workers=max_workers)
+                    elapsed = time.perf_counter() - start
+                    print(f"{model:>10} {num_q:>7} {max_workers:>8} {str(warm_start):>5} {elapsed:>9.3f} "
+                          f"{num_q / elapsed:>9.1f} {fit.converged.mean():>10.1%}")
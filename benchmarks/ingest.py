@@ -0,0 +1,212 @@
+import os
+import tempfile
+import time
+from pathlib import Path
+
+import dask
+import numpy as np
+
+from xicam.XPCS import profiling
+from xicam.XPCS.ingestors import chunks, ingest_nxXPCS, raw_data_projection_key
+from xicam.XPCS.ingestors.cache import IngestCache
+from xicam.XPCS.ingestors.convert import convert_nxXPCS
+from xicam.XPCS.ingestors.lazy import LazyHDF5Dataset
+from xicam.XPCS.testing import write_synthetic_nxXPCS
+
+
+class IngestG2:
+    """Time ingestion of the g2 'primary' stream against the number of q-bins."""
+    params = ([10, 100, 1000], [None, 1])
+    param_names = ['num_q', 'g2_page_size']
+
+    def setup(self, num_q, g2_page_size):
+        self._tmpdir = tempfile.TemporaryDirectory()
+        self.path = write_synthetic_nxXPCS(Path(self._tmpdir.name) / f'g2_{num_q}.nxs', num_q=num_q)
+
+    def teardown(self, num_q, g2_page_size):
+        self._tmpdir.cleanup()
+
+    def time_ingest(self, num_q, g2_page_size):
+        for _ in ingest_nxXPCS([self.path], g2_page_size=g2_page_size, cache=None):
+            pass
+
+    def peakmem_ingest(self, num_q, g2_page_size):
+        for _ in ingest_nxXPCS([self.path], g2_page_size=g2_page_size, cache=None):
+            pass
+
+
+class IngestRaw:
+    """Time ingesting and reading every raw frame against the on-disk chunking and compression."""
+    params = ([1, 16], [None, 'gzip', 'lzf'])
+    param_names = ['frame_chunks', 'compression']
+    num_frames = 128
+    detector_shape = (512, 512)
+    timeout = 600
+
+    def setup(self, frame_chunks, compression):
+        self._tmpdir = tempfile.TemporaryDirectory()
+        self.path = write_synthetic_nxXPCS(Path(self._tmpdir.name) / 'raw.nxs', num_frames=self.num_frames,
+                                           detector_shape=self.detector_shape, frame_chunks=frame_chunks,
+                                           compression=compression)
+
+    def teardown(self, frame_chunks, compression):
+        self._tmpdir.cleanup()
+
+    def _read_frames(self):
+        for name, doc in ingest_nxXPCS([self.path], cache=None):
+            if name == 'event_page' and 'raw' in doc['data']:
+                dask.compute(doc['data']['raw'].sum())
+
+    def time_ingest(self, frame_chunks, compression):
+        for _ in ingest_nxXPCS([self.path], cache=None):
+            pass
+
+    def time_read_frames(self, frame_chunks, compression):
+        self._read_frames()
+
+    def peakmem_read_frames(self, frame_chunks, compression):
+        self._read_frames()
+
+
+class IngestConverted:
+    """Time reading all raw frames of a file written one frame per chunk, before and after conversion."""
+    params = ([False, True],)
+    param_names = ['converted']
+    timeout = 600
+
+    def setup(self, converted):
+        self._tmpdir = tempfile.TemporaryDirectory()
+        self.path = write_synthetic_nxXPCS(Path(self._tmpdir.name) / 'raw.nxs', num_frames=256,
+                                           detector_shape=(256, 256), frame_chunks=1)
+        if converted:
+            self.path = convert_nxXPCS(self.path, output=Path(self._tmpdir.name) / 'converted.h5')
+
+    def teardown(self, converted):
+        self._tmpdir.cleanup()
+
+    def time_read_frames(self, converted):
+        for name, doc in ingest_nxXPCS([self.path], cache=None, use_converted=False):
+            if name == 'event_page' and 'raw' in doc['data']:
+                dask.compute(doc['data']['raw'].sum())
+
+
+class ReadCompressed:
+    """Time reading a gzip-compressed raw frame stack in one call with h5py and with parallel chunk decompression,
+    against the number of decompression threads."""
+    params = (['h5py', 'parallel'], [1, 2, 4, 8])
+    param_names = ['backend', 'workers']
+    num_frames = 128
+    detector_shape = (512, 512)
+    timeout = 600
+
+    def setup(self, backend, workers):
+        self._tmpdir = tempfile.TemporaryDirectory()
+        self.path = write_synthetic_nxXPCS(Path(self._tmpdir.name) / 'raw.nxs', num_frames=self.num_frames,
+                                           detector_shape=self.detector_shape, frame_chunks=4, compression='gzip')
+        self.dataset = LazyHDF5Dataset(self.path, raw_data_projection_key)
+        self._settings = chunks.read_backend, chunks.decompression_workers, chunks._executor
+        chunks.read_backend, chunks.decompression_workers, chunks._executor = backend, workers, None
+
+    def teardown(self, backend, workers):
+        if chunks._executor is not None:
+            chunks._executor.shutdown()
+        chunks.read_backend, chunks.decompression_workers, chunks._executor = self._settings
+        del self.dataset
+        self._tmpdir.cleanup()
+
+    def time_read(self, backend, workers):
+        self.dataset[()]
+
+
+class IngestProfiled:
+    """Time ingestion with the profiling hooks switched off and on, to keep their overhead in check."""
+    params = ([False, True],)
+    param_names = ['profiled']
+
+    def setup(self, profiled):
+        self._tmpdir = tempfile.TemporaryDirectory()
+        self.path = write_synthetic_nxXPCS(Path(self._tmpdir.name) / 'g2.nxs', num_q=100, num_frames=64,
+                                           detector_shape=(64, 64), frame_chunks=1)
+        if profiled:
+            profiling.enable()
+
+    def teardown(self, profiled):
+        profiling.disable()
+        profiling.reset()
+        self._tmpdir.cleanup()
+
+    def time_ingest(self, profiled):
+        for _ in ingest_nxXPCS([self.path], cache=None):
+            pass
+
+
+class IngestCached:
+    """Time reopening a file whose documents are already in the ingest cache."""
+    params = ([10, 1000],)
+    param_names = ['num_q']
+
+    def setup(self, num_q):
+        self._tmpdir = tempfile.TemporaryDirectory()
+        self.cache = IngestCache(Path(self._tmpdir.name) / 'cache')
+        self.path = write_synthetic_nxXPCS(Path(self._tmpdir.name) / f'g2_{num_q}.nxs', num_q=num_q)
+        for _ in ingest_nxXPCS([self.path], cache=self.cache):
+            pass
+
+    def teardown(self, num_q):
+        self._tmpdir.cleanup()
+
+    def time_reopen(self, num_q):
+        for _ in ingest_nxXPCS([self.path], cache=self.cache):
+            pass
+
+
+if __name__ == '__main__':
+    benchmark = IngestG2()
+    print(f"{'num_q':>8} {'page size':>10} {'seconds':>10}")
+    for num_q in IngestG2.params[0]:
+        for g2_page_size in IngestG2.params[1]:
+            benchmark.setup(num_q, g2_page_size)
+            start = time.perf_counter()
+            benchmark.time_ingest(num_q, g2_page_size)
+            elapsed = time.perf_counter() - start
+            benchmark.teardown(num_q, g2_page_size)
+            print(f"{num_q:>8} {str(g2_page_size):>10} {elapsed:>10.4f}")
+
+    benchmark = IngestRaw()
+    print(f"{'chunks':>8} {'compression':>12} {'ingest (s)':>11} {'read (s)':>9} {'frames/s':>9}")
+    for frame_chunks in IngestRaw.params[0]:
+        for compression in IngestRaw.params[1]:
+            benchmark.setup(frame_chunks, compression)
+            start = time.perf_counter()
+            benchmark.time_ingest(frame_chunks, compression)
+            ingest_time = time.perf_counter() - start
+            start = time.perf_counter()
+            benchmark.time_read_frames(frame_chunks, compression)
+            read_time = time.perf_counter() - start
+            benchmark.teardown(frame_chunks, compression)
+            print(f"{frame_chunks:>8} {str(compression):>12} {ingest_time:>11.4f} {read_time:>9.3f} "
+                  f"{IngestRaw.num_frames / read_time:>9.1f}")
+
+    benchmark = IngestCached()
+    print(f"{'num_q':>8} {'cached reopen (s)':>20}")
+    for num_q in IngestCached.params[0]:
+        benchmark.setup(num_q)
+        start = time.perf_counter()
+        benchmark.time_reopen(num_q)
+        elapsed = time.perf_counter() - start
+        benchmark.teardown(num_q)
+        print(f"{num_q:>8} {elapsed:>20.4f}")
+
+    benchmark = ReadCompressed()
+    nbytes = ReadCompressed.num_frames * np.prod(ReadCompressed.detector_shape) * 2
+    print(f"{'backend':>8} {'workers':>8} {'seconds':>10} {'MB/s':>9}")
+    for backend in ReadCompressed.params[0]:
+        for workers in ReadCompressed.params[1]:
+            if workers > os.cpu_count():
+                continue
+            benchmark.setup(backend, workers)
+            start = time.perf_counter()
+            benchmark.time_read(backend, workers)
+            elapsed = time.perf_counter() - start
+            benchmark.teardown(backend, workers)
+            print(f"{backend:>8} {workers:>8} {elapsed:>10.4f} {nbytes / 1e6 / elapsed:>9.1f}")
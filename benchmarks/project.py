@@ -0,0 +1,121 @@
+import tempfile
+import time
+from pathlib import Path
+
+from xicam.XPCS.projectors.background import submit_projection
+from xicam.XPCS.projectors.nexus import project_nxXPCS, clear_projection_cache
+from xicam.XPCS.testing import write_synthetic_nxXPCS, load_run
+
+
+class ProjectG2:
+    """Time projecting the g2 curves of a run into intents against the number of q-bins."""
+    params = ([10, 100, 1000],)
+    param_names = ['num_q']
+
+    def setup(self, num_q):
+        self._tmpdir = tempfile.TemporaryDirectory()
+        path = write_synthetic_nxXPCS(Path(self._tmpdir.name) / f'g2_{num_q}.nxs', num_q=num_q)
+        self.run = load_run(path, cache=None)
+
+    def teardown(self, num_q):
+        clear_projection_cache()
+        self._tmpdir.cleanup()
+
+    def time_project(self, num_q):
+        clear_projection_cache()
+        project_nxXPCS(self.run)
+
+    def time_project_memoized(self, num_q):
+        project_nxXPCS(self.run)
+
+    def peakmem_project(self, num_q):
+        clear_projection_cache()
+        project_nxXPCS(self.run)
+
+
+class ProjectRaw:
+    """Time projecting a run with raw frames, whose image intents must stay lazy."""
+    params = ([64, 512], [(256, 256), (1024, 1024)])
+    param_names = ['num_frames', 'detector_shape']
+    timeout = 600
+
+    def setup(self, num_frames, detector_shape):
+        self._tmpdir = tempfile.TemporaryDirectory()
+        path = write_synthetic_nxXPCS(Path(self._tmpdir.name) / 'raw.nxs', num_frames=num_frames,
+                                      detector_shape=detector_shape, frame_chunks=16)
+        self.run = load_run(path, cache=None)
+
+    def teardown(self, num_frames, detector_shape):
+        clear_projection_cache()
+        self._tmpdir.cleanup()
+
+    def time_project(self, num_frames, detector_shape):
+        clear_projection_cache()
+        project_nxXPCS(self.run)
+
+    def peakmem_project(self, num_frames, detector_shape):
+        clear_projection_cache()
+        project_nxXPCS(self.run)
+
+
+class ProjectBackground:
+    """Time to first intent and to all intents of a background projection, against the number of q-bins."""
+    params = ([10, 100, 1000],)
+    param_names = ['num_q']
+
+    def setup(self, num_q):
+        self._tmpdir = tempfile.TemporaryDirectory()
+        path = write_synthetic_nxXPCS(Path(self._tmpdir.name) / f'g2_{num_q}.nxs', num_q=num_q, num_frames=64,
+                                      detector_shape=(256, 256))
+        self.run = load_run(path, cache=None)
+
+    def teardown(self, num_q):
+        clear_projection_cache()
+        self._tmpdir.cleanup()
+
+    def _project(self):
+        clear_projection_cache()
+        job = submit_projection(self.run)
+        job.result()
+        return job
+
+    def track_time_to_first_intent(self, num_q):
+        return self._project().time_to_first_intent
+
+    track_time_to_first_intent.unit = 'seconds'
+
+    def track_time_to_all_intents(self, num_q):
+        return self._project().duration
+
+    track_time_to_all_intents.unit = 'seconds'
+
+
+if __name__ == '__main__':
+    benchmark = ProjectG2()
+    print(f"{'num_q':>8} {'seconds':>10}")
+    for num_q in ProjectG2.params[0]:
+        benchmark.setup(num_q)
+        start = time.perf_counter()
+        benchmark.time_project(num_q)
+        elapsed = time.perf_counter() - start
+        benchmark.teardown(num_q)
+        print(f"{num_q:>8} {elapsed:>10.4f}")
+
+    benchmark = ProjectRaw()
+    print(f"{'frames':>8} {'detector':>12} {'seconds':>10}")
+    for num_frames in ProjectRaw.params[0]:
+        for detector_shape in ProjectRaw.params[1]:
+            benchmark.setup(num_frames, detector_shape)
+            start = time.perf_counter()
+            benchmark.time_project(num_frames, detector_shape)
+            elapsed = time.perf_counter() - start
+            benchmark.teardown(num_frames, detector_shape)
+            print(f"{num_frames:>8} {'x'.join(map(str, detector_shape)):>12} {elapsed:>10.4f}")
+
+    benchmark = ProjectBackground()
+    print(f"{'num_q':>8} {'first (s)':>10} {'all (s)':>10}")
+    for num_q in ProjectBackground.params[0]:
+        benchmark.setup(num_q)
+        job = benchmark._project()
+        benchmark.teardown(num_q)
+        print(f"{num_q:>8} {job.time_to_first_intent:>10.4f} {job.duration:>10.4f}")
@@ -0,0 +1,57 @@
+import tempfile
+import time
+from pathlib import Path
+
+from xicam.XPCS.ingestors import raw_data_projection_key
+from xicam.XPCS.ingestors.lazy import lazy_array
+from xicam.XPCS.reduction.pyramid import ImagePyramid
+from xicam.XPCS.testing import write_synthetic_nxXPCS
+
+
+class PyramidFrame:
+    """Time scrubbing through all raw frames for display at full resolution and from a cached 8x pyramid level."""
+    params = ([(1024, 1024), (2048, 2048)],)
+    param_names = ['detector_shape']
+
+    def setup(self, detector_shape):
+        self._tmpdir = tempfile.TemporaryDirectory()
+        path = write_synthetic_nxXPCS(Path(self._tmpdir.name) / 'frames.nxs', num_frames=16, resizable=True,
+                                      detector_shape=detector_shape)
+        self.pyramid = ImagePyramid(lazy_array(path, raw_data_projection_key),
+                                    path=Path(self._tmpdir.name) / 'pyramid.h5')
+        # Fill the pyramid cache, as a first zoomed-out pass over the frames would
+        self.pyramid.levels[-1].compute()
+
+    def teardown(self, detector_shape):
+        self.pyramid.close()
+        self._tmpdir.cleanup()
+
+    def time_full_resolution(self, detector_shape):
+        for frame in range(16):
+            self.pyramid.levels[0][frame].compute()
+
+    def time_cached_level(self, detector_shape):
+        # As the canvas does: through the array-like level, without a dask graph per frame
+        for frame in range(16):
+            self.pyramid.arrays[-1][frame]
+
+    def peakmem_full_resolution(self, detector_shape):
+        self.pyramid.levels[0].max().compute()
+
+    def peakmem_cached_level(self, detector_shape):
+        self.pyramid.levels[-1].max().compute()
+
+
+if __name__ == '__main__':
+    benchmark = PyramidFrame()
+    print(f"{'detector':>12} {'full (s)':>10} {'8x (s)':>10} {'speedup':>8}")
+    for detector_shape in PyramidFrame.params[0]:
+        benchmark.setup(detector_shape)
+        timings = []
+        for method in (benchmark.time_full_resolution, benchmark.time_cached_level):
+            start = time.perf_counter()
+            method(detector_shape)
+            timings.append(time.perf_counter() - start)
+        benchmark.teardown(detector_shape)
+        print(f"{'x'.join(map(str, detector_shape)):>12} {timings[0]:>10.4f} {timings[1]:>10.4f} "
+              f"{timings[0] / timings[1]:>8.1f}")
@@ -0,0 +1,108 @@
+import tempfile
+import time
+from pathlib import Path
+
+import h5py
+import numpy as np
+
+from xicam.XPCS.ingestors import raw_data_projection_key
+from xicam.XPCS.reduction.frames import reduce_frames
+from xicam.XPCS.reduction.index import QROIIndex
+from xicam.XPCS.reduction.screening import screen_frames
+from xicam.XPCS.reduction.statistics import roi_statistics
+from xicam.XPCS.testing import write_synthetic_nxXPCS
+
+
+class ReduceFrames:
+    """Time one streaming pass over the raw frames of a file against the number of threads."""
+    params = ([1, 2, 4, 8],)
+    param_names = ['max_workers']
+    timeout = 600
+
+    def setup(self, max_workers):
+        self._tmpdir = tempfile.TemporaryDirectory()
+        self.path = write_synthetic_nxXPCS(Path(self._tmpdir.name) / 'raw.nxs', detector_shape=(512, 512),
+                                           num_frames=256, resizable=True)
+        yy, xx = np.indices((512, 512))
+        self.index = QROIIndex.from_qmap(np.hypot(yy - 256, xx - 256), bins=200)
+        self.h5 = h5py.File(self.path, 'r')
+
+    def teardown(self, max_workers):
+        self.h5.close()
+        self._tmpdir.cleanup()
+
+    def time_reduce(self, max_workers):
+        reduce_frames(self.h5[raw_data_projection_key], self.index, max_workers=max_workers)
+
+    def peakmem_reduce(self, max_workers):
+        reduce_frames(self.h5[raw_data_projection_key], self.index, max_workers=max_workers)
+
+
+class ROIStatistics(ReduceFrames):
+    """Time the per-ROI pixel count, mean intensity and speckle contrast pass against the number of threads, and
+    the same statistics from one boolean mask per ROI for reference."""
+    params = ([1, 2, 4, 8],)
+
+    def time_roi_statistics(self, max_workers):
+        roi_statistics(self.h5[raw_data_projection_key], self.index, max_workers=max_workers)
+
+    def peakmem_roi_statistics(self, max_workers):
+        roi_statistics(self.h5[raw_data_projection_key], self.index, max_workers=max_workers)
+
+    def time_masked_loop(self, max_workers):
+        labels = self.index.label_array()
+        masks = [labels == label for label in self.index.labels]
+        raw = self.h5[raw_data_projection_key]
+        for start in range(0, len(raw), 64):
+            frames = raw[start:start + 64].astype(np.float64)
+            for mask in masks:
+                pixels = frames[:, mask]
+                pixels.mean(axis=1), pixels.var(axis=1)
+
+
+class ScreenFrames(ReduceFrames):
+    """Time and peak memory of screening the raw frames for outliers against the block size; peak memory should
+    not grow with it beyond two blocks."""
+    params = ([16, 64, 256],)
+    param_names = ['block_size']
+
+    def time_screen(self, block_size):
+        screen_frames(self.h5[raw_data_projection_key], self.index, block_size=block_size)
+
+    def peakmem_screen(self, block_size):
+        screen_frames(self.h5[raw_data_projection_key], self.index, block_size=block_size)
+
+
+if __name__ == '__main__':
+    benchmark = ReduceFrames()
+    print(f"{'threads':>8} {'seconds':>10} {'frames/s':>10}")
+    for max_workers in ReduceFrames.params[0]:
+        benchmark.setup(max_workers)
+        start = time.perf_counter()
+        benchmark.time_reduce(max_workers)
+        elapsed = time.perf_counter() - start
+        benchmark.teardown(max_workers)
+        print(f"{max_workers:>8} {elapsed:>10.3f} {256 / elapsed:>10.1f}")
+
+    benchmark = ROIStatistics()
+    print(f"\n{'threads':>8} {'ROI stats s':>12} {'masked loop s':>14}")
+    for max_workers in ROIStatistics.params[0]:
+        benchmark.setup(max_workers)
+        start = time.perf_counter()
+        benchmark.time_roi_statistics(max_workers)
+        elapsed = time.perf_counter() - start
+        start = time.perf_counter()
+        benchmark.time_masked_loop(max_workers)
+        masked = time.perf_counter() - start
+        benchmark.teardown(max_workers)
+        print(f"{max_workers:>8} {elapsed:>12.3f} {masked:>14.3f}")
+
+    benchmark = ScreenFrames()
+    print(f"\n{'block':>8} {'seconds':>10} {'frames/s':>10}")
+    for block_size in ScreenFrames.params[0]:
+        benchmark.setup(block_size)
+        start = time.perf_counter()
+        benchmark.time_screen(block_size)
+        elapsed = time.perf_counter() - start
+        benchmark.teardown(block_size)
+        print(f"{block_size:>8} {elapsed:>10.3f} {256 / elapsed:>10.1f}")
@@ -0,0 +1,43 @@
+import tempfile
+import time
+from pathlib import Path
+
+from xicam.XPCS.projectors.series import project_series
+from xicam.XPCS.testing import write_synthetic_nxXPCS, load_run
+
+
+class ProjectSeries:
+    """Time aligning and stacking the g2 curves of a series of runs against the number of runs."""
+    params = ([4, 16, 64],)
+    param_names = ['num_runs']
+
+    def setup(self, num_runs):
+        self._tmpdir = tempfile.TemporaryDirectory()
+        # Every other run has a coarser tau, so half of the runs are interpolated
+        self.runs = [load_run(write_synthetic_nxXPCS(Path(self._tmpdir.name) / f'{i}.nxs', num_q=100,
+                                                     num_tau=64 if i % 2 else 48, seed=i), cache=None)
+                     for i in range(num_runs)]
+
+    def teardown(self, num_runs):
+        self._tmpdir.cleanup()
+
+    def time_compute(self, num_runs):
+        project_series(self.runs).compute()
+
+    def time_fit(self, num_runs):
+        project_series(self.runs).fit('single')
+
+
+if __name__ == '__main__':
+    benchmark = ProjectSeries()
+    print(f"{'runs':>8} {'compute (s)':>12} {'fit (s)':>10}")
+    for num_runs in ProjectSeries.params[0]:
+        benchmark.setup(num_runs)
+        start = time.perf_counter()
+        benchmark.time_compute(num_runs)
+        computed = time.perf_counter() - start
+        start = time.perf_counter()
+        benchmark.time_fit(num_runs)
+        fitted = time.perf_counter() - start
+        benchmark.teardown(num_runs)
+        print(f"{num_runs:>8} {computed:>12.4f} {fitted:>10.4f}")
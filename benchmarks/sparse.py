@@ -0,0 +1,56 @@
+import time
+
+import numpy as np
+
+from xicam.XPCS.correlation.multitau import multi_tau_correlation
+from xicam.XPCS.sparse import SparseFrames
+from xicam.XPCS.testing import synthetic_speckle
+
+
+def photon_frames(num_frames: int, shape, photons_per_pixel: float) -> np.ndarray:
+    speckle = synthetic_speckle(num_frames, shape, correlation_time=20, intensity=photons_per_pixel)
+    return np.random.default_rng(0).poisson(speckle).astype(np.uint16)
+
+
+def _labels(shape, num_rois: int = 10):
+    yy, xx = np.indices(shape)
+    r = np.hypot(yy - shape[0] / 2, xx - shape[1] / 2)
+    return np.digitize(r, np.linspace(0, r.max(), num_rois + 1)[1:-1]) + 1
+
+
+class MultiTauSparse:
+    """Multi-tau correlation of low-count frames, dense against sparse, against the mean count rate."""
+    params = ([.001, .01, .1], [False, True])
+    param_names = ['photons_per_pixel', 'sparse']
+    timeout = 600
+
+    def setup(self, photons_per_pixel, sparse):
+        self.frames = photon_frames(2000, (128, 128), photons_per_pixel)
+        if sparse:
+            self.frames = SparseFrames.from_dense(self.frames)
+        self.labels = _labels((128, 128))
+
+    def time_multi_tau(self, photons_per_pixel, sparse):
+        multi_tau_correlation(self.frames, self.labels, num_levels=8, num_bufs=16)
+
+    def peakmem_multi_tau(self, photons_per_pixel, sparse):
+        multi_tau_correlation(self.frames, self.labels, num_levels=8, num_bufs=16)
+
+    def track_nbytes(self, photons_per_pixel, sparse):
+        return self.frames.nbytes
+
+
+if __name__ == '__main__':
+    labels = _labels((128, 128))
+    print(f"{'photons/px':>10} {'dense MB':>9} {'sparse MB':>10} {'dense (s)':>10} {'sparse (s)':>11} {'speedup':>8}")
+    for photons_per_pixel in MultiTauSparse.params[0]:
+        dense = photon_frames(2000, (128, 128), photons_per_pixel)
+        sparse = SparseFrames.from_dense(dense)
+        start = time.perf_counter()
+        multi_tau_correlation(dense, labels)
+        dense_time = time.perf_counter() - start
+        start = time.perf_counter()
+        multi_tau_correlation(sparse, labels)
+        sparse_time = time.perf_counter() - start
+        print(f"{photons_per_pixel:>10} {dense.nbytes / 1e6:>9.1f} {sparse.nbytes / 1e6:>10.2f} {dense_time:>10.3f} "
+              f"{sparse_time:>11.3f} {dense_time / sparse_time:>7.1f}x")
@@ -33,7 +33,7 @@ setup(
         'Programming Language :: Python :: 3',
     ],
     keywords='',
-    packages=find_namespace_packages(exclude=['docs', 'tests*']),
+    packages=find_namespace_packages(exclude=['docs', 'tests*', 'benchmarks*']),
     package_data={'xicam.XPCS': []},
     include_package_data=True,
     author='Ron Pandolfi',
@@ -41,5 +41,14 @@ setup(
     # dependency_links=dependency_links,
     author_email='ronpandolfi@lbl.gov',
     entry_points={'xicam.plugins.GUIPlugin': ['xpcs_gui_plugin = xicam.XPCS:XPCS'],
-                  'databroker.ingestors': ['application/x-hdf5 = xicam.XPCS.ingestors:ingest_nxXPCS']},
+                  'databroker.ingestors': ['application/x-hdf5 = xicam.XPCS.ingestors:ingest_nxXPCS'],
+                  'databroker.intents': ['MultiErrorBarIntent = xicam.XPCS.intents:MultiErrorBarIntent',
+                                         'PyramidImageIntent = xicam.XPCS.intents:PyramidImageIntent'],
+                  'xicam.plugins.OperationPlugin': [
+                      'multi_tau_correlation = xicam.XPCS.operations.multitau:multi_tau_correlation',
+                      'blocked_two_time_correlation = xicam.XPCS.operations.twotime:blocked_two_time_correlation',
+                      'fit_g2 = xicam.XPCS.operations.fitting:fit_g2'],
+                  'xicam.plugins.IntentCanvasPlugin': [
+                      'multi_errorbar_canvas = xicam.XPCS.canvases:MultiErrorBarIntentCanvas',
+                      'pyramid_image_canvas = xicam.XPCS.canvases:PyramidImageIntentCanvas']},
 )
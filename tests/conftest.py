@@ -0,0 +1,14 @@
+import pytest
+
+from xicam.XPCS.ingestors import convert
+from xicam.XPCS.ingestors.cache import ingest_cache
+from xicam.XPCS.reduction.pyramid import pyramid_cache
+
+
+@pytest.fixture(autouse=True)
+def isolated_ingest_cache(tmp_path, monkeypatch):
+    # Keep tests from reading or polluting the user's ingest and pyramid caches and converted files
+    monkeypatch.setattr(ingest_cache, 'directory', tmp_path / 'ingest_cache')
+    monkeypatch.setattr(convert, 'converted_directory', tmp_path / 'converted')
+    monkeypatch.setattr(pyramid_cache, 'directory', tmp_path / 'pyramid_cache')
+    yield ingest_cache
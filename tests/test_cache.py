@@ -0,0 +1,77 @@
+import gc
+import os
+import time
+
+import numpy as np
+
+from xicam.XPCS.ingestors import ingest_nxXPCS
+from xicam.XPCS.ingestors import cache as cache_module
+from xicam.XPCS.ingestors.cache import IngestCache
+from xicam.XPCS.testing import write_synthetic_nxXPCS
+
+
+def test_cache_replay(tmp_path):
+    cache = IngestCache(tmp_path / 'cache')
+    path = write_synthetic_nxXPCS(tmp_path / 'run.nxs', num_q=4)
+
+    first = list(ingest_nxXPCS([path], cache=cache))
+    assert len(cache.entries()) == 1
+    second = list(ingest_nxXPCS([path], cache=cache))
+
+    assert [name for name, _ in first] == [name for name, _ in second]
+    assert first[0][1]['uid'] == second[0][1]['uid']
+    saxs_2d = [doc['data']['SAXS_2D'] for name, doc in second if name == 'event' and 'SAXS_2D' in doc['data']][0]
+    assert np.isclose(saxs_2d.sum().compute(), sum(doc['data']['SAXS_2D'].sum().compute()
+                                                   for name, doc in first
+                                                   if name == 'event' and 'SAXS_2D' in doc['data']))
+
+    # Options are part of the key, unless they are left at their defaults
+    list(ingest_nxXPCS([path], g2_page_size=2, cache=cache))
+    assert len(cache.entries()) == 2
+    list(ingest_nxXPCS([path], roi_statistics=False, cache=cache))
+    assert len(cache.entries()) == 2
+    list(ingest_nxXPCS([path], roi_statistics=True, cache=cache))
+    assert len(cache.entries()) == 3
+
+    # Rewriting the file invalidates its entries
+    del first, second, saxs_2d
+    gc.collect()
+    write_synthetic_nxXPCS(path, num_q=4, seed=1)
+    os.utime(path, ns=(time.time_ns(), time.time_ns() + 10 ** 9))
+    assert cache.get(path) is None
+
+
+def test_cache_version(tmp_path, monkeypatch):
+    cache = IngestCache(tmp_path / 'cache')
+    path = write_synthetic_nxXPCS(tmp_path / 'run.nxs', num_q=4, num_rois=2)
+    version = cache_module.CACHE_VERSION
+    monkeypatch.setattr(cache_module, 'CACHE_VERSION', version - 1)
+    list(ingest_nxXPCS([path], cache=cache))
+    assert cache.get(path) is not None
+
+    # Entries written with another layout are not replayed
+    monkeypatch.setattr(cache_module, 'CACHE_VERSION', version)
+    assert cache.get(path) is None
+    documents = list(ingest_nxXPCS([path], cache=cache))
+    assert 'rois' in {doc['name'] for name, doc in documents if name == 'descriptor'}
+    assert len(cache.entries()) == 2
+
+
+def test_cache_lru_eviction(tmp_path):
+    paths = [write_synthetic_nxXPCS(tmp_path / f'{i}.nxs', seed=i) for i in range(3)]
+    cache = IngestCache(tmp_path / 'cache')
+    for path in paths:
+        list(ingest_nxXPCS([path], cache=cache))
+    entry_size = max(entry.stat().st_size for entry in cache.entries())
+
+    # Touch the first entry so the second one becomes least recently used
+    past = time.time() - 100
+    for i, path in enumerate(paths):
+        os.utime(cache._entry(cache.key(path)), (past + i, past + i))
+    assert cache.get(paths[0]) is not None
+
+    cache.max_bytes = 2 * entry_size
+    cache.evict()
+    assert cache.get(paths[0]) is not None
+    assert cache.get(paths[1]) is None
+    assert cache.get(paths[2]) is not None
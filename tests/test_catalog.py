@@ -0,0 +1,76 @@
+import os
+
+import pytest
+
+from xicam.XPCS.ingestors import ingest_nxXPCS
+from xicam.XPCS.ingestors.catalog import CatalogIndex, header_documents
+from xicam.XPCS.testing import write_synthetic_nxXPCS
+
+
+@pytest.fixture
+def directory(tmp_path):
+    directory = tmp_path / 'data'
+    (directory / 'nested').mkdir(parents=True)
+    write_synthetic_nxXPCS(directory / 'aerogel_1.nxs', num_q=4, num_frames=8, detector_shape=(16, 16))
+    write_synthetic_nxXPCS(directory / 'aerogel_2.nxs', num_q=8, detector_shape=(16, 16))
+    write_synthetic_nxXPCS(directory / 'nested' / 'latex.nxs', num_q=2, num_frames=32, detector_shape=(16, 16))
+    (directory / 'broken.nxs').write_bytes(b'not hdf5')
+    return directory
+
+
+@pytest.fixture
+def index(tmp_path):
+    with CatalogIndex(tmp_path / 'index.sqlite') as index:
+        yield index
+
+
+def test_header_documents_match_ingest(directory):
+    path = directory / 'aerogel_1.nxs'
+    header = header_documents(path)
+    assert [name for name, _ in header] == ['start'] + ['descriptor'] * 5 + ['stop']
+    assert header[0][1]['nxXPCS']['num_frames'] == 8
+
+    descriptors = {doc['name']: doc['data_keys'] for name, doc in ingest_nxXPCS([path], cache=None)
+                   if name == 'descriptor'}
+    for name, doc in header[1:-1]:
+        assert {key: tuple(value['shape']) for key, value in doc['data_keys'].items()} == \
+               {key: tuple(value['shape']) for key, value in descriptors[doc['name']].items()}
+    assert header[-1][1]['num_events']['primary'] == 4
+
+
+def test_header_num_events_match_ingest(tmp_path):
+    path = write_synthetic_nxXPCS(tmp_path / 'rois.nxs', num_q=6, num_frames=10, detector_shape=(16, 16), num_rois=2)
+    header = header_documents(path)
+    stop = next(doc for name, doc in ingest_nxXPCS([path], cache=None) if name == 'stop')
+    assert header[-1][1]['num_events'] == stop['num_events']
+    assert stop['num_events'] == {'raw': 10, 'primary': 6, 'SAXS_2D': 1, 'SAXS_1D': 1, 'SAXS_1D_I_partial': 1,
+                                  'rois': 1}
+
+
+def test_index_update_and_search(directory, index):
+    report = index.update(directory, max_workers=1)
+    assert (report.scanned, report.unchanged, len(report.failed)) == (3, 0, 1)
+    assert len(index) == 3
+
+    assert [os.path.basename(entry.path) for entry in index.search(sample_name='aerogel%')] == \
+           ['aerogel_1.nxs', 'aerogel_2.nxs']
+    assert [entry.num_frames for entry in index.search(min_frames=16)] == [32]
+    assert len(index.search(q=0.05)) == 3
+    assert len(index.search(q_range=(0.06, 0.1))) == 0
+
+    # Only changed files are rescanned, and deleted ones dropped
+    write_synthetic_nxXPCS(directory / 'aerogel_2.nxs', num_q=3, detector_shape=(16, 16), seed=1)
+    (directory / 'nested' / 'latex.nxs').unlink()
+    report = index.update(directory, max_workers=1)
+    assert (report.scanned, report.unchanged, report.removed) == (1, 1, 1)
+    assert [entry.num_q for entry in index.search(sample_name='aerogel%')] == [4, 3]
+
+
+def test_index_catalog_is_lazy(directory, index):
+    index.update([directory / 'aerogel_1.nxs'])
+    entry, = index.search()
+    catalog = index.catalog()
+    run = catalog[entry.uid]
+    assert run.metadata['start']['sample_name'] == 'aerogel_1'
+    assert run.primary.read()['g2_curves'].shape == (4, 64)
+    assert run.raw.to_dask()['raw'].shape == (8, 16, 16)
@@ -0,0 +1,62 @@
+import h5py
+import numpy as np
+import pytest
+
+from xicam.XPCS.ingestors import chunks
+from xicam.XPCS.ingestors.chunks import ChunkReader
+from xicam.XPCS.ingestors.lazy import LazyHDF5Dataset, lazy_array
+
+selections = [(), 3, -1, (slice(2, 11), slice(5, 30)), (Ellipsis, 7), (slice(None), 4, slice(3, 9)),
+              (slice(0, 10, 2),), ([1, 5],), (slice(5, 5),)]
+
+
+@pytest.fixture(params=[dict(compression='gzip', shuffle=True),
+                        dict(compression='gzip', compression_opts=1, fletcher32=True),
+                        dict(compression='lzf')],
+                ids=['gzip-shuffle', 'gzip-fletcher32', 'lzf'])
+def dataset(request, tmp_path):
+    rng = np.random.default_rng(0)
+    # Edge chunks along every axis
+    data = rng.poisson(5, size=(13, 37, 41)).astype(np.uint16)
+    with h5py.File(tmp_path / 'compressed.h5', 'w') as h5:
+        h5.create_dataset('data', data=data, chunks=(4, 16, 16), **request.param)
+    with h5py.File(tmp_path / 'compressed.h5', 'r') as h5:
+        yield h5['data'], data
+
+
+@pytest.mark.parametrize('item', selections)
+def test_read_matches_h5py(dataset, item):
+    dataset, data = dataset
+    read = ChunkReader(dataset).read(item)
+    expected = dataset[item]
+    assert read.dtype == expected.dtype
+    np.testing.assert_array_equal(read, expected)
+
+
+def test_supported_filters(dataset):
+    dataset, _ = dataset
+    assert chunks.supported(dataset) == (dataset.compression != 'lzf')
+
+
+def test_lazy_array_reads_in_parallel(tmp_path):
+    data = np.arange(16 * 64 * 64, dtype=np.float32).reshape(16, 64, 64)
+    path = tmp_path / 'frames.h5'
+    with h5py.File(path, 'w') as h5:
+        h5.create_dataset('frames', data=data, chunks=(1, 64, 64), compression='gzip', shuffle=True)
+
+    assert LazyHDF5Dataset(path, 'frames').parallel
+    np.testing.assert_array_equal(lazy_array(path, 'frames').compute(), data)
+
+
+def test_h5py_backend(tmp_path, monkeypatch):
+    data = np.arange(8 * 8, dtype=np.int32).reshape(8, 8)
+    path = tmp_path / 'frames.h5'
+    with h5py.File(path, 'w') as h5:
+        h5.create_dataset('frames', data=data, chunks=(2, 8), compression='gzip')
+
+    def fail(*args, **kwargs):
+        raise AssertionError('ChunkReader used with the h5py backend')
+
+    monkeypatch.setattr(chunks, 'read_backend', 'h5py')
+    monkeypatch.setattr(chunks.ChunkReader, 'read', fail)
+    np.testing.assert_array_equal(LazyHDF5Dataset(path, 'frames')[2:6], data[2:6])
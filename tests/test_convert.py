@@ -0,0 +1,56 @@
+import gc
+import os
+
+import h5py
+import numpy as np
+
+from xicam.XPCS.ingestors import ingest_nxXPCS, g2_projection_key, raw_data_projection_key
+from xicam.XPCS.ingestors.lazy import handle_pool
+from xicam.XPCS.ingestors.convert import convert_nxXPCS, converted_path, find_converted
+from xicam.XPCS.testing import write_synthetic_nxXPCS
+
+
+def _raw_frames(documents):
+    pages = [doc for name, doc in documents if name == 'event_page' and 'raw' in doc['data']]
+    return pages, np.concatenate([np.asarray(page['data']['raw']) for page in pages])
+
+
+def test_convert_layout(tmp_path):
+    path = write_synthetic_nxXPCS(tmp_path / 'run.nxs', num_q=50, num_frames=40, detector_shape=(64, 64))
+    output = convert_nxXPCS(path, output=tmp_path / 'run.h5', target_chunk_bytes=64 * 64 * 2 * 8,
+                            min_chunked_bytes=1024)
+    with h5py.File(path, 'r') as source, h5py.File(output, 'r') as converted:
+        raw = converted[raw_data_projection_key]
+        assert raw.chunks == (8, 64, 64) and raw.compression == 'gzip'
+        np.testing.assert_array_equal(raw[()], source[raw_data_projection_key][()])
+        g2 = converted[g2_projection_key]
+        # Whole curves (columns of the (tau, q) dataset) per chunk
+        assert g2.chunks[0] == g2.shape[0]
+        np.testing.assert_array_equal(g2[()], source[g2_projection_key][()])
+
+
+def test_ingest_uses_converted(tmp_path):
+    path = write_synthetic_nxXPCS(tmp_path / 'run.nxs', num_q=5, num_frames=12, detector_shape=(16, 16))
+    original = list(ingest_nxXPCS([path], cache=None))
+    original_frames = _raw_frames(original)[1]
+    # Release the handles of the first ingest so only the ones below are counted
+    del original
+    gc.collect()
+    assert find_converted(path) is None
+
+    assert convert_nxXPCS(path) == converted_path(path)
+    assert find_converted(path) == converted_path(path)
+    documents = list(ingest_nxXPCS([path]))
+    assert documents[0][1]['sample_name'] == 'run'
+    # Lazily loaded datasets hold the file they read from open
+    assert handle_pool.refcount(converted_path(path)) > 0 and handle_pool.refcount(path) == 0
+    np.testing.assert_array_equal(_raw_frames(documents)[1], original_frames)
+    del documents
+    gc.collect()
+
+    # Touching the file makes the conversion stale
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    assert find_converted(path) is None
+    documents = list(ingest_nxXPCS([path]))
+    assert handle_pool.refcount(converted_path(path)) == 0 and handle_pool.refcount(path) > 0
@@ -0,0 +1,58 @@
+import gc
+from functools import partial
+
+import numpy as np
+import pytest
+
+from xicam.XPCS.ingestors import ingest_nxXPCS
+from xicam.XPCS.projectors.nexus import clear_projection_cache, project_nxXPCS
+from xicam.XPCS.reduction.frames import reduce_frames, reduce_nxXPCS
+from xicam.XPCS.reduction.index import QROIIndex
+from xicam.XPCS.testing import write_synthetic_nxXPCS
+
+
+@pytest.fixture(scope='module')
+def frames():
+    return np.random.default_rng(0).poisson(20, size=(50, 16, 16)).astype(np.uint16)
+
+
+@pytest.fixture(scope='module')
+def index():
+    yy, xx = np.indices((16, 16))
+    labels = np.digitize(np.hypot(yy - 8, xx - 8), [2, 4, 6, 8])
+    # Bin 0 (the center) is left out, as a mask would
+    return QROIIndex.from_labels(labels)
+
+
+@pytest.mark.parametrize('block_size, max_workers', [(50, 1), (7, 3)])
+def test_reduce_frames(frames, index, block_size, max_workers):
+    reduction = reduce_frames(frames, index, num_partitions=4, block_size=block_size, max_workers=max_workers)
+
+    labels = index.label_array()
+    bin_means = np.stack([frames[:, labels == label].mean(axis=1) for label in index.labels], axis=1)
+    partitions = np.arange(50) * 4 // 50
+    np.testing.assert_allclose(reduction.mean_image, frames.mean(axis=0))
+    np.testing.assert_allclose(reduction.I, bin_means.mean(axis=0))
+    np.testing.assert_allclose(reduction.I_partial, [bin_means[partitions == p].mean(axis=0) for p in range(4)])
+    assert reduction.num_frames == 50
+
+
+def test_reduce_nxXPCS_streams(tmp_path, index):
+    from databroker.in_memory import BlueskyInMemoryCatalog
+
+    path = write_synthetic_nxXPCS(tmp_path / 'raw.nxs', detector_shape=(16, 16), num_frames=20)
+    documents = list(reduce_nxXPCS([path], index, num_partitions=5))
+    ingested = list(ingest_nxXPCS([path], cache=None))
+    assert [name for name, _ in documents] == [name for name, _ in ingested]
+
+    catalog = BlueskyInMemoryCatalog()
+    catalog.upsert(documents[0][1], documents[-1][1], partial(iter, documents), [], {})
+    clear_projection_cache()
+    intents = project_nxXPCS(catalog[documents[0][1]['uid']])
+    stability = next(intent for intent in intents if intent.name.startswith('Stability'))
+    assert np.asarray(stability.y).shape == (5, index.num_bins)
+
+    # Release the lazily-read file handles held by the run
+    clear_projection_cache()
+    del documents, ingested, catalog, intents, stability
+    gc.collect()
@@ -0,0 +1,79 @@
+import gc
+
+import numpy as np
+import pytest
+
+from xicam.XPCS.fitting.g2 import fit_g2, models
+from xicam.XPCS.projectors import nexus
+from xicam.XPCS.projectors.nexus import clear_projection_cache, project_nxXPCS
+from xicam.XPCS.testing import load_run, write_synthetic_nxXPCS
+
+tau = np.logspace(-5, 1, 64)
+q = np.linspace(0.002, 0.02, 40)
+truths = {'single': lambda: np.stack([np.full(40, .3), 2e4 * q ** 2, np.ones(40)], axis=1),
+          'stretched': lambda: np.stack([np.full(40, .3), 2e4 * q ** 2, np.full(40, .7), np.ones(40)], axis=1),
+          'double': lambda: np.stack([np.full(40, .3), 2e5 * q ** 2, 2e4 * q ** 2, np.full(40, .4), np.ones(40)],
+                                     axis=1)}
+
+
+@pytest.fixture
+def projection_cache():
+    # Cached intents hold the HDF5 handles of their run open
+    clear_projection_cache()
+    yield
+    clear_projection_cache()
+    gc.collect()
+
+
+def _curves(model):
+    params = truths[model]()
+    g2 = models[model].evaluate(params, tau)
+    return params, g2 + np.random.default_rng(0).normal(scale=1e-4, size=g2.shape)
+
+
+@pytest.mark.parametrize('model', sorted(truths))
+@pytest.mark.parametrize('warm_start', [False, True])
+def test_fit_recovers_parameters(model, warm_start):
+    params, g2 = _curves(model)
+    fit = fit_g2(g2, tau, q=q, model=model, errors=np.full_like(g2, 1e-4), warm_start=warm_start)
+    assert fit.converged.mean() > .9
+    np.testing.assert_allclose(np.median(fit.param_array() / params, axis=0), 1, rtol=1e-2)
+    assert np.all(np.isfinite(fit.relaxation_rate_error))
+    np.testing.assert_allclose(np.median(fit.chi2), 1, rtol=.2)
+
+
+@pytest.mark.parametrize('model', sorted(truths))
+def test_relaxation_rate(model):
+    # Every truth relaxes at Γ = 2e4 q² (the dominant, slower mode of the double exponential)
+    _, g2 = _curves(model)
+    fit = fit_g2(g2, tau, q=q, model=model, errors=np.full_like(g2, 1e-4))
+    np.testing.assert_allclose(np.median(fit.relaxation_rate / (2e4 * q ** 2)), 1, rtol=1e-2)
+    assert np.all(np.isfinite(fit.relaxation_rate_error))
+
+
+def test_fixed_parameters_and_nan_points():
+    params, g2 = _curves('single')
+    g2[:, ::5] = np.nan
+    fit = fit_g2(g2, tau, q=q, fixed={'baseline': 1})
+    assert np.all(fit.params['baseline'] == 1)
+    assert np.all(fit.errors['baseline'] == 0)
+    np.testing.assert_allclose(fit.relaxation_rate, params[:, 1], rtol=1e-2)
+
+
+def test_process_pool_matches_inline():
+    _, g2 = _curves('stretched')
+    inline = fit_g2(g2, tau, q=q, model='stretched', batch_size=8)
+    pooled = fit_g2(g2, tau, q=q, model='stretched', batch_size=8, max_workers=2)
+    np.testing.assert_allclose(pooled.param_array(), inline.param_array())
+
+
+def test_projected_fit_intents(tmp_path, monkeypatch, projection_cache):
+    monkeypatch.setattr(nexus, 'g2_fit_model', 'single')
+    run = load_run(write_synthetic_nxXPCS(tmp_path / 'run.nxs', num_q=6))
+    intents = project_nxXPCS(run)
+    rates = next(intent for intent in intents if intent.name.startswith('Γ'))
+    q_squared = np.linspace(0.001, 0.05, 6) ** 2
+    np.testing.assert_allclose(rates.x, q_squared)
+    # The synthetic rates are 1e3 q²; the slowest curves barely decay within tau
+    np.testing.assert_allclose(rates.y[2:], 1e3 * q_squared[2:], rtol=1e-2)
+    assert any(intent.name.startswith('g₂ fit') for intent in intents)
@@ -1,4 +1,6 @@
 from pathlib import Path
+
+import pytest
 from xicam.core.data import load_header
 from xicam.plugins import manager as plugin_manager
 
@@ -11,6 +13,7 @@ f = 'B009_Aerogel_1mm_025C_att1_Lq0_001_0001-10000.nxs'
 p = Path('.') / f
 
 
+@pytest.mark.skipif(not p.exists(), reason=f"{f} is not available; see test_ingest_synthetic")
 def test_ingest_nexus(path=p):
     docs = list(ingest_nxXPCS([path]))
     #TODO check document keys even if multiple events per document
@@ -36,8 +39,134 @@ def test_ingest_nexus(path=p):
 
 
 
+@pytest.mark.parametrize('frame_chunks, compression', [(None, None), (4, 'gzip'), (16, 'lzf')])
+def test_ingest_synthetic(tmp_path, frame_chunks, compression):
+    import h5py
+    import numpy as np
+    from xicam.XPCS.ingestors import projections, raw_data_projection_key
+    from xicam.XPCS.testing import write_synthetic_nxXPCS
+
+    path = write_synthetic_nxXPCS(tmp_path / 'run.nxs', num_q=5, num_frames=10, detector_shape=(8, 8),
+                                  frame_chunks=frame_chunks, compression=compression)
+    with h5py.File(path, 'r') as h5:
+        raw = h5[raw_data_projection_key]
+        assert raw.compression == compression
+        assert (raw.chunks or (None,))[0] == (min(frame_chunks, 10) if frame_chunks else None)
+        frames = raw[()]
+
+    docs = list(ingest_nxXPCS([path], cache=None))
+    assert [name for name, doc in docs][0] == 'start' and docs[-1][0] == 'stop'
+    assert docs[0][1]['projections'] == projections
+    assert {doc['name'] for name, doc in docs if name == 'descriptor'} == \
+           {'primary', 'raw', 'SAXS_2D', 'SAXS_1D', 'SAXS_1D_I_partial'}
+
+    raw_pages = [doc for name, doc in docs if name == 'event_page' and 'raw' in doc['data']]
+    np.testing.assert_array_equal(np.concatenate([np.asarray(page['data']['raw']) for page in raw_pages]), frames)
+
+
 # def test_project_nexus():
 #
 #     cat = load_header([p])
 #     g2_arr = project_nxXPCS(cat)
-#     print(g2_arr)
\ No newline at end of file
+#     print(g2_arr)
+
+def test_ingest_raw_frame_selection(tmp_path):
+    import h5py
+    import numpy as np
+    from xicam.XPCS.testing import write_synthetic_nxXPCS
+
+    path = write_synthetic_nxXPCS(tmp_path / 'raw.nxs', num_frames=50, detector_shape=(16, 16))
+    docs = list(ingest_nxXPCS([path], raw_frame_range=(5, 45), raw_frame_stride=3, raw_block_size=4))
+
+    raw_descriptor = next(doc for name, doc in docs if name == 'descriptor' and doc['name'] == 'raw')
+    raw_pages = [doc for name, doc in docs if name == 'event_page' and doc['descriptor'] == raw_descriptor['uid']]
+    assert [len(page['seq_num']) for page in raw_pages] == [4, 4, 4, 2]
+
+    frames = np.concatenate([np.asarray(page['data']['raw']) for page in raw_pages])
+    with h5py.File(path, 'r') as h5:
+        np.testing.assert_array_equal(frames, h5['/entry/data/raw'][5:45:3])
+    np.testing.assert_array_equal(np.concatenate([page['data']['raw_frame_index'] for page in raw_pages]),
+                                  np.arange(5, 45, 3))
+
+
+@pytest.mark.parametrize('g2_page_size', [1, 3, 100])
+def test_ingest_paged_g2(tmp_path, g2_page_size):
+    import numpy as np
+    from xicam.XPCS.testing import write_synthetic_nxXPCS
+
+    path = write_synthetic_nxXPCS(tmp_path / 'paged.nxs', num_q=7, num_tau=16)
+
+    def g2_pages(docs):
+        descriptor = next(doc for name, doc in docs if name == 'descriptor' and doc['name'] == 'primary')
+        return [doc for name, doc in docs if name == 'event_page' and doc['descriptor'] == descriptor['uid']]
+
+    unpaged = g2_pages(list(ingest_nxXPCS([path], cache=None)))
+    paged = g2_pages(list(ingest_nxXPCS([path], cache=None, g2_page_size=g2_page_size)))
+    assert len(unpaged) == 1
+    assert [len(page['seq_num']) for page in paged] == [min(g2_page_size, 7 - start)
+                                                        for start in range(0, 7, g2_page_size)]
+    assert sum((page['seq_num'] for page in paged), []) == unpaged[0]['seq_num']
+    for field in ('g2_curves', 'g2_error_bars', 'g2_tau', 'g2_dqlist'):
+        np.testing.assert_array_equal(np.concatenate([page['data'][field] for page in paged]),
+                                      unpaged[0]['data'][field])
+
+
+def test_ingest_batch(tmp_path):
+    import numpy as np
+    from xicam.XPCS.ingestors.batch import ingest_nxXPCS_batch
+    from xicam.XPCS.testing import write_synthetic_nxXPCS
+
+    paths = [write_synthetic_nxXPCS(tmp_path / f'{i}.nxs', num_q=3 + i, seed=i) for i in range(3)]
+    paths.insert(1, tmp_path / 'missing.nxs')
+    report = ingest_nxXPCS_batch(paths, max_workers=2)
+
+    assert [result.path for result in report.results] == list(map(str, paths))
+    assert [result.ok for result in report.results] == [True, False, True, True]
+    assert report.files_per_second > 0 and report.megabytes_per_second > 0
+
+    for num_q, result in zip([3, 4, 5], report.results[:1] + report.results[2:]):
+        g2_page = next(doc for name, doc in result.documents if name == 'event_page')
+        assert len(g2_page['data']['g2_curves']) == num_q
+        saxs_2d = next(doc for name, doc in result.documents if name == 'event' and 'SAXS_2D' in doc['data'])
+        assert np.isfinite(saxs_2d['data']['SAXS_2D'].sum().compute())
+
+
+class _UnpicklableError(Exception):
+    def __init__(self, path, reason):
+        super().__init__(f"{path}: {reason}")
+
+
+def _failing_ingest(paths, **kwargs):
+    import os
+
+    path = Path(paths[0])
+    if path.stem == 'crash':
+        os._exit(1)
+    if path.stem == 'unpicklable':
+        raise _UnpicklableError(path, 'unreadable')
+    return [('start', {'path': str(path)})]
+
+
+def test_ingest_batch_worker_failures(tmp_path, monkeypatch):
+    import multiprocessing
+    from xicam.XPCS.ingestors import batch
+
+    monkeypatch.setattr(batch, 'ingest_nxXPCS', _failing_ingest)
+    paths = [tmp_path / f'{name}.nxs' for name in ('good', 'unpicklable')]
+    for path in paths:
+        path.write_bytes(b'')
+    context = multiprocessing.get_context('fork')
+
+    # An exception that can't be unpickled fails its own file only
+    report = batch.ingest_nxXPCS_batch(paths, max_workers=2, mp_context=context)
+    assert [result.ok for result in report.results] == [True, False]
+    # (tblib, if something installed its pickling support, makes the exception itself picklable)
+    assert 'unreadable' in str(report.results[1].error) and '_UnpicklableError' in report.results[1].traceback
+
+    # A dead worker fails the files that were pending, and each of them gets a result
+    paths.append(tmp_path / 'crash.nxs')
+    paths[-1].write_bytes(b'')
+    report = batch.ingest_nxXPCS_batch(paths, max_workers=2, mp_context=context)
+    assert [result.path for result in report.results] == list(map(str, paths))
+    assert not report.results[-1].ok and report.results[-1].traceback
+    assert type(report.results[-1].error).__name__ == 'BrokenProcessPool'
@@ -0,0 +1,58 @@
+import gc
+import os
+
+import numpy as np
+import pytest
+
+from xicam.XPCS.ingestors import ingest_nxXPCS
+from xicam.XPCS.ingestors.lazy import handle_pool, lazy_array
+from xicam.XPCS.testing import write_synthetic_nxXPCS
+
+
+def _open_fds():
+    return len(os.listdir('/proc/self/fd'))
+
+
+@pytest.fixture
+def nxs_path(tmp_path):
+    return write_synthetic_nxXPCS(tmp_path / 'synthetic.nxs', num_q=5, num_tau=16, detector_shape=(32, 32))
+
+
+def test_shared_handle(nxs_path):
+    first = list(ingest_nxXPCS([nxs_path]))
+    second = list(ingest_nxXPCS([nxs_path]))
+    assert len(handle_pool) == 1
+    assert handle_pool.refcount(nxs_path) == 4  # SAXS_2D and SAXS_1D_I_partial of both runs
+
+    del first
+    gc.collect()
+    assert handle_pool.refcount(nxs_path) == 2
+
+    del second
+    gc.collect()
+    assert len(handle_pool) == 0
+
+
+def test_chunks_match_layout(tmp_path):
+    import h5py
+    path = tmp_path / 'chunked.h5'
+    with h5py.File(path, 'w') as h5:
+        h5.create_dataset('data', data=np.arange(64 * 64 * 8).reshape(8, 64, 64), chunks=(1, 16, 64))
+
+    array = lazy_array(path, 'data')
+    for dim_chunks, disk_chunk in zip(array.chunks, (1, 16, 64)):
+        assert all(chunk % disk_chunk == 0 for chunk in dim_chunks[:-1])
+    assert int(array.sum().compute()) == int(np.arange(64 * 64 * 8).sum())
+
+
+@pytest.mark.skipif(not os.path.isdir('/proc/self/fd'), reason='requires /proc/self/fd')
+def test_no_descriptor_leak(nxs_path):
+    fds = _open_fds()
+    for _ in range(1000):
+        docs = list(ingest_nxXPCS([nxs_path]))
+        saxs_2d = next(doc for name, doc in docs if name == 'event' and 'SAXS_2D' in doc['data'])
+        saxs_2d['data']['SAXS_2D'].sum().compute()
+        del docs, saxs_2d
+    gc.collect()
+    assert len(handle_pool) == 0
+    assert _open_fds() <= fds
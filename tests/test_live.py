@@ -0,0 +1,155 @@
+from functools import partial
+
+import dask.array as da
+import h5py
+import numpy as np
+
+from xicam.XPCS.ingestors import g2_projection_key, g2_error_projection_key, dqlist_key, raw_data_projection_key, \
+                                 SAXS_1D_I_projection_key, SAXS_2D_I_projection_key, XPCS_roi_projection_key, \
+                                 ingest_nxXPCS
+from xicam.XPCS.ingestors import live
+from xicam.XPCS.ingestors.live import NxXPCSFollower, end_time_key, follow_nxXPCS, update_count_attribute
+from xicam.XPCS.projectors.nexus import project_nxXPCS
+from xicam.XPCS.testing import write_synthetic_nxXPCS
+
+
+def _append(path, num_q=0, num_frames=0):
+    with h5py.File(path, 'a') as h5:
+        for key in (g2_projection_key, g2_error_projection_key, dqlist_key):
+            dataset = h5[key]
+            dataset.resize(dataset.shape[1] + num_q, axis=1)
+            dataset[:, dataset.shape[1] - num_q:] = 1.1
+        raw = h5[raw_data_projection_key]
+        raw.resize(raw.shape[0] + num_frames, axis=0)
+        raw[raw.shape[0] - num_frames:] = 1
+
+
+def _pages(documents, descriptor_uids):
+    return [doc for name, doc in documents if name == 'event_page' and doc['descriptor'] in descriptor_uids]
+
+
+def _catalog_run(documents):
+    from databroker.in_memory import BlueskyInMemoryCatalog
+
+    stop = next((doc for name, doc in documents if name == 'stop'), None)
+    catalog = BlueskyInMemoryCatalog()
+    catalog.upsert(documents[0][1], stop, partial(iter, documents), [], {})
+    return catalog[documents[0][1]['uid']]
+
+
+def test_follow_growing_file(tmp_path):
+    path = write_synthetic_nxXPCS(tmp_path / 'live.nxs', num_q=5, num_tau=16, detector_shape=(8, 8), num_frames=3,
+                                  resizable=True)
+    follower = NxXPCSFollower(path, swmr=False)
+
+    documents = follower.poll()
+    descriptors = {doc['name']: doc['uid'] for name, doc in documents if name == 'descriptor'}
+    assert documents[0][0] == 'start'
+    assert len(_pages(documents, [descriptors['primary']])[0]['seq_num']) == 5
+    assert len(_pages(documents, [descriptors['raw']])[0]['seq_num']) == 3
+    assert follower.poll() == []
+
+    # Only the new q-bins and frames are emitted
+    _append(path, num_q=2, num_frames=4)
+    documents += (new_documents := follower.poll())
+    assert [doc['seq_num'] for doc in _pages(new_documents, [descriptors['primary']])] == [[6, 7]]
+    assert [list(doc['data']['raw_frame_index'])
+            for doc in _pages(new_documents, [descriptors['raw']])] == [[3, 4, 5, 6]]
+    assert not any(name in ('start', 'descriptor', 'stop') for name, _ in new_documents)
+
+    # The live run can be projected before it is finished
+    intents = project_nxXPCS(_catalog_run(documents))
+    assert next(intent for intent in intents if intent.name.startswith('g₂')).y.shape[0] == 7
+
+    # Updated snapshots are re-emitted and the projection shows the latest one
+    with h5py.File(path, 'a') as h5:
+        h5[SAXS_1D_I_projection_key][0] *= 2
+        h5[end_time_key] = '2026-01-01T00:00:00'
+    documents += (new_documents := follower.poll())
+    assert [name for name, _ in new_documents] == ['event', 'stop']
+    assert follower.finished and follower.poll() == []
+
+    run = _catalog_run(documents)
+    with h5py.File(path, 'r') as h5:
+        expected = h5[SAXS_1D_I_projection_key][0]
+    curve = next(intent for intent in project_nxXPCS(run) if intent.name.startswith('AVG SAXS'))
+    np.testing.assert_allclose(np.asarray(curve.y), expected)
+
+
+def test_follow_idle_timeout(tmp_path):
+    path = write_synthetic_nxXPCS(tmp_path / 'live.nxs', num_q=2, num_tau=4, detector_shape=(4, 4),
+                                  resizable=True)
+    documents = list(follow_nxXPCS([path], poll_interval=0.01, idle_timeout=0.05, swmr=False))
+    assert documents[0][0] == 'start'
+    assert documents[-1][0] == 'stop' and documents[-1][1]['exit_status'] == 'abort'
+
+
+def test_follow_lazy_frames_and_rois(tmp_path, monkeypatch):
+    path = write_synthetic_nxXPCS(tmp_path / 'live.nxs', num_q=5, num_tau=16, detector_shape=(32, 32), num_frames=10,
+                                  resizable=True, num_rois=3)
+    follower = NxXPCSFollower(path, raw_block_size=4, swmr=False, roi_statistics=True)
+    documents = follower.poll()
+    descriptors = {doc['name']: doc['uid'] for name, doc in documents if name == 'descriptor'}
+    assert 'rois' in descriptors and 'roi_statistics' not in descriptors
+
+    # Frames are read when computed, in pages of raw_block_size frames
+    pages = _pages(documents, [descriptors['raw']])
+    assert all(isinstance(page['data']['raw'], da.Array) for page in pages)
+    assert [len(page['seq_num']) for page in pages] == [4, 4, 2]
+    with h5py.File(path, 'r') as h5:
+        np.testing.assert_array_equal(np.concatenate([np.asarray(page['data']['raw']) for page in pages]),
+                                      h5[raw_data_projection_key][()])
+
+    # Large snapshots are only read again when their update count changes
+    monkeypatch.setattr(live, 'snapshot_compare_bytes', 0)
+    with h5py.File(path, 'a') as h5:
+        h5[SAXS_2D_I_projection_key][0] += 1
+    assert follower.poll() == []
+    with h5py.File(path, 'a') as h5:
+        h5[SAXS_2D_I_projection_key].attrs[update_count_attribute] = 1
+        h5[end_time_key] = '2026-01-01T00:00:00'
+    documents += (new_documents := follower.poll())
+    descriptors.update({doc['name']: doc['uid'] for name, doc in new_documents if name == 'descriptor'})
+    assert [doc['descriptor'] for name, doc in new_documents if name == 'event'] == [descriptors['SAXS_2D'],
+                                                                                     descriptors['roi_statistics']]
+
+    # The followed run carries the same ROI statistics as an ingested one
+    statistics = next(doc for name, doc in new_documents
+                      if name == 'event' and doc['descriptor'] == descriptors['roi_statistics'])
+    expected = next(doc for name, doc in ingest_nxXPCS([path], cache=None, roi_statistics=True)
+                    if name == 'event' and 'roi_mean_intensity' in doc['data'])
+    np.testing.assert_allclose(statistics['data']['roi_mean_intensity'], expected['data']['roi_mean_intensity'])
+
+
+def test_follow_rewritten_rois(tmp_path):
+    path = write_synthetic_nxXPCS(tmp_path / 'live.nxs', num_q=2, num_tau=4, detector_shape=(16, 16),
+                                  resizable=True, num_rois=3)
+    follower = NxXPCSFollower(path, swmr=False)
+    descriptors = {doc['name']: doc['uid'] for name, doc in follower.poll() if name == 'descriptor'}
+
+    # Rewritten ROIs are emitted again in the same stream, and used from then on
+    with h5py.File(path, 'a') as h5:
+        rois = h5[XPCS_roi_projection_key]
+        rois[...] = np.minimum(rois[()], 1)
+    documents = follower.poll()
+    assert [(name, doc['descriptor']) for name, doc in documents] == [('event', descriptors['rois'])]
+    assert documents[0][1]['data']['rois'].max() == 1
+    np.testing.assert_array_equal(follower._roi_labels, documents[0][1]['data']['rois'])
+    assert follower.poll() == []
+
+
+def test_follow_reshaped_snapshot(tmp_path, monkeypatch):
+    path = write_synthetic_nxXPCS(tmp_path / 'live.nxs', num_q=2, num_tau=4, detector_shape=(8, 8),
+                                  resizable=True)
+    follower = NxXPCSFollower(path, swmr=False)
+    follower.poll()
+    warnings = []
+    monkeypatch.setattr(live.msg, 'logMessage', lambda *args, **kwargs: warnings.append(args))
+
+    # A reshaped snapshot is not described twice; it is skipped with a single warning
+    with h5py.File(path, 'a') as h5:
+        del h5[SAXS_2D_I_projection_key]
+        h5[SAXS_2D_I_projection_key] = np.ones((4, 4))
+    assert follower.poll() == []
+    assert follower.poll() == []
+    assert len(warnings) == 1 and 'SAXS_2D' in warnings[0][0]
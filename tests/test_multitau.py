@@ -0,0 +1,42 @@
+import numpy as np
+import pytest
+
+from xicam.XPCS.correlation.multitau import multi_tau_correlation
+from xicam.XPCS.testing import synthetic_speckle
+
+
+@pytest.fixture(scope='module')
+def speckle():
+    return synthetic_speckle(num_frames=800, shape=(16, 16), correlation_time=10)
+
+
+def _direct_g2(frames, mask, lag):
+    current, past = frames[lag:, mask], frames[:len(frames) - lag, mask]
+    return (current * past).mean(axis=0).mean() / (past.mean(axis=0).mean() * current.mean(axis=0).mean())
+
+
+def test_multi_tau_matches_direct_correlation(speckle):
+    labels = np.zeros((16, 16), dtype=int)
+    labels[:8] = 1
+    labels[8:] = 2
+    g2, tau, g2_errors = multi_tau_correlation(speckle, labels, num_levels=4, num_bufs=8)
+
+    assert g2.shape == g2_errors.shape == (len(tau), 2)
+    assert list(tau[:9]) == [1, 2, 3, 4, 5, 6, 7, 8, 10]
+    for i, lag in enumerate(tau[:7]):
+        for roi in (1, 2):
+            assert g2[i, roi - 1] == pytest.approx(_direct_g2(speckle, labels == roi, lag))
+    assert np.all(g2_errors > 0)
+
+
+def test_multi_tau_block_size_independent(speckle):
+    labels = np.ones((16, 16), dtype=int)
+    reference = multi_tau_correlation(speckle, labels, block_size=len(speckle))
+    for block_size in (1, 7, 100):
+        for expected, actual in zip(reference, multi_tau_correlation(speckle, labels, block_size=block_size)):
+            np.testing.assert_allclose(actual, expected)
+
+
+def test_multi_tau_recovers_decay(speckle):
+    g2, tau, _ = multi_tau_correlation(speckle, np.ones((16, 16), dtype=int))
+    np.testing.assert_allclose(g2[:, 0], 1 + np.exp(-2 * tau / 10), atol=0.1)
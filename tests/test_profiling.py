@@ -0,0 +1,59 @@
+import json
+import logging
+
+import pytest
+
+from xicam.XPCS import profiling
+from xicam.XPCS.ingestors import ingest_nxXPCS
+from xicam.XPCS.projectors.nexus import clear_projection_cache, project_nxXPCS
+from xicam.XPCS.testing import load_run, write_synthetic_nxXPCS
+
+
+@pytest.fixture
+def profiled():
+    profiling.reset()
+    profiling.enable()
+    yield profiling
+    profiling.disable()
+    profiling.reset()
+
+
+def test_disabled_is_a_no_op():
+    assert not profiling.enabled
+    documents = [('start', {})]
+    assert profiling.trace_documents(documents, 'ingest') is documents
+    assert profiling.stage('a') is profiling.stage('b')
+    with profiling.stage('ingest'):
+        pass
+    assert profiling.summary() == {}
+
+
+def test_ingest_and_project_stages(tmp_path, profiled, caplog):
+    path = write_synthetic_nxXPCS(tmp_path / 'run.nxs', num_q=6, num_frames=8, detector_shape=(16, 16))
+    with caplog.at_level(logging.INFO, logger=profiling.logger.name):
+        run = load_run(path, cache=None)
+        clear_projection_cache()
+        project_nxXPCS(run)
+        clear_projection_cache()
+
+    summary = profiled.summary()
+    assert {'ingest.compose.start', 'ingest.compose.event_page', 'ingest.compose.stop', 'ingest.hdf5_read',
+            'ingest.dask_graph', 'project', 'project.to_dask', 'project.compute_g2'} <= set(summary)
+    # g2, g2 errors and dqlist are read whole: 2 * 6 * 64 + 6 float64 values
+    assert summary['ingest.hdf5_read']['hdf5_bytes'] >= (2 * 6 * 64 + 6) * 8
+    assert summary['project.compute_g2']['dask_computes'] >= 1
+    assert summary['project']['seconds'] >= summary['project.compute_g2']['seconds']
+
+    records = [json.loads(record.getMessage()) for record in caplog.records]
+    assert {'project', 'ingest.hdf5_read'} <= {record['stage'] for record in records}
+
+
+def test_chrome_trace(tmp_path, profiled):
+    path = write_synthetic_nxXPCS(tmp_path / 'run.nxs', num_q=3)
+    for _ in ingest_nxXPCS([path], cache=None):
+        pass
+    with open(profiled.write_chrome_trace(tmp_path / 'trace.json')) as f:
+        trace = json.load(f)
+    events = trace['traceEvents']
+    assert events and all(event['ph'] == 'X' and event['dur'] >= 0 for event in events)
+    assert [event['name'] for event in events][:2] == ['ingest.cache_lookup', 'ingest.compose.start']
@@ -0,0 +1,61 @@
+import threading
+from concurrent.futures import CancelledError
+
+import pytest
+
+from xicam.XPCS.intents import MultiErrorBarIntent
+from xicam.XPCS.projectors import nexus
+from xicam.XPCS.projectors.background import PendingIntent, submit_projection
+from xicam.XPCS.projectors.nexus import clear_projection_cache, iter_project_nxXPCS, project_nxXPCS
+from xicam.XPCS.testing import write_synthetic_nxXPCS, load_run
+
+
+@pytest.fixture
+def run(tmp_path):
+    clear_projection_cache()
+    yield load_run(write_synthetic_nxXPCS(tmp_path / 'run.nxs', num_q=6, num_frames=8, detector_shape=(16, 16)))
+    clear_projection_cache()
+
+
+def test_lazy_intents_first(run):
+    intents = list(iter_project_nxXPCS(run))
+    g2_index = next(i for i, intent in enumerate(intents) if isinstance(intent, MultiErrorBarIntent))
+    assert g2_index == len(intents) - 1
+    assert project_nxXPCS(run) == intents
+
+
+def test_background_projection(run):
+    streamed, done = [], threading.Event()
+    job = submit_projection(run, on_intent=lambda job, intent: streamed.append(intent),
+                            on_done=lambda job: done.set())
+    assert isinstance(job.placeholder, PendingIntent) and not job.placeholder.curve_names
+
+    intents = job.result(timeout=60)
+    assert done.wait(timeout=60)
+    assert streamed == intents == job.intents
+    assert [intent.name for intent in intents] == [intent.name for intent in project_nxXPCS(run)]
+    assert 0 < job.time_to_first_intent <= job.duration
+    assert job.exception() is None and not job.cancelled
+
+
+def test_cancel_projection(run):
+    release, done = threading.Event(), threading.Event()
+
+    def slow_projector(run_catalog):
+        for i, intent in enumerate(iter_project_nxXPCS(run_catalog)):
+            if i == 1:
+                release.wait(timeout=60)
+            yield intent
+
+    job = submit_projection(run, projector=slow_projector, on_done=lambda job: done.set())
+    assert job.cancel()
+    release.set()
+
+    assert done.wait(timeout=60)
+    assert job.cancelled
+    assert isinstance(job.exception(), CancelledError)
+    with pytest.raises(CancelledError):
+        job.result()
+    assert len(job.intents) <= 1
+    # An interrupted projection is not memoized
+    assert not nexus._projection_cache
@@ -0,0 +1,51 @@
+import pytest
+
+from xicam.XPCS.projectors import nexus
+from xicam.XPCS.projectors.nexus import project_nxXPCS, clear_projection_cache
+from xicam.XPCS.testing import write_synthetic_nxXPCS, load_run
+
+
+@pytest.fixture
+def run(tmp_path):
+    clear_projection_cache()
+    yield load_run(write_synthetic_nxXPCS(tmp_path / 'run.nxs', num_q=6, num_frames=8, detector_shape=(16, 16)))
+    clear_projection_cache()
+
+
+def test_project_nexus_memoized(run, monkeypatch):
+    conversions = []
+    run_type = type(run.primary)
+    to_dask = run_type.to_dask
+
+    def counting_to_dask(self):
+        conversions.append(self.name)
+        return to_dask(self)
+
+    monkeypatch.setattr(run_type, 'to_dask', counting_to_dask)
+
+    intents = project_nxXPCS(run)
+    assert sorted(conversions) == sorted(['primary', 'SAXS_2D', 'SAXS_1D', 'SAXS_1D_I_partial', 'raw'])
+
+    assert project_nxXPCS(run) == intents
+    assert len(conversions) == 5
+
+
+def test_projection_cache_lru(tmp_path, monkeypatch):
+    clear_projection_cache()
+    monkeypatch.setattr(nexus, 'projection_cache_size', 2)
+    runs = [load_run(write_synthetic_nxXPCS(tmp_path / f'{i}.nxs', num_q=2, seed=i)) for i in range(3)]
+    for run in runs:
+        project_nxXPCS(run)
+    assert [key[0] for key in nexus._projection_cache] == [run.metadata['start']['uid'] for run in runs[1:]]
+    clear_projection_cache()
+
+
+def test_project_g2_single_intent(run):
+    from xicam.XPCS.intents import MultiErrorBarIntent
+
+    g2_intents = [intent for intent in project_nxXPCS(run) if isinstance(intent, MultiErrorBarIntent)]
+    assert len(g2_intents) == 1
+    g2 = g2_intents[0]
+    assert g2.y.shape == (6, 64) and g2.height.shape == (6, 64) and g2.x.shape == (64,)
+    assert g2.curve_names[0] == 'q=0.001'
+    assert g2.visible.all()
@@ -0,0 +1,95 @@
+import gc
+import os
+
+import numpy as np
+import pytest
+
+from xicam.XPCS.intents import PyramidImageIntent
+from xicam.XPCS.projectors.nexus import project_nxXPCS
+from xicam.XPCS.reduction.pyramid import ImagePyramid, PyramidCache
+from xicam.XPCS.testing import write_synthetic_nxXPCS, load_run
+
+
+@pytest.fixture
+def frames():
+    return np.random.default_rng(0).poisson(10, size=(40, 64, 66)).astype(np.uint16)
+
+
+@pytest.mark.parametrize('reduction', ['mean', 'max'])
+def test_pyramid_levels(frames, reduction):
+    pyramid = ImagePyramid(frames, reduction=reduction, frames_per_block=16)
+    assert [level.shape for level in pyramid.levels] == [(40, 64, 66), (40, 32, 33), (40, 16, 16), (40, 8, 8)]
+
+    cells = frames[:, :64, :64].reshape(40, 8, 8, 8, 8)
+    expected = cells.mean(axis=(2, 4)) if reduction == 'mean' else cells.max(axis=(2, 4))
+    np.testing.assert_allclose(pyramid.levels[3].compute(), expected, rtol=1e-6)
+    np.testing.assert_allclose(pyramid.levels[3][5].compute(), expected[5], rtol=1e-6)
+
+    image = ImagePyramid(frames[0], reduction=reduction)
+    np.testing.assert_allclose(image.levels[3].compute(), expected[0], rtol=1e-6)
+
+
+def test_pyramid_disk_cache(frames, tmp_path):
+    pyramid = ImagePyramid(frames, path=tmp_path / 'pyramid.h5', frames_per_block=16)
+    first_block = pyramid.levels[2][:16].compute()
+    pyramid.close()
+
+    # Cached blocks are served without touching the source; others still need it
+    reopened = ImagePyramid(frames, path=tmp_path / 'pyramid.h5', frames_per_block=16)
+    reopened._read_source = None
+    np.testing.assert_array_equal(reopened.levels[2][:16].compute(), first_block)
+    np.testing.assert_array_equal(reopened.levels[1][:16].compute(), pyramid.levels[1][:16].compute())
+    with pytest.raises(TypeError):
+        reopened.levels[1][16:].compute()
+    reopened.close()
+
+
+def test_pyramid_cache_evicts_on_write(frames, tmp_path):
+    cache = PyramidCache(directory=tmp_path / 'pyramids')
+    first, second = (cache.path('run', field) for field in ('SAXS_2D', 'raw'))
+    # Looking up paths touches nothing on disk
+    assert not cache.directory.exists()
+
+    pyramid = ImagePyramid(frames, path=first, frames_per_block=16, cache=cache)
+    pyramid.levels[1][:16].compute()
+    pyramid.close()
+    os.utime(first, (0, 0))
+
+    # Creating the next file trims the cache to the size of the first one
+    cache.max_bytes = cache.nbytes
+    pyramid = ImagePyramid(frames, path=second, frames_per_block=16, cache=cache)
+    pyramid.levels[1][:16].compute()
+    pyramid.close()
+    assert cache.entries() == [second]
+
+
+def test_pyramid_file_released(frames, tmp_path):
+    cache = PyramidCache(directory=tmp_path / 'pyramids')
+    pyramid = ImagePyramid(frames, path=cache.path('run', 'raw'), frames_per_block=16, cache=cache)
+    pyramid.levels[1][:16].compute()
+    # Files in use are never evicted
+    cache.max_bytes = 0
+    cache.evict()
+    assert cache.entries() == [pyramid.path]
+
+    # Dropping the pyramid without close() closes its file
+    path = pyramid.path
+    del pyramid
+    gc.collect()
+    assert not cache.open_files
+    cache.evict()
+    assert not path.exists()
+
+
+def test_level_for_scale(frames):
+    pyramid = ImagePyramid(frames)
+    assert [pyramid.level_for_scale(scale) for scale in (0.25, 1, 1.9, 2, 5, 100)] == [0, 0, 0, 1, 2, 3]
+
+
+def test_project_image_pyramids(tmp_path):
+    run = load_run(write_synthetic_nxXPCS(tmp_path / 'pyramid.nxs', detector_shape=(64, 64), num_frames=4))
+    images = [intent for intent in project_nxXPCS(run) if isinstance(intent, PyramidImageIntent)]
+    assert len(images) == 2
+    for intent in images:
+        assert intent.pyramid.levels[-1].shape[-2:] == (8, 8)
+        assert np.isfinite(intent.pyramid.levels[-1].compute()).all()
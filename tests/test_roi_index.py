@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+
+from xicam.XPCS.reduction.index import QROIIndex, clear_index_cache, geometry_index, roi_index
+
+
+@pytest.fixture
+def labels():
+    rng = np.random.default_rng(0)
+    return rng.integers(0, 6, size=(20, 30))
+
+
+def test_index_reductions_match_masks(labels):
+    frames = np.random.default_rng(1).poisson(50, size=(4, 20, 30))
+    index = QROIIndex.from_labels(labels)
+
+    assert list(index.labels) == [1, 2, 3, 4, 5]
+    np.testing.assert_array_equal(index.label_array(), labels)
+    for i, label in enumerate(index.labels):
+        mask = labels == label
+        assert index.sizes[i] == mask.sum()
+        np.testing.assert_allclose(index.sum(frames)[:, i], frames[:, mask].sum(axis=1))
+        np.testing.assert_allclose(index.mean(frames)[:, i], frames[:, mask].mean(axis=1))
+        np.testing.assert_allclose(index.variance(frames)[:, i], frames[:, mask].var(axis=1))
+        # A single frame reduces to one value per bin
+        assert index.mean(frames[0])[i] == pytest.approx(frames[0][mask].mean())
+
+
+def test_index_from_qmap():
+    qmap = np.tile(np.linspace(0, 1, 11), (3, 1))
+    mask = np.zeros_like(qmap, dtype=bool)
+    mask[0] = True
+    index = QROIIndex.from_qmap(qmap, bins=[0, 0.5, 1], mask=mask)
+
+    assert list(index.sizes) == [10, 12]
+    np.testing.assert_allclose(index.q, [0.2, 0.75])
+
+
+def test_index_cache(labels):
+    clear_index_cache()
+    assert roi_index(labels) is roi_index(labels.copy())
+    assert roi_index(labels) is not roi_index(labels + 1)
+
+
+def test_geometry_index_cache():
+    from pyFAI.azimuthalIntegrator import AzimuthalIntegrator
+
+    clear_index_cache()
+    geometry = AzimuthalIntegrator(dist=1, poni1=0.005, poni2=0.005, pixel1=1e-4, pixel2=1e-4, wavelength=1e-10)
+    index = geometry_index(geometry, (100, 100), bins=20)
+    assert index is geometry_index(geometry, (100, 100), bins=20)
+    assert index.num_bins == 20 and index.sizes.sum() == 100 * 100
+    assert np.all(np.diff(index.q) > 0)
+
+    geometry.dist = 2
+    assert geometry_index(geometry, (100, 100), bins=20) is not index
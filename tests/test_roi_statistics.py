@@ -0,0 +1,93 @@
+import numpy as np
+import pytest
+from xicam.core.intents import ImageIntent
+
+from xicam.XPCS.ingestors import ingest_nxXPCS
+from xicam.XPCS.projectors.nexus import clear_projection_cache, project_nxXPCS
+from xicam.XPCS.reduction.index import QROIIndex
+from xicam.XPCS.reduction.statistics import compact_labels, roi_labels, roi_statistics
+from xicam.XPCS.sparse import SparseFrames
+from xicam.XPCS.testing import write_synthetic_nxXPCS, load_run, synthetic_speckle
+
+
+@pytest.fixture(scope='module')
+def labels():
+    yy, xx = np.indices((32, 32))
+    return np.digitize(np.hypot(yy - 16, xx - 16), [4, 8, 12, 16])
+
+
+def test_roi_labels():
+    stack = np.zeros((2, 4, 4), dtype=bool)
+    stack[0, :2] = stack[1, 1:3] = True
+    mask = np.ones((4, 4))
+    mask[:, 0] = 0
+    labels = roi_labels(stack, mask)
+    assert labels.dtype == np.uint8
+    assert labels[:, 1].tolist() == [1, 1, 2, 0]
+    assert not labels[:, 0].any()
+    assert compact_labels(np.full(3, 300)).dtype == np.uint16
+
+
+@pytest.mark.parametrize('block_size, max_workers', [(200, 1), (7, 3)])
+def test_roi_statistics(labels, block_size, max_workers):
+    frames = synthetic_speckle(num_frames=200, shape=(32, 32), correlation_time=2.)
+    index = QROIIndex.from_labels(labels)
+    stats = roi_statistics(frames, index, block_size=block_size, max_workers=max_workers)
+
+    assert stats.pixel_count.tolist() == [(labels == label).sum() for label in index.labels]
+    np.testing.assert_allclose(stats.mean_intensity,
+                               np.stack([frames[:, labels == label].mean(axis=1) for label in index.labels], axis=1))
+    # Fully developed speckle has unit contrast (less the Poisson term, as the intensities are not counts)
+    np.testing.assert_allclose(stats.contrast, 1 - 1 / 100, atol=.1)
+
+
+def test_roi_statistics_sparse(labels):
+    frames = np.random.default_rng(0).poisson(.5, size=(20, 32, 32))
+    index = QROIIndex.from_labels(labels)
+    dense = roi_statistics(frames, index, block_size=8)
+    sparse = roi_statistics(SparseFrames.from_dense(frames), index, block_size=8)
+    np.testing.assert_allclose(sparse.mean_intensity, dense.mean_intensity)
+    np.testing.assert_allclose(sparse.contrast, dense.contrast)
+
+
+def test_ingest_and_project_rois(tmp_path):
+    path = write_synthetic_nxXPCS(tmp_path / 'rois.nxs', num_q=4, num_frames=12, detector_shape=(32, 32), num_rois=4)
+    documents = list(ingest_nxXPCS([path], cache=None, roi_statistics=True))
+    descriptors = {doc['name']: doc for name, doc in documents if name == 'descriptor'}
+    assert {'rois', 'roi_statistics'} <= set(descriptors)
+    # The label arrays are emitted once, not with every frame
+    rois_events = [doc for name, doc in documents
+                   if name == 'event' and doc['descriptor'] == descriptors['rois']['uid']]
+    assert len(rois_events) == 1
+    assert rois_events[0]['data']['rois'].dtype == np.uint8
+    statistics = next(doc for name, doc in documents
+                      if name == 'event' and doc['descriptor'] == descriptors['roi_statistics']['uid'])
+    assert statistics['data']['roi_mean_intensity'].shape == (12, len(statistics['data']['roi_labels']))
+
+    clear_projection_cache()
+    intents = project_nxXPCS(load_run(path, cache=None, roi_statistics=True))
+    names = [intent.name.split(' rois')[0] for intent in intents]
+    assert {'Mask', 'ROIs', 'ROI pixel count', 'ROI intensity', 'ROI speckle contrast'} <= set(names)
+    rois = next(intent for intent in intents if intent.name.startswith('ROIs'))
+    assert isinstance(rois, ImageIntent)
+    clear_projection_cache()
+
+    # Without raw frames the statistics come from SAXS_2D and have no contrast
+    path = write_synthetic_nxXPCS(tmp_path / 'no_frames.nxs', num_q=4, detector_shape=(32, 32), num_rois=4)
+    intents = project_nxXPCS(load_run(path, cache=None, roi_statistics=True))
+    assert any(intent.name.startswith('ROI intensity') for intent in intents)
+    assert not any(intent.name.startswith('ROI speckle contrast') for intent in intents)
+    clear_projection_cache()
+
+
+def test_roi_statistics_follow_frame_range(tmp_path):
+    path = write_synthetic_nxXPCS(tmp_path / 'rois.nxs', num_q=4, num_frames=12, detector_shape=(32, 32), num_rois=4)
+    # By default only the label arrays are ingested, without reading the frames
+    names = [doc['name'] for name, doc in ingest_nxXPCS([path], cache=None) if name == 'descriptor']
+    assert 'rois' in names and 'roi_statistics' not in names
+
+    documents = list(ingest_nxXPCS([path], cache=None, roi_statistics=True, raw_frame_range=(2, 10),
+                                   raw_frame_stride=2))
+    descriptor = next(doc for name, doc in documents if name == 'descriptor' and doc['name'] == 'roi_statistics')
+    statistics = next(doc for name, doc in documents if name == 'event' and doc['descriptor'] == descriptor['uid'])
+    assert statistics['data']['roi_mean_intensity'].shape[0] == 4
@@ -0,0 +1,101 @@
+import numpy as np
+import pytest
+
+from xicam.XPCS.correlation.multitau import multi_tau_correlation
+from xicam.XPCS.correlation.twotime import two_time_correlation
+from xicam.XPCS.ingestors import ingest_nxXPCS
+from xicam.XPCS.projectors.nexus import clear_projection_cache, project_nxXPCS
+from xicam.XPCS.reduction.frames import reduce_frames
+from xicam.XPCS.reduction.index import QROIIndex
+from xicam.XPCS.reduction.screening import robust_zscore, screen_frames
+from xicam.XPCS.sparse import SparseFrames
+from xicam.XPCS.testing import write_synthetic_nxXPCS, load_run, synthetic_speckle
+
+
+@pytest.fixture(scope='module')
+def index():
+    yy, xx = np.indices((32, 32))
+    return QROIIndex.from_labels(np.digitize(np.hypot(yy - 16, xx - 16), [2, 6, 10, 14]))
+
+
+@pytest.fixture(scope='module')
+def frames():
+    # Poisson frames around a ring pattern, with a beam spike, a beam dump and a sample shift
+    yy, xx = np.indices((32, 32))
+    pattern = 100 / (1 + np.hypot(yy - 16, xx - 16)) + 5
+    frames = np.random.default_rng(0).poisson(pattern, size=(200, 32, 32)).astype(np.float64)
+    frames[50] *= 10
+    frames[120] = 0
+    frames[150] = np.roll(frames[150], 6, axis=1)
+    return frames
+
+
+def test_robust_zscore():
+    z = robust_zscore(np.array([1., 2., 3., 4., 100.]))
+    assert z[-1] > 10 and abs(z[2]) < 1e-12
+    assert robust_zscore(np.array([1., 1., 1., 2.])).tolist() == [0, 0, 0, np.inf]
+
+
+@pytest.mark.parametrize('block_size', [200, 16])
+def test_screen_frames(frames, index, block_size):
+    screen = screen_frames(frames, index, block_size=block_size)
+    assert np.flatnonzero(screen.outliers).tolist() == [50, 120, 150]
+    assert screen.roi_mean.shape == (200, index.num_bins)
+    np.testing.assert_allclose(screen.total_intensity, frames.sum(axis=(1, 2)))
+    assert screen.similarity[150] < np.nanmedian(screen.similarity)
+    # Rethresholding reuses the statistics
+    assert screen.rethreshold(1e9).outliers.tolist() == [False] * 120 + [True] + [False] * 79
+
+    sparse_screen = screen_frames(SparseFrames.from_dense(frames), index, block_size=block_size)
+    np.testing.assert_allclose(sparse_screen.similarity, screen.similarity, equal_nan=True)
+    assert (sparse_screen.outliers == screen.outliers).all()
+
+
+def test_masked_reduction(frames, index):
+    keep = screen_frames(frames, index).keep
+    reduction = reduce_frames(frames, index, num_partitions=4, block_size=16, frame_mask=keep)
+    np.testing.assert_allclose(reduction.mean_image, frames[keep].mean(axis=0))
+    assert reduction.num_frames == 197
+    sparse_reduction = reduce_frames(SparseFrames.from_dense(frames), index, num_partitions=4, block_size=16,
+                                     frame_mask=keep)
+    np.testing.assert_allclose(sparse_reduction.I_partial, reduction.I_partial)
+
+
+def test_masked_correlation():
+    frames = synthetic_speckle(num_frames=512, shape=(16, 16), correlation_time=5.)
+    labels = np.ones((16, 16), dtype=int)
+    clean, tau, _ = multi_tau_correlation(frames, labels, num_levels=4, block_size=64)
+
+    corrupted = frames.copy()
+    corrupted[100] *= 50
+    keep = np.ones(512, dtype=bool)
+    keep[100] = False
+    bad, _, _ = multi_tau_correlation(corrupted, labels, num_levels=4, block_size=64)
+    masked, masked_tau, _ = multi_tau_correlation(corrupted, labels, num_levels=4, block_size=64, frame_mask=keep)
+    assert np.array_equal(masked_tau, tau)
+    assert np.abs(masked - clean).max() < np.abs(bad - clean).max() / 5
+    # An all-True mask changes nothing
+    unmasked, _, _ = multi_tau_correlation(frames, labels, num_levels=4, block_size=64,
+                                           frame_mask=np.ones(512, dtype=bool))
+    np.testing.assert_allclose(unmasked, clean)
+
+    two_time, intensity = two_time_correlation(corrupted[:64], labels, tile_size=16, frame_mask=keep[:64])
+    assert np.isfinite(two_time).all() and np.isfinite(intensity).all()
+    two_time, intensity = two_time_correlation(corrupted[64:128], labels, tile_size=16, frame_mask=keep[64:128])
+    assert np.isnan(two_time[0, 36]).all() and np.isnan(two_time[0, :, 36]).all() and np.isnan(intensity[0, 36])
+
+
+def test_ingest_frame_screening(tmp_path):
+    path = write_synthetic_nxXPCS(tmp_path / 'screen.nxs', num_q=4, num_frames=40, detector_shape=(32, 32),
+                                  num_rois=3)
+    documents = list(ingest_nxXPCS([path], cache=None, frame_screening=True))
+    descriptor = next(doc for name, doc in documents if name == 'descriptor' and doc['name'] == 'frame_screening')
+    event = next(doc for name, doc in documents if name == 'event' and doc['descriptor'] == descriptor['uid'])
+    assert event['data']['frame_total_intensity'].shape == (40,)
+    assert not event['data']['frame_outlier'].any()
+
+    clear_projection_cache()
+    intents = project_nxXPCS(load_run(path, cache=None, frame_screening=True))
+    assert any(intent.name.startswith('Frame intensity') for intent in intents)
+    assert any(intent.name.startswith('Frame similarity') for intent in intents)
+    clear_projection_cache()
@@ -0,0 +1,50 @@
+import dask.array as da
+import numpy as np
+import pytest
+
+from xicam.XPCS.intents import MultiErrorBarIntent
+from xicam.XPCS.projectors.series import match_q, project_nxXPCS_series, project_series
+from xicam.XPCS.testing import write_synthetic_nxXPCS, load_run
+
+
+@pytest.fixture
+def runs(tmp_path):
+    # The last run has twice as many q-bins (every other one on the grid of the others) and a coarser tau
+    shapes = [dict(num_q=6), dict(num_q=6, seed=1), dict(num_q=11, num_tau=32, seed=2)]
+    return [load_run(write_synthetic_nxXPCS(tmp_path / f'{i}.nxs', **shape), cache=None)
+            for i, shape in enumerate(shapes)]
+
+
+def test_match_q():
+    assert match_q([1., 2., 3.], [1.01, 2.5, 3.]).tolist() == [0, -1, 2]
+    assert match_q([], [1.]).tolist() == [-1]
+
+
+def test_series_alignment(runs):
+    series = project_series(runs)
+    assert isinstance(series.g2.data, da.Array)
+    assert series.g2.dims == ('run', 'q', 'tau')
+    assert series.g2.shape == (3, 6, 64)
+
+    series = series.compute()
+    g2 = series.g2.values
+    assert np.isfinite(g2[:2]).all()
+    # The third run covers every q of the grid with its even q-bins, interpolated onto the tau of the grid
+    assert np.isfinite(g2[2]).all()
+    assert np.allclose(g2[0], g2[1], atol=1e-2)
+    assert np.allclose(g2[2], g2[0], atol=2e-2)
+    assert series.stability.shape == (3,) and np.isfinite(series.stability.values).all()
+
+
+def test_series_fit_and_intents(runs):
+    series = project_series(runs[:2]).compute()
+    fit = series.fit('single')
+    assert fit['relaxation_rate'].dims == ('run', 'q')
+    # Same relaxation rates 1e3 q² in both synthetic runs; the slowest curves barely decay within tau
+    assert np.allclose(fit['relaxation_rate'].values[:, 2:], 1e3 * series.q[2:] ** 2, rtol=.05)
+
+    intents = project_nxXPCS_series(runs[:2], model='single')
+    g2_intent = intents[0]
+    assert isinstance(g2_intent, MultiErrorBarIntent)
+    assert g2_intent.y.shape == (2, len(series.tau))
+    assert len(intents) == 3
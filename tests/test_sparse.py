@@ -0,0 +1,86 @@
+import h5py
+import numpy as np
+import pytest
+
+from xicam.XPCS.correlation.multitau import multi_tau_correlation
+from xicam.XPCS.correlation.twotime import two_time_correlation
+from xicam.XPCS.ingestors import ingest_nxXPCS, raw_data_projection_key, raw_sparse_projection_key
+from xicam.XPCS.ingestors.convert import convert_nxXPCS
+from xicam.XPCS.reduction.frames import reduce_frames
+from xicam.XPCS.reduction.index import roi_index
+from xicam.XPCS.sparse import SparseFrames, write_sparse_hdf5
+from xicam.XPCS.testing import synthetic_speckle, write_synthetic_nxXPCS
+
+
+@pytest.fixture(scope='module')
+def photons():
+    # About 0.05 photons per pixel per frame
+    speckle = synthetic_speckle(num_frames=300, shape=(16, 16), correlation_time=8, intensity=.05)
+    return np.random.default_rng(0).poisson(speckle).astype(np.uint16)
+
+
+def _labels():
+    labels = np.zeros((16, 16), dtype=int)
+    labels[:8] = 1
+    labels[8:, 4:] = 2
+    return labels
+
+
+def test_round_trip(photons):
+    frames = SparseFrames.from_dense(photons, block_size=64)
+    assert frames.shape == photons.shape and frames.dtype == photons.dtype
+    assert frames.density < .1 and frames.nbytes < photons.nbytes
+    np.testing.assert_array_equal(frames.to_dense(), photons)
+    np.testing.assert_array_equal(frames[7], photons[7])
+    np.testing.assert_array_equal(frames[-1, 2:5], photons[-1, 2:5])
+    np.testing.assert_array_equal(frames[10:40:3, :, 3], photons[10:40:3, :, 3])
+    np.testing.assert_array_equal(frames[[3, 1]], photons[[3, 1]])
+    np.testing.assert_array_equal(frames.frames(5, 50, 5).to_dense(), photons[5:50:5])
+    np.testing.assert_array_equal(frames.sum(axis=0), photons.sum(axis=0))
+    np.testing.assert_array_equal(frames.to_dask(frames_per_chunk=32)[100:140].compute(), photons[100:140])
+
+
+def test_multi_tau_matches_dense(photons):
+    dense = multi_tau_correlation(photons, _labels(), num_levels=5, num_bufs=8, block_size=50)
+    sparse = multi_tau_correlation(SparseFrames.from_dense(photons), _labels(), num_levels=5, num_bufs=8,
+                                   block_size=50)
+    for dense_result, sparse_result in zip(dense, sparse):
+        np.testing.assert_allclose(sparse_result, dense_result)
+
+
+def test_two_time_matches_dense(photons):
+    dense, dense_intensity = two_time_correlation(photons[:100], _labels(), tile_size=32, max_workers=2)
+    sparse, sparse_intensity = two_time_correlation(SparseFrames.from_dense(photons[:100]), _labels(), tile_size=32,
+                                                    max_workers=2)
+    np.testing.assert_allclose(sparse, dense)
+    np.testing.assert_allclose(sparse_intensity, dense_intensity)
+
+
+def test_reduction_matches_dense(photons):
+    index = roi_index(_labels())
+    dense = reduce_frames(photons, index, num_partitions=4, block_size=64, max_workers=2)
+    sparse = reduce_frames(SparseFrames.from_dense(photons), index, num_partitions=4, block_size=64, max_workers=2)
+    np.testing.assert_allclose(sparse.mean_image, dense.mean_image)
+    np.testing.assert_allclose(sparse.I_partial, dense.I_partial)
+
+
+def test_hdf5_layout(tmp_path, photons):
+    with h5py.File(tmp_path / 'sparse.h5', 'w') as h5:
+        write_sparse_hdf5(h5.create_group('frames'), photons, block_size=64, compression='gzip')
+    frames = SparseFrames.from_hdf5(tmp_path / 'sparse.h5', 'frames')
+    np.testing.assert_array_equal(frames[50:60], photons[50:60])
+    g2, _, _ = multi_tau_correlation(frames, _labels(), num_levels=3, num_bufs=8)
+    assert np.all(np.isfinite(g2))
+
+
+def test_ingest_sparse_layout(tmp_path):
+    path = write_synthetic_nxXPCS(tmp_path / 'run.nxs', num_q=3, num_frames=20, detector_shape=(16, 16))
+    converted = convert_nxXPCS(path, output=tmp_path / 'sparse.h5', sparse_raw=True)
+    with h5py.File(converted, 'r') as h5, h5py.File(path, 'r') as source:
+        assert raw_data_projection_key not in h5 and raw_sparse_projection_key in h5
+        frames = source[raw_data_projection_key][()]
+
+    documents = list(ingest_nxXPCS([converted], raw_block_size=8, cache=None))
+    pages = [doc for name, doc in documents if name == 'event_page' and 'raw' in doc['data']]
+    assert [len(page['seq_num']) for page in pages] == [8, 8, 4]
+    np.testing.assert_array_equal(np.concatenate([np.asarray(page['data']['raw']) for page in pages]), frames)
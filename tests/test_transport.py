@@ -0,0 +1,84 @@
+import gc
+import pickle
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pytest
+
+from xicam.XPCS import transport
+from xicam.XPCS.transport import SharedArray
+
+
+@pytest.fixture(params=['shared_memory', 'memmap'])
+def backend(request, tmp_path, monkeypatch):
+    monkeypatch.setattr(transport, 'memmap_directory', str(tmp_path / 'shared'))
+    return request.param
+
+
+def _make_shared(shape, backend):
+    shared = SharedArray.empty(shape, dtype=np.float32, backend=backend)
+    shared[:] = np.arange(np.prod(shape), dtype=np.float32).reshape(shape)
+    return shared.handoff()
+
+
+def test_worker_handoff(backend):
+    with ProcessPoolExecutor(max_workers=1) as executor:
+        shared = executor.submit(_make_shared, (4, 64, 64), backend).result()
+    # The worker has exited; the block now belongs to this process
+    assert shared.owner
+    np.testing.assert_array_equal(shared.array, np.arange(4 * 64 * 64, dtype=np.float32).reshape(4, 64, 64))
+
+    image = shared.to_dask(chunks=(1, 64, 64))
+    # Tasks see views of the buffer (compute() itself returns a copy)
+    views = image.map_blocks(lambda block: np.full((1, 1, 1), np.shares_memory(block, shared.array)),
+                             chunks=(1, 1, 1), dtype=bool)
+    assert views.compute().all()
+    np.testing.assert_array_equal(image.compute(), shared.array)
+
+    descriptor = shared.descriptor
+    shared.close()
+    assert shared.closed
+    with pytest.raises(FileNotFoundError):
+        SharedArray.attach(descriptor)
+
+
+def test_pickle_without_handoff_does_not_transfer(backend):
+    shared = SharedArray.from_array(np.ones((8, 8)), backend=backend)
+    copy = pickle.loads(pickle.dumps(shared))
+    assert shared.owner and not copy.owner
+    copy[0, 0] = 5
+    assert shared[0, 0] == 5
+
+    descriptor = shared.descriptor
+    del copy, shared
+    gc.collect()
+    with pytest.raises(FileNotFoundError):
+        SharedArray.attach(descriptor)
+
+
+def test_batch_through_shared_memory(tmp_path):
+    from xicam.XPCS.ingestors.batch import ingest_nxXPCS_batch
+    from xicam.XPCS.testing import write_synthetic_nxXPCS
+
+    paths = [write_synthetic_nxXPCS(tmp_path / f'{i}.nxs', num_q=50, seed=i) for i in range(2)]
+    report = ingest_nxXPCS_batch(paths, max_workers=2, share_min_bytes=1024, cache=None)
+    plain = ingest_nxXPCS_batch(paths, max_workers=1, cache=None)
+    for shared, result in zip(report.results, plain.results):
+        g2_page = next(doc for name, doc in shared.documents if name == 'event_page' and 'g2_curves' in doc['data'])
+        expected = next(doc for name, doc in result.documents if name == 'event_page' and 'g2_curves' in doc['data'])
+        assert g2_page['data']['g2_curves'].name.startswith('shared-')
+        np.testing.assert_array_equal(g2_page['data']['g2_curves'].compute(), expected['data']['g2_curves'])
+
+
+def test_shared_two_time_output():
+    from xicam.XPCS.correlation.twotime import create_two_time_output, two_time_correlation
+    from xicam.XPCS.testing import synthetic_speckle
+
+    frames = synthetic_speckle(num_frames=40, shape=(8, 8))
+    labels = np.ones((8, 8), dtype=int)
+    out = create_two_time_output(1, 40, shared=True)
+    assert isinstance(out, SharedArray)
+    out, _ = two_time_correlation(frames, labels, tile_size=16, out=out)
+    expected, _ = two_time_correlation(frames, labels, tile_size=16)
+    np.testing.assert_allclose(out.array, expected)
+    out.close()
@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+
+from xicam.XPCS.correlation.twotime import create_two_time_output, two_time_correlation, two_time_preview
+from xicam.XPCS.testing import synthetic_speckle
+
+
+@pytest.fixture(scope='module')
+def speckle():
+    return synthetic_speckle(num_frames=100, shape=(8, 8), correlation_time=5)
+
+
+def _labels():
+    labels = np.zeros((8, 8), dtype=int)
+    labels[:4] = 1
+    labels[4:] = 2
+    return labels
+
+
+def _direct_two_time(frames, mask):
+    pixels = frames[:, mask]
+    means = pixels.mean(axis=1)
+    return pixels @ pixels.T / mask.sum() / np.outer(means, means)
+
+
+@pytest.mark.parametrize('tile_size', [7, 32, 100])
+def test_two_time_matches_direct(speckle, tile_size):
+    labels = _labels()
+    two_time, roi_intensity = two_time_correlation(speckle, labels, tile_size=tile_size, max_workers=2)
+
+    assert two_time.shape == (2, 100, 100)
+    for roi in (1, 2):
+        np.testing.assert_allclose(two_time[roi - 1], _direct_two_time(speckle, labels == roi), rtol=1e-5)
+        np.testing.assert_allclose(roi_intensity[roi - 1], speckle[:, labels == roi].mean(axis=1))
+
+
+@pytest.mark.parametrize('suffix', ['.h5', '.npy'])
+def test_two_time_out_of_core(speckle, tmp_path, suffix):
+    labels = _labels()
+    reference, _ = two_time_correlation(speckle, labels, tile_size=100)
+    out = create_two_time_output(2, len(speckle), path=tmp_path / f'two_time{suffix}', tile_size=16)
+    two_time_correlation(speckle, labels, tile_size=16, out=out)
+    np.testing.assert_allclose(out[()] if suffix == '.h5' else out, reference)
+
+    preview = two_time_preview(out, max_size=30, tile_size=16)
+    # 100 frames are averaged in blocks of 4 into 25 preview frames
+    assert preview.shape == (2, 25, 25)
+    np.testing.assert_allclose(preview[:, 1, 2], reference[:, 4:8, 8:12].mean(axis=(1, 2)), rtol=1e-6)
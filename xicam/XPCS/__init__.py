@@ -1,7 +1,14 @@
+from databroker.core import BlueskyRun
+from xicam.core import msg
+from xicam.core.data import ProjectionNotFound
+from xicam.core.threads import invoke_in_main_thread
+from xicam.core.workspace import Ensemble
 from xicam.SAXS.stages import CorrelationStage
-from xicam.XPCS.projectors.nexus import project_nxXPCS
+from xicam.XPCS.projectors.nexus import find_nxXPCS_projection, project_nxXPCS
 
 from . import ingestors
+from .projectors import background
+from .workflows import BlockedTwoTime, MultiTauFit, MultiTauOneTime
 
 
 class XPCS(CorrelationStage):
@@ -12,3 +19,59 @@ class XPCS(CorrelationStage):
         # Add in appropriate projectors here
         # Add in first position so that it has priority
         self._projectors.insert(0, project_nxXPCS)
+        # Offer the streaming multi-tau correlator next to the SAXS correlation workflows
+        self.workflow_editor.workflows[MultiTauOneTime()] = MultiTauOneTime.name
+        self.workflow_editor.workflows[BlockedTwoTime()] = BlockedTwoTime.name
+        self.workflow_editor.workflows[MultiTauFit()] = MultiTauFit.name
+        self._projection_jobs = []
+
+    def appendCatalog(self, catalog: BlueskyRun, **kwargs):
+        # nxXPCS runs are projected in the background; their intents are added as they are produced
+        try:
+            find_nxXPCS_projection(catalog)
+        except ProjectionNotFound:
+            return super(XPCS, self).appendCatalog(catalog, **kwargs)
+
+        if background.cancel_superseded:
+            for job in self._projection_jobs:
+                job.cancel()
+
+        ensemble = self.ensemble_model.activeEnsemble
+        if ensemble is None:
+            ensemble = Ensemble()
+            self.ensemble_model.appendEnsemble(ensemble, self._projectors)
+
+        job = background.ProjectionJob(catalog, on_intent=self._projected_intent, on_done=self._projection_done)
+        projectors = [lambda _: [job.placeholder]] + [projector for projector in self._projectors
+                                                      if projector is not project_nxXPCS]
+        self.ensemble_model.appendCatalog(catalog, projectors, ensemble=ensemble)
+        self._projection_jobs.append(job.submit())
+
+    def _projected_intent(self, job: background.ProjectionJob, intent):
+        invoke_in_main_thread(self._append_intent, job, intent)
+
+    def _append_intent(self, job: background.ProjectionJob, intent):
+        # The run may have been closed in the meantime
+        if job.run_catalog in self.ensemble_model.tree:
+            self.ensemble_model.appendIntent(intent, job.run_catalog)
+
+    def _projection_done(self, job: background.ProjectionJob):
+        invoke_in_main_thread(self._finish_projection, job)
+
+    def _finish_projection(self, job: background.ProjectionJob):
+        self._projection_jobs.remove(job)
+        model = self.ensemble_model
+        if job.placeholder in model.tree:
+            row, catalog = model.tree.index(job.placeholder)
+            catalog_row, _ = model.tree.index(catalog)
+            model.removeRows(row, 1, model.createIndex(catalog_row, 0, catalog))
+
+        exception = job.exception()
+        if job.cancelled:
+            msg.logMessage(f"Projection of {job.name} was cancelled after {len(job.intents)} intents.")
+        elif exception is not None:
+            msg.logError(exception)
+            msg.notifyMessage(f"Data file {job.name} was opened, but could not be projected.")
+        else:
+            msg.logMessage(f"Projected {job.name}: first plot after {job.time_to_first_intent or 0:.2f} s, "
+                           f"all {len(job.intents)} intents after {job.duration:.2f} s.")
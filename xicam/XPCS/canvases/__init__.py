@@ -0,0 +1,154 @@
+from copy import copy
+
+import numpy as np
+from pyqtgraph import ErrorBarItem
+from qtpy.QtCore import Qt, QRectF
+from qtpy.QtWidgets import QListWidget, QListWidgetItem
+from xicam.gui.canvases import PlotIntentCanvas, PlotIntentCanvasBlend
+from xicam.plugins import manager as plugin_manager
+from xicam.SAXS.canvases import SAXSImageIntentCanvas
+
+from xicam.XPCS.intents import MultiErrorBarIntent, PyramidImageIntent
+
+
+class MultiErrorBarIntentCanvas(PlotIntentCanvas):
+    """Plot canvas for MultiErrorBarIntents, with a checkable list to toggle individual curves.
+
+    Only visible curves get plot items; the error bars of all visible curves of an intent share one ErrorBarItem.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(MultiErrorBarIntentCanvas, self).__init__(*args, **kwargs)
+        self.curve_list = QListWidget()
+        self.curve_list.setMaximumWidth(160)
+        self.curve_list.itemChanged.connect(self._curve_toggled)
+        self._arrays = {}
+
+    def render(self, intent):
+        if not isinstance(intent, MultiErrorBarIntent):
+            return super(MultiErrorBarIntentCanvas, self).render(intent)
+
+        if not self.canvas_widget:
+            bases_names = getattr(intent, 'mixins', tuple()) or tuple()
+            bases = map(lambda name: plugin_manager.type_mapping['PlotMixinPlugin'][name], bases_names)
+            self.canvas_widget = type('PlotViewBlend', (*bases, PlotIntentCanvasBlend), {})()
+            self.layout().addWidget(self.canvas_widget)
+            self.canvas_widget.plotItem.addLegend()
+            self.layout().addWidget(self.curve_list)
+
+        x = np.asarray(intent.x).squeeze()
+        ys = np.atleast_2d(np.asarray(intent.y))
+        height = np.atleast_2d(np.asarray(intent.height)) if intent.height is not None else None
+        self._arrays[intent] = (x, ys, height)
+        self.intent_to_items[intent] = []
+
+        self.curve_list.blockSignals(True)
+        for i, curve_name in enumerate(intent.curve_names):
+            item = QListWidgetItem(f"{intent.name} {curve_name}")
+            item.setFlags(item.flags() | Qt.ItemIsUserCheckable)
+            item.setCheckState(Qt.Checked if intent.visible[i] else Qt.Unchecked)
+            item.setData(Qt.UserRole, (intent, i))
+            self.curve_list.addItem(item)
+        self.curve_list.blockSignals(False)
+
+        x_log_mode = intent.kwargs.get("xLogMode", self.canvas_widget.plotItem.getAxis("bottom").logMode)
+        y_log_mode = intent.kwargs.get("yLogMode", self.canvas_widget.plotItem.getAxis("left").logMode)
+        self.canvas_widget.plotItem.setLogMode(x=x_log_mode, y=y_log_mode)
+        self.canvas_widget.setLabels(**intent.labels)
+
+        self._draw(intent)
+        return self.intent_to_items[intent]
+
+    def set_curve_visible(self, intent: MultiErrorBarIntent, index: int, visible: bool):
+        intent.visible[index] = visible
+        self._draw(intent)
+
+    def _curve_toggled(self, item: QListWidgetItem):
+        intent, index = item.data(Qt.UserRole)
+        self.set_curve_visible(intent, index, item.checkState() == Qt.Checked)
+
+    def _draw(self, intent: MultiErrorBarIntent):
+        for item in self.intent_to_items.get(intent, []):
+            self.canvas_widget.plotItem.removeItem(item)
+
+        x, ys, height = self._arrays[intent]
+        symbol = intent.kwargs.get("symbol", None)
+        indices = np.flatnonzero(intent.visible)
+        items = [self.canvas_widget.plot(x=x, y=ys[i], name=intent.curve_names[i], symbol=symbol) for i in indices]
+
+        if height is not None and len(indices):
+            # One item for the error bars of all visible curves
+            error_item = ErrorBarItem(x=np.tile(x, len(indices)), y=ys[indices].ravel(), height=height[indices].ravel())
+            self.canvas_widget.plotItem.addItem(error_item)
+            items.append(error_item)
+
+        self.intent_to_items[intent] = items
+        self.colorize()
+
+    def unrender(self, intent) -> bool:
+        if intent in self._arrays:
+            del self._arrays[intent]
+            for row in reversed(range(self.curve_list.count())):
+                if self.curve_list.item(row).data(Qt.UserRole)[0] is intent:
+                    self.curve_list.takeItem(row)
+        return super(MultiErrorBarIntentCanvas, self).unrender(intent)
+
+
+class PyramidImageIntentCanvas(SAXSImageIntentCanvas):
+    """SAXS image canvas that displays the pyramid level matching the current zoom of a PyramidImageIntent.
+
+    Coarser levels are stretched over the full-resolution pixel coordinates, so ROIs, crosshair and geometry
+    overlays are unaffected by level switches.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(PyramidImageIntentCanvas, self).__init__(*args, **kwargs)
+        self._level = None
+        self._viewbox = None
+
+    def render(self, intent, **kwargs):
+        if not isinstance(intent, PyramidImageIntent) or intent.pyramid is None:
+            return super(PyramidImageIntentCanvas, self).render(intent, **kwargs)
+
+        # Start from the level that fits the canvas rather than from full resolution
+        pyramid = intent.pyramid
+        level = pyramid.level_for_scale(max(pyramid.source.shape[-2:]) / max(self.width(), self.height(), 1))
+        proxy = copy(intent)
+        proxy.image = pyramid.arrays[level]
+        super(PyramidImageIntentCanvas, self).render(proxy, **kwargs)
+        self.intent_to_items[intent] = self.intent_to_items.pop(proxy)
+        self._primary_intent = intent
+        self._level = level
+        self._set_rect()
+
+        if self._viewbox is None:
+            view = self.canvas_widget.view
+            self._viewbox = view.getViewBox() if hasattr(view, 'getViewBox') else view
+            self._viewbox.sigRangeChanged.connect(self._range_changed)
+
+    def _set_rect(self):
+        pyramid = self._primary_intent.pyramid
+        height, width = pyramid.levels[self._level].shape[-2:]
+        factor = pyramid.factors[self._level]
+        self.canvas_widget.imageItem.setRect(QRectF(0, 0, width * factor, height * factor))
+
+    def _range_changed(self, *_):
+        if not isinstance(self._primary_intent, PyramidImageIntent):
+            return
+        pyramid = self._primary_intent.pyramid
+        level = pyramid.level_for_scale(min(self._viewbox.viewPixelSize()))
+        if level == self._level:
+            return
+        index = self.canvas_widget.currentIndex
+        self.canvas_widget.setImage(pyramid.arrays[level].squeeze(),
+                                    autoRange=False, autoLevels=False, autoHistogramRange=False)
+        if pyramid.stacked:
+            self.canvas_widget.setCurrentIndex(index)
+        self._level = level
+        self._set_rect()
+
+    def unrender(self, intent) -> bool:
+        if intent is self._primary_intent:
+            self._primary_intent = None
+            self._level = None
+        return super(PyramidImageIntentCanvas, self).unrender(intent)
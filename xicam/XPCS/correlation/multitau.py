@@ -0,0 +1,178 @@
+from typing import Tuple
+
+import numpy as np
+from scipy import sparse
+
+from ..reduction.index import QROIIndex, roi_index
+from ..sparse import SparseFrames, read_frames
+
+# Sparse levels are densified once more than this fraction of their pixels is non-zero
+max_sparse_density = .25
+
+
+def _concatenate(first, second):
+    if sparse.issparse(first) or sparse.issparse(second):
+        return sparse.vstack([sparse.csr_matrix(first), sparse.csr_matrix(second)], format='csr')
+    return np.concatenate([first, second])
+
+
+def _product_sums(first, second, weights: np.ndarray = None) -> np.ndarray:
+    # Per-pixel sums over frames of first * second, optionally weighted per frame
+    if sparse.issparse(first):
+        products = first.multiply(second)
+        if weights is None:
+            return np.asarray(products.sum(axis=0)).ravel()
+        return np.asarray(products.T @ weights).ravel()
+    if weights is None:
+        return np.einsum('ij,ij->j', first, second)
+    return np.einsum('i,ij,ij->j', weights, first, second)
+
+
+def _sums(frames, weights: np.ndarray = None) -> np.ndarray:
+    if weights is None:
+        return np.asarray(frames.sum(axis=0)).ravel()
+    return np.asarray(frames.T @ weights).ravel()
+
+
+class MultiTauCorrelator:
+    """Streaming multi-tau autocorrelator computing g2 per ROI from blocks of frames.
+
+    Level 0 correlates frames at lags 0 .. num_bufs - 1; each following level correlates pairwise averages of the
+    previous level's frames at lags num_bufs / 2 .. num_bufs - 1 (in units of its own, doubled, frame time). Each
+    level only keeps the last ``num_bufs - 1`` frames plus per-pixel accumulators, so memory is
+    O(num_levels x num_bufs x pixels) regardless of the number of frames.
+
+    g2 uses the symmetric normalization of ``skbeam.core.correlation.multi_tau_auto_corr``:
+    g2(tau) = <I(t) I(t - tau)> / (<I(t - tau)> <I(t)>), averaged over the pixels of each ROI. The standard error is
+    the spread of the per-pixel g2 within the ROI divided by sqrt(number of pixels).
+
+    Blocks of ``SparseFrames`` are correlated as sparse matrices, so the cost of each lag scales with the number of
+    photons rather than the number of pixels. Averaged frames of the higher levels fill up; a level switches to dense
+    arrays once more than ``max_sparse_density`` of its pixels are non-zero.
+
+    Frames marked invalid (e.g. outliers flagged by ``screen_frames``) keep their place in time but are left out of
+    every pair they belong to, and an averaged frame of a higher level is invalid when either of its frames is.
+    """
+
+    def __init__(self, labels, num_levels: int = 8, num_bufs: int = 16):
+        if num_bufs % 2:
+            raise ValueError(f"num_bufs must be even, got {num_bufs}.")
+
+        # Pixels of all ROIs, sorted by label so that every ROI is a contiguous segment
+        self.index = labels if isinstance(labels, QROIIndex) else roi_index(labels)
+        self.num_levels = num_levels
+        self.num_bufs = num_bufs
+
+        num_pixels = len(self.index.pixel_index)
+        self._history = [np.empty((0, num_pixels)) for _ in range(num_levels)]
+        self._pending = [np.empty((0, num_pixels)) for _ in range(num_levels)]
+        self._history_valid = [np.ones(0, dtype=bool) for _ in range(num_levels)]
+        self._pending_valid = [np.ones(0, dtype=bool) for _ in range(num_levels)]
+        self._G = np.zeros((num_levels, num_bufs, num_pixels))
+        self._past = np.zeros((num_levels, num_bufs, num_pixels))
+        self._future = np.zeros((num_levels, num_bufs, num_pixels))
+        self._counts = np.zeros((num_levels, num_bufs), dtype=np.int64)
+        self.num_frames = 0
+
+    def _lags(self, level: int) -> range:
+        return range(self.num_bufs) if level == 0 else range(self.num_bufs // 2, self.num_bufs)
+
+    def update(self, frames, valid: np.ndarray = None):
+        """Accumulate a block of frames of shape (n, *labels.shape), dense or as SparseFrames; ``valid`` is a
+        boolean mask of the frames to correlate (all by default)."""
+        if isinstance(frames, SparseFrames):
+            frames = self.index.gather_sparse(frames)
+        else:
+            frames = self.index.gather(frames)
+        valid = np.ones(frames.shape[0], dtype=bool) if valid is None else np.asarray(valid, dtype=bool)
+        self.num_frames += frames.shape[0]
+        self._update_level(frames, valid, 0)
+
+    def _update_level(self, frames, valid: np.ndarray, level: int):
+        if sparse.issparse(frames) and frames.nnz > max_sparse_density * np.prod(frames.shape):
+            frames = frames.toarray()
+        history = self._history[level]
+        extended = _concatenate(history, frames)
+        extended_valid = np.concatenate([self._history_valid[level], valid])
+        start, stop = history.shape[0], extended.shape[0]
+        # Unweighted sums while every frame is valid
+        all_valid = extended_valid.all()
+
+        for lag in self._lags(level):
+            first = max(start, lag)
+            if first >= stop:
+                continue
+            current = extended[first:stop]
+            past = extended[first - lag:stop - lag]
+            weights = None if all_valid else \
+                (extended_valid[first:stop] & extended_valid[first - lag:stop - lag]).astype(np.float64)
+            self._G[level, lag] += _product_sums(current, past, weights)
+            self._past[level, lag] += _sums(past, weights)
+            self._future[level, lag] += _sums(current, weights)
+            self._counts[level, lag] += stop - first if weights is None else int(weights.sum())
+
+        self._history[level] = extended[max(stop - (self.num_bufs - 1), 0):]
+        self._history_valid[level] = extended_valid[max(stop - (self.num_bufs - 1), 0):]
+
+        if level + 1 < self.num_levels:
+            unpaired = _concatenate(self._pending[level], frames)
+            unpaired_valid = np.concatenate([self._pending_valid[level], valid])
+            num_pairs = unpaired.shape[0] // 2
+            self._pending[level] = unpaired[2 * num_pairs:]
+            self._pending_valid[level] = unpaired_valid[2 * num_pairs:]
+            if num_pairs:
+                averaged = (unpaired[0:2 * num_pairs:2] + unpaired[1:2 * num_pairs:2]) / 2
+                averaged_valid = unpaired_valid[0:2 * num_pairs:2] & unpaired_valid[1:2 * num_pairs:2]
+                self._update_level(averaged, averaged_valid, level + 1)
+
+    def result(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Return (g2, tau, g2_errors); g2 and g2_errors have shape (len(tau), number of ROIs), tau is in frames.
+
+        The zero lag is not included.
+        """
+        levels, lags = [], []
+        for level in range(self.num_levels):
+            for lag in self._lags(level):
+                if self._counts[level, lag] and (level or lag):
+                    levels.append(level)
+                    lags.append(lag)
+        levels, lags = np.asarray(levels, dtype=int), np.asarray(lags, dtype=int)
+        tau = lags * 2 ** levels
+
+        counts = self._counts[levels, lags][:, None]
+        G = self._G[levels, lags] / counts
+        past = self._past[levels, lags] / counts
+        future = self._future[levels, lags] / counts
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            g2 = self.index.reduce(G) / (self.index.reduce(past) * self.index.reduce(future)) * self.index.sizes
+            # Dark pixels have no defined g2; leave them out of the spread
+            pixel_g2 = G / (past * future)
+            valid = np.isfinite(pixel_g2)
+            pixel_g2 = np.where(valid, pixel_g2, 0)
+            num_valid = self.index.reduce(valid)
+            mean_pixel_g2 = self.index.reduce(pixel_g2) / num_valid
+            variance = self.index.reduce(pixel_g2 ** 2) / num_valid - mean_pixel_g2 ** 2
+            g2_errors = np.sqrt(np.clip(variance, 0, None) / num_valid)
+
+        return g2, tau, g2_errors
+
+
+def multi_tau_correlation(frames,
+                          labels,
+                          num_levels: int = 8,
+                          num_bufs: int = 16,
+                          block_size: int = 256,
+                          frame_mask: np.ndarray = None) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Compute multi-tau g2, tau and standard errors per ROI from a (N, q_x, q_y) frame stack.
+
+    ``frames`` may be any sliceable array (NumPy, h5py or dask) or SparseFrames; it is read ``block_size`` frames at
+    a time. ``labels`` has the shape of one frame, with ROIs numbered from 1 and 0 for background, or is a QROIIndex.
+    ``frame_mask`` (e.g. ``FrameScreen.keep``) marks the frames to correlate; the others are skipped.
+    """
+    correlator = MultiTauCorrelator(labels, num_levels=num_levels, num_bufs=num_bufs)
+    frame_mask = None if frame_mask is None else np.asarray(frame_mask, dtype=bool)
+    for start in range(0, len(frames), block_size):
+        correlator.update(read_frames(frames, start, start + block_size),
+                          valid=None if frame_mask is None else frame_mask[start:start + block_size])
+    return correlator.result()
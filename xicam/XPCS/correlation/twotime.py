@@ -0,0 +1,135 @@
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Tuple
+
+import numpy as np
+from scipy import sparse
+
+from ..reduction.index import QROIIndex, roi_index
+from ..sparse import SparseFrames, read_frames
+from ..transport import SharedArray
+
+
+def create_two_time_output(num_rois: int,
+                           num_frames: int,
+                           path=None,
+                           tile_size: int = 512,
+                           dtype=np.float32,
+                           shared: bool = False):
+    """Allocate the (num_rois, num_frames, num_frames) output of ``two_time_correlation``.
+
+    Without ``path`` the output is held in memory, or in a ``SharedArray`` with ``shared`` so a worker process can
+    hand it to the GUI without copying. A ``path`` ending in .h5/.hdf5/.nxs creates a 'two_time' dataset (chunked
+    by tile) in that HDF5 file; any other path creates a memory-mapped .npy file.
+    """
+    shape = (num_rois, num_frames, num_frames)
+    if path is None:
+        if shared:
+            # Fresh shared memory and memory-mapped files are zero-filled
+            return SharedArray.empty(shape, dtype=dtype)
+        return np.zeros(shape, dtype=dtype)
+    if os.path.splitext(str(path))[1] in ('.h5', '.hdf5', '.nxs'):
+        import h5py
+        h5 = h5py.File(path, 'a')
+        if 'two_time' in h5:
+            del h5['two_time']
+        chunk = min(tile_size, num_frames)
+        return h5.create_dataset('two_time', shape=shape, dtype=dtype, chunks=(1, chunk, chunk))
+    return np.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=shape)
+
+
+def two_time_correlation(frames,
+                         labels,
+                         tile_size: int = 512,
+                         out=None,
+                         max_workers: int = None,
+                         frame_mask: np.ndarray = None) -> Tuple[object, np.ndarray]:
+    """Compute the two-time correlation C(t1, t2) of every ROI in tiles of ``tile_size`` x ``tile_size`` frames.
+
+    C(t1, t2) = <I(t1) I(t2)> / (<I(t1)> <I(t2)>), with averages over the pixels of the ROI; each tile is one matrix
+    product of the (frames x pixels) blocks of the ROI, a sparse one for SparseFrames. Only the upper triangle of
+    tiles is computed and mirrored. Frame blocks are read from ``frames`` (NumPy, h5py, dask or SparseFrames) on
+    demand, and tiles of all ROIs are computed in parallel on ``max_workers`` threads, so at most a few blocks are in
+    memory at once.
+
+    ``out`` receives the (num_rois, N, N) result (see ``create_two_time_output``); returns ``(out, roi_intensity)``
+    where roi_intensity is the (num_rois, N) mean intensity of each ROI per frame.
+
+    Frames left out by ``frame_mask`` (e.g. ``FrameScreen.keep``) get NaN rows and columns and NaN intensities.
+    """
+    index = labels if isinstance(labels, QROIIndex) else roi_index(labels)
+    num_rois = index.num_bins
+    num_frames = len(frames)
+    frame_mask = None if frame_mask is None else np.asarray(frame_mask, dtype=bool)
+    if out is None:
+        out = create_two_time_output(num_rois, num_frames, tile_size=tile_size)
+    starts = list(range(0, num_frames, tile_size))
+
+    def load(start):
+        block = read_frames(frames, start, start + tile_size)
+        if isinstance(block, SparseFrames):
+            # Column slices of CSC matrices are cheap; each ROI then multiplies as CSR
+            return [segment.tocsr() for segment in index.segments(index.gather_sparse(block).tocsc())]
+        return list(index.segments(index.gather(block)))
+
+    def means(pixels):
+        return np.asarray(pixels.mean(axis=1)).ravel()
+
+    def tile(roi, block_i, block_j):
+        pixels_i, pixels_j = block_i[roi], block_j[roi]
+        numerator = pixels_i @ pixels_j.T / pixels_i.shape[1]
+        if sparse.issparse(numerator):
+            numerator = numerator.toarray()
+        return numerator / np.outer(means(pixels_i), means(pixels_j))
+
+    roi_intensity = np.zeros((num_rois, num_frames))
+    with ThreadPoolExecutor(max_workers=max_workers or os.cpu_count()) as executor:
+        for i, start_i in enumerate(starts):
+            block_i = load(start_i)
+            stop_i = start_i + block_i[0].shape[0]
+            for roi, pixels in enumerate(block_i):
+                roi_intensity[roi, start_i:stop_i] = means(pixels)
+
+            def row_tiles(start_j):
+                block_j = block_i if start_j == start_i else load(start_j)
+                return start_j, [tile(roi, block_i, block_j) for roi in range(num_rois)]
+
+            # Tiles of one row run concurrently; results are written from this thread only (h5py is not thread-safe)
+            for future in as_completed([executor.submit(row_tiles, start_j) for start_j in starts[i:]]):
+                start_j, tiles = future.result()
+                for roi, values in enumerate(tiles):
+                    stop_j = start_j + values.shape[1]
+                    if frame_mask is not None:
+                        values[~frame_mask[start_i:stop_i]] = np.nan
+                        values[:, ~frame_mask[start_j:stop_j]] = np.nan
+                    out[roi, start_i:stop_i, start_j:stop_j] = values
+                    if start_j != start_i:
+                        out[roi, start_j:stop_j, start_i:stop_i] = values.T
+
+    if frame_mask is not None:
+        roi_intensity[:, ~frame_mask] = np.nan
+    return out, roi_intensity
+
+
+def two_time_preview(two_time, max_size: int = 512, tile_size: int = 512) -> np.ndarray:
+    """Downsample a (num_rois, N, N) two-time result by block-averaging to at most ``max_size`` frames per side.
+
+    The result is read tile by tile, so ``two_time`` can be an HDF5 dataset or memory map larger than memory.
+    """
+    num_rois, num_frames = two_time.shape[:2]
+    factor = int(np.ceil(num_frames / max_size))
+    tile_size = max(factor, tile_size // factor * factor)
+    size = int(np.ceil(num_frames / factor))
+    preview = np.zeros((num_rois, size, size))
+    for roi in range(num_rois):
+        for start_i in range(0, num_frames, tile_size):
+            for start_j in range(0, num_frames, tile_size):
+                values = np.asarray(two_time[roi, start_i:start_i + tile_size, start_j:start_j + tile_size])
+                rows, columns = int(np.ceil(values.shape[0] / factor)), int(np.ceil(values.shape[1] / factor))
+                # Pad ragged edges with NaN so that partial blocks average over their valid frames only
+                padded = np.full((rows * factor, columns * factor), np.nan)
+                padded[:values.shape[0], :values.shape[1]] = values
+                pooled = np.nanmean(padded.reshape(rows, factor, columns, factor), axis=(1, 3))
+                preview[roi, start_i // factor:start_i // factor + rows,
+                        start_j // factor:start_j // factor + columns] = pooled
+    return preview
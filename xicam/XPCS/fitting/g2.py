@@ -0,0 +1,419 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+
+
+class G2Model:
+    """A g2(tau) model evaluated for many curves at once.
+
+    ``evaluate`` and ``jacobian`` take parameters of shape (num_curves, num_params) and tau of shape (num_tau,), and
+    return arrays of shape (num_curves, num_tau) and (num_curves, num_tau, num_params). ``lower`` and ``upper`` bound
+    each parameter.
+    """
+    name = None
+    param_names = ()
+    lower = ()
+    upper = ()
+
+    def evaluate(self, params: np.ndarray, tau: np.ndarray) -> np.ndarray:
+        raise NotImplementedError
+
+    def jacobian(self, params: np.ndarray, tau: np.ndarray) -> np.ndarray:
+        raise NotImplementedError
+
+    def initial(self, beta: np.ndarray, gamma: np.ndarray, baseline: np.ndarray) -> np.ndarray:
+        """Starting parameters from the contrast, the single-exponential relaxation rate and the baseline."""
+        raise NotImplementedError
+
+
+class SingleExponential(G2Model):
+    """g2 = baseline + beta exp(-2 gamma tau)"""
+    name = 'single'
+    param_names = ('beta', 'gamma', 'baseline')
+    lower = (0, 0, 0)
+    upper = (np.inf, np.inf, np.inf)
+
+    def evaluate(self, params, tau):
+        beta, gamma, baseline = (params[:, i, None] for i in range(3))
+        return baseline + beta * np.exp(-2 * gamma * tau)
+
+    def jacobian(self, params, tau):
+        beta, gamma, baseline = (params[:, i, None] for i in range(3))
+        decay = np.exp(-2 * gamma * tau)
+        return np.stack([decay, -2 * beta * tau * decay, np.ones_like(decay)], axis=-1)
+
+    def initial(self, beta, gamma, baseline):
+        return np.stack([beta, gamma, baseline], axis=-1)
+
+
+class StretchedExponential(G2Model):
+    """g2 = baseline + beta exp(-2 (gamma tau) ** alpha)"""
+    name = 'stretched'
+    param_names = ('beta', 'gamma', 'alpha', 'baseline')
+    lower = (0, 0, 0.05, 0)
+    upper = (np.inf, np.inf, 2, np.inf)
+
+    def evaluate(self, params, tau):
+        beta, gamma, alpha, baseline = (params[:, i, None] for i in range(4))
+        return baseline + beta * np.exp(-2 * (gamma * tau) ** alpha)
+
+    def jacobian(self, params, tau):
+        beta, gamma, alpha, baseline = (params[:, i, None] for i in range(4))
+        scaled = gamma * tau
+        stretched = scaled ** alpha
+        decay = np.exp(-2 * stretched)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            d_gamma = np.where(gamma > 0, -2 * beta * decay * alpha * stretched / gamma, 0)
+            d_alpha = np.where(scaled > 0, -2 * beta * decay * stretched * np.log(scaled), 0)
+        return np.stack([decay, d_gamma, d_alpha, np.ones_like(decay)], axis=-1)
+
+    def initial(self, beta, gamma, baseline):
+        return np.stack([beta, gamma, np.ones_like(beta), baseline], axis=-1)
+
+
+class DoubleExponential(G2Model):
+    """g2 = baseline + beta (fraction exp(-gamma_1 tau) + (1 - fraction) exp(-gamma_2 tau)) ** 2
+
+    The field correlation is a sum of two modes; gamma_1 and gamma_2 are directly comparable to gamma of the single
+    exponential.
+    """
+    name = 'double'
+    param_names = ('beta', 'gamma_1', 'gamma_2', 'fraction', 'baseline')
+    lower = (0, 0, 0, 0, 0)
+    upper = (np.inf, np.inf, np.inf, 1, np.inf)
+
+    def evaluate(self, params, tau):
+        beta, gamma_1, gamma_2, fraction, baseline = (params[:, i, None] for i in range(5))
+        field_correlation = fraction * np.exp(-gamma_1 * tau) + (1 - fraction) * np.exp(-gamma_2 * tau)
+        return baseline + beta * field_correlation ** 2
+
+    def jacobian(self, params, tau):
+        beta, gamma_1, gamma_2, fraction, baseline = (params[:, i, None] for i in range(5))
+        decay_1, decay_2 = np.exp(-gamma_1 * tau), np.exp(-gamma_2 * tau)
+        field_correlation = fraction * decay_1 + (1 - fraction) * decay_2
+        scale = 2 * beta * field_correlation
+        return np.stack([field_correlation ** 2,
+                         -scale * fraction * tau * decay_1,
+                         -scale * (1 - fraction) * tau * decay_2,
+                         scale * (decay_1 - decay_2),
+                         np.ones_like(decay_1)], axis=-1)
+
+    def initial(self, beta, gamma, baseline):
+        # One fast and one slow mode around the single-exponential rate
+        return np.stack([beta, 8 * gamma, gamma, np.full_like(beta, .5), baseline], axis=-1)
+
+
+models = {model.name: model for model in (SingleExponential(), StretchedExponential(), DoubleExponential())}
+
+
+@dataclass
+class G2Fit:
+    """Fitted parameters, their standard errors and the reduced chi-square of a set of g2 curves.
+
+    ``params`` and ``errors`` map each parameter name of the model to an array with one value per curve.
+    """
+    model: str
+    tau: np.ndarray
+    q: np.ndarray
+    params: Dict[str, np.ndarray]
+    errors: Dict[str, np.ndarray]
+    chi2: np.ndarray
+    converged: np.ndarray
+    iterations: np.ndarray = field(default=None, repr=False)
+
+    @property
+    def relaxation_rate(self) -> np.ndarray:
+        """Γ(q): the single or stretched exponential rate, or the rate of the dominant mode of the double exponential"""
+        if self.model == 'double':
+            dominant = self.params['fraction'] >= .5
+            return np.where(dominant, self.params['gamma_1'], self.params['gamma_2'])
+        return self.params['gamma']
+
+    @property
+    def relaxation_rate_error(self) -> np.ndarray:
+        if self.model == 'double':
+            dominant = self.params['fraction'] >= .5
+            return np.where(dominant, self.errors['gamma_1'], self.errors['gamma_2'])
+        return self.errors['gamma']
+
+    @property
+    def beta(self) -> np.ndarray:
+        return self.params['beta']
+
+    def param_array(self) -> np.ndarray:
+        return np.stack([self.params[name] for name in models[self.model].param_names], axis=-1)
+
+    def curves(self, tau: np.ndarray = None) -> np.ndarray:
+        """Evaluate the fitted model at ``tau`` (the fitted tau by default), giving shape (num_curves, len(tau))."""
+        tau = self.tau if tau is None else np.asarray(tau, dtype=float)
+        return models[self.model].evaluate(self.param_array(), tau)
+
+
+def initial_guess(model: G2Model, g2: np.ndarray, tau: np.ndarray, weights: np.ndarray) -> np.ndarray:
+    """Estimate starting parameters of all curves from the baseline, the early contrast and the 1/e decay time."""
+    valid = weights > 0
+    num_valid = valid.sum(axis=1)
+    # Baseline from the last tenth of the valid points, contrast from the first valid point
+    order = np.cumsum(valid, axis=1)
+    tail = valid & (order > num_valid[:, None] * .9)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        baseline = np.nansum(np.where(tail, g2, 0), axis=1) / tail.sum(axis=1)
+        baseline = np.where(np.isfinite(baseline), baseline, 1)
+        first = np.argmax(valid, axis=1)
+        beta = np.clip(g2[np.arange(len(g2)), first] - baseline, 1e-3, None)
+        normalized = (g2 - baseline[:, None]) / beta[:, None]
+    # tau where the normalized decay first drops below 1/e, where exp(-2 gamma tau) = 1/e
+    decayed = valid & (normalized < np.exp(-1))
+    tau_e = np.where(decayed.any(axis=1), tau[np.argmax(decayed, axis=1)], tau[-1])
+    gamma = 1 / (2 * np.clip(tau_e, np.finfo(float).tiny, None))
+    return model.initial(beta, gamma, baseline)
+
+
+def _weights(g2: np.ndarray, errors: np.ndarray = None) -> np.ndarray:
+    weights = np.isfinite(g2).astype(float)
+    if errors is not None:
+        errors = np.broadcast_to(np.asarray(errors, dtype=float), g2.shape)
+        usable = np.isfinite(errors) & (errors > 0)
+        # Curves without usable errors are fit unweighted
+        weighted = usable.any(axis=1)
+        with np.errstate(divide='ignore'):
+            weights = np.where(weighted[:, None], np.where(usable, 1 / errors, 0), 1) * weights
+    return weights
+
+
+def levenberg_marquardt(model: G2Model,
+                        g2: np.ndarray,
+                        tau: np.ndarray,
+                        weights: np.ndarray,
+                        initial: np.ndarray,
+                        free: np.ndarray = None,
+                        max_iterations: int = 100,
+                        tolerance: float = 1e-10) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray,
+                                                           np.ndarray]:
+    """Fit all curves at once with a bounded Levenberg-Marquardt iteration.
+
+    Every iteration evaluates the weighted residuals and Jacobians of the still-active curves as single arrays and
+    solves their damped normal equations as one stacked linear solve. Curves leave the active set as they converge.
+    ``free`` masks the parameters to fit; the others keep their initial values.
+
+    Returns (params, errors, reduced chi-square, converged, iterations).
+    """
+    num_curves, num_params = initial.shape
+    lower, upper = np.asarray(model.lower, dtype=float), np.asarray(model.upper, dtype=float)
+    free = np.ones(num_params, dtype=bool) if free is None else np.asarray(free, dtype=bool)
+    g2 = np.where(weights > 0, g2, 0)
+
+    params = np.clip(np.array(initial, dtype=float), lower, upper)
+    damping = np.full(num_curves, 1e-3)
+    iterations = np.zeros(num_curves, dtype=np.int64)
+    converged = np.zeros(num_curves, dtype=bool)
+
+    def cost(p, rows):
+        residuals = weights[rows] * (model.evaluate(p, tau) - g2[rows])
+        return residuals, np.einsum('ij,ij->i', residuals, residuals)
+
+    residuals, costs = cost(params, slice(None))
+    active = np.arange(num_curves)
+    for _ in range(max_iterations):
+        if not len(active):
+            break
+        p = params[active]
+        jacobian = weights[active, :, None] * model.jacobian(p, tau) * free
+        normal = np.einsum('ijk,ijl->ikl', jacobian, jacobian)
+        gradient = np.einsum('ijk,ij->ik', jacobian, residuals[active])
+        diagonal = np.einsum('ikk->ik', normal)
+        # Damp along the curvature of each parameter; fixed parameters get an identity row so the system stays regular
+        damped = normal + (damping[active, None] * diagonal + np.where(free, 1e-12, 1))[:, :, None] * np.eye(num_params)
+        step = -np.linalg.solve(damped, gradient[..., None])[..., 0]
+        trial = np.clip(p + step, lower, upper)
+        trial_residuals, trial_costs = cost(trial, active)
+
+        iterations[active] += 1
+        improved = trial_costs < costs[active]
+        accepted = active[improved]
+        change = costs[accepted] - trial_costs[improved]
+        params[accepted] = trial[improved]
+        residuals[accepted] = trial_residuals[improved]
+        costs[accepted] = trial_costs[improved]
+        damping[active] = np.where(improved, damping[active] / 10, damping[active] * 10)
+
+        moved = np.abs(trial - p).max(axis=1) <= tolerance * (np.abs(p).max(axis=1) + tolerance)
+        done = np.zeros(len(active), dtype=bool)
+        done[improved] = change <= tolerance * (costs[accepted] + tolerance)
+        done |= moved | (damping[active] > 1e12)
+        converged[active[done]] = True
+        active = active[~done]
+
+    # Standard errors from the covariance at the solution, scaled by the reduced chi-square
+    jacobian = weights[:, :, None] * model.jacobian(params, tau) * free
+    normal = np.einsum('ijk,ijl->ikl', jacobian, jacobian)
+    degrees_of_freedom = np.clip((weights > 0).sum(axis=1) - free.sum(), 1, None)
+    chi2 = costs / degrees_of_freedom
+    covariance = np.linalg.pinv(normal)
+    errors = np.sqrt(np.clip(np.einsum('ikk->ik', covariance), 0, None) * chi2[:, None])
+    errors[:, ~free] = 0
+    return params, errors, chi2, converged, iterations
+
+
+def _fit_batch(model_name: str, g2, tau, weights, initial, free, max_iterations):
+    return levenberg_marquardt(models[model_name], g2, tau, weights, initial, free=free,
+                               max_iterations=max_iterations)
+
+
+def _fit(model_name, g2, tau, weights, initial, free, max_iterations, batch_size, executor):
+    batches = range(0, len(g2), batch_size)
+    args = [(model_name, g2[start:start + batch_size], tau, weights[start:start + batch_size],
+             initial[start:start + batch_size], free, max_iterations) for start in batches]
+    if executor is None or len(args) == 1:
+        results = [_fit_batch(*arg) for arg in args]
+    else:
+        results = list(executor.map(_fit_batch, *zip(*args)))
+    return tuple(np.concatenate(parts) for parts in zip(*results))
+
+
+def fit_g2(g2: np.ndarray,
+           tau: np.ndarray,
+           q: np.ndarray = None,
+           model: str = 'single',
+           errors: np.ndarray = None,
+           initial: np.ndarray = None,
+           fixed: Dict[str, float] = None,
+           warm_start: bool = True,
+           seed_stride: int = 8,
+           max_iterations: int = 100,
+           batch_size: int = 256,
+           max_workers: int = 1) -> G2Fit:
+    """Fit ``model`` ('single', 'stretched' or 'double') to every g2 curve.
+
+    ``g2`` (and ``errors``, used as weights) have shape (num_curves, len(tau)), as projected by ``project_nxXPCS``;
+    NaN points are ignored. ``fixed`` maps parameter names to values that are held fixed (e.g. ``{'baseline': 1}``).
+
+    With ``warm_start``, every ``seed_stride``-th curve in q order is fit first and the others start from their
+    nearest fitted neighbour in q, with rates scaled by q² as for diffusion. ``initial`` (of shape (num_curves,
+    num_params), e.g. ``G2Fit.param_array()`` of a previous run) replaces the estimated starting point altogether.
+
+    Curves are fit in batches of ``batch_size``; with ``max_workers`` > 1 the batches run in a process pool.
+    """
+    g2_model = models[model]
+    g2 = np.atleast_2d(np.asarray(g2, dtype=float))
+    tau = np.asarray(tau, dtype=float).ravel()
+    q = np.arange(len(g2), dtype=float) if q is None else np.asarray(q, dtype=float).ravel()
+    weights = _weights(g2, errors)
+
+    fixed = fixed or {}
+    free = np.array([name not in fixed for name in g2_model.param_names])
+    if initial is None:
+        initial = initial_guess(g2_model, g2, tau, weights)
+    initial = np.array(initial, dtype=float)
+    for name, value in fixed.items():
+        initial[:, g2_model.param_names.index(name)] = value
+
+    max_workers = max_workers or os.cpu_count()
+    executor = ProcessPoolExecutor(max_workers=max_workers) if max_workers > 1 and len(g2) > batch_size else None
+    try:
+        if warm_start and len(g2) > seed_stride:
+            order = np.argsort(q)
+            seeds = np.zeros(len(g2), dtype=bool)
+            seeds[order[::seed_stride]] = True
+            seed_results = _fit(model, g2[seeds], tau, weights[seeds], initial[seeds], free, max_iterations,
+                                batch_size, executor)
+
+            # Start every other curve from the nearest seed that converged
+            converged = seed_results[3]
+            if converged.any():
+                seed_index, seed_params = np.flatnonzero(seeds)[converged], seed_results[0][converged]
+                nearest = np.abs(q[~seeds, None] - q[None, seed_index]).argmin(axis=1)
+                warm = seed_params[nearest].copy()
+                seed_q = q[seed_index][nearest]
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    scale = np.where(seed_q != 0, (q[~seeds] / seed_q) ** 2, 1)
+                rates = [i for i, name in enumerate(g2_model.param_names) if name.startswith('gamma') and free[i]]
+                warm[:, rates] *= scale[:, None]
+                initial[~seeds] = warm
+
+            rest_results = _fit(model, g2[~seeds], tau, weights[~seeds], initial[~seeds], free,
+                                max_iterations, batch_size, executor)
+            results = []
+            for seed_part, rest_part in zip(seed_results, rest_results):
+                combined = np.empty((len(g2),) + seed_part.shape[1:], dtype=seed_part.dtype)
+                combined[seeds], combined[~seeds] = seed_part, rest_part
+                results.append(combined)
+        else:
+            results = _fit(model, g2, tau, weights, initial, free, max_iterations, batch_size, executor)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    params, param_errors, chi2, converged, iterations = results
+    return G2Fit(model=model,
+                 tau=tau,
+                 q=q,
+                 params={name: params[:, i] for i, name in enumerate(g2_model.param_names)},
+                 errors={name: param_errors[:, i] for i, name in enumerate(g2_model.param_names)},
+                 chi2=chi2,
+                 converged=converged,
+                 iterations=iterations)
+
+
+def g2_arrays(run_catalog) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Return (g2, tau, g2 errors, q) of an nxXPCS run, with g2 and errors of shape (num_q, num_tau)."""
+    from ..ingestors import g2_projection_key, g2_error_projection_key, tau_projection_key, dqlist_key
+
+    projection = next(projection for projection in run_catalog.metadata['start'].get('projections', [])
+                      if projection['name'] == 'nxXPCS')['projection']
+    stream = getattr(run_catalog, projection[g2_projection_key]['stream']).read()
+    g2 = np.asarray(stream[projection[g2_projection_key]['field']])
+    tau = np.asarray(stream[projection[tau_projection_key]['field']])[0]
+    errors = np.asarray(stream[projection[g2_error_projection_key]['field']])
+    dqlist = np.asarray(stream[projection[dqlist_key]['field']])
+    return g2, tau, errors, np.reshape(dqlist, (len(dqlist), -1))[:, 0]
+
+
+def _fit_run(run_catalog, kwargs) -> G2Fit:
+    g2, tau, errors, q = g2_arrays(run_catalog)
+    return fit_g2(g2, tau, q=q, errors=errors, **kwargs)
+
+
+def fit_g2_runs(runs: Sequence, model: str = 'single', max_workers: int = None, **kwargs) -> List[G2Fit]:
+    """Fit every g2 curve of many nxXPCS runs, one run per worker process.
+
+    ``kwargs`` are passed to ``fit_g2`` for each run.
+    """
+    kwargs = dict(kwargs, model=model, max_workers=1)
+    max_workers = max_workers or os.cpu_count()
+    if max_workers == 1 or len(runs) == 1:
+        return [_fit_run(run, kwargs) for run in runs]
+    # Runs are read here so only arrays travel to the workers
+    arrays = [g2_arrays(run) for run in runs]
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(fit_g2, g2, tau, q=q, errors=errors, **kwargs) for g2, tau, errors, q in arrays]
+        return [future.result() for future in futures]
+
+
+def fit_intents(fit: G2Fit, name: str, visible: Sequence[bool] = None) -> list:
+    """Return the intents of a fit: Γ vs q² with error bars, and the fitted curves over the g2 curves."""
+    from xicam.core.intents import ErrorBarIntent
+    from ..intents import MultiErrorBarIntent
+
+    rate_errors = np.nan_to_num(fit.relaxation_rate_error)
+    return [ErrorBarIntent(name=f"Γ ({fit.model}) {name}",
+                           canvas_name='Γ vs. q²',
+                           match_key='diffusion_coefficient',
+                           x=fit.q ** 2,
+                           y=fit.relaxation_rate,
+                           top=rate_errors,
+                           bottom=rate_errors,
+                           symbol='o',
+                           labels={'bottom': 'q²', 'left': 'Γ'}),
+            MultiErrorBarIntent(name=f"g₂ fit {name}",
+                                canvas_name='g₂ vs. τ',
+                                match_key='g₂ vs. τ',
+                                x=fit.tau,
+                                y=fit.curves(),
+                                curve_names=[f"q={q:.3} fit" for q in fit.q],
+                                visible=visible,
+                                xLogMode=True,
+                                labels={"left": "g₂", "bottom": "τ"})]
@@ -1,12 +1,22 @@
 import time
+from typing import Tuple
 import numpy as np
 import h5py
 import event_model
 from pathlib import Path
-import dask.array as da
 from xarray import DataArray
 import mimetypes
 
+from .. import profiling
+from ..sparse import SparseFrames
+from ..reduction.index import QROIIndex
+from ..reduction.statistics import compact_labels, image_roi_statistics, roi_labels, \
+                                   roi_statistics as compute_roi_statistics
+from ..reduction.screening import screen_frames
+from .cache import IngestCache, ingest_cache
+from .convert import find_converted, sample_name_attribute
+from .lazy import handle_pool, lazy_array
+
 mimetypes.add_type('application/x-hdf5', '.nxs')
 mimetypes.add_type('application/x-hdf5', '.nx')
 
@@ -15,7 +25,20 @@ tau_projection_key = '/entry/XPCS/data/tau'
 g2_error_projection_key = '/entry/XPCS/data/g2_stderr'
 dqlist_key = '/entry/XPCS/instrument/mask/dqlist'
 
-# XPCS_mask_names_key = '/entry/XPCS/data/masks'
+# Valid-pixel mask (nonzero is valid; a stack of masks is combined) and ROI label map (ROIs numbered from 1, or a
+# stack of boolean ROI masks); both are ingested once, as compact label arrays, into the 'rois' stream
+XPCS_mask_projection_key = '/entry/XPCS/data/masks'
+XPCS_roi_projection_key = '/entry/XPCS/data/rois'
+# Per-ROI statistics computed on ingest from the raw frames (or SAXS_2D), not read from the file
+ROI_labels_key = '/entry/XPCS/data/roi_statistics/labels'
+ROI_pixel_count_key = '/entry/XPCS/data/roi_statistics/pixel_count'
+ROI_mean_intensity_key = '/entry/XPCS/data/roi_statistics/mean_intensity'
+ROI_contrast_key = '/entry/XPCS/data/roi_statistics/contrast'
+# Per-frame statistics and outlier flags of the raw frames, computed on ingest by screen_frames
+frame_total_intensity_key = '/entry/XPCS/data/frame_screening/total_intensity'
+frame_roi_mean_key = '/entry/XPCS/data/frame_screening/roi_mean'
+frame_similarity_key = '/entry/XPCS/data/frame_screening/similarity'
+frame_outlier_key = '/entry/XPCS/data/frame_screening/outlier'
 
 SAXS_2D_I_projection_key = '/entry/SAXS_2D/data/I'
 SAXS_1D_I_projection_key = '/entry/SAXS_1D/data/I'
@@ -23,6 +46,8 @@ SAXS_1D_Q_projection_key = '/entry/SAXS_1D/data/Q'
 SAXS_1D_I_partial_projection_key = '/entry/SAXS_1D/data/I_partial'
 
 raw_data_projection_key = '/entry/data/raw'
+# Raw frames stored as photon events (see xicam.XPCS.sparse); ingested into the same 'raw' stream
+raw_sparse_projection_key = '/entry/data/raw_sparse'
 # TODO: add var for rest of projection keys
 
 projections = [{'name': 'nxXPCS',
@@ -40,10 +65,46 @@ projections = [{'name': 'nxXPCS',
                                                'stream': 'primary',
                                                'location': 'event',
                                                'field': 'g2_error_bars'},
-                     # XPCS_mask_names_key: {'type': 'linked',
-                     #                           'stream': 'primary',
-                     #                           'location': 'event',
-                     #                           'field': 'masks'},
+                     XPCS_mask_projection_key: {'type': 'linked',
+                                                'stream': 'rois',
+                                                'location': 'event',
+                                                'field': 'mask'},
+                     XPCS_roi_projection_key: {'type': 'linked',
+                                               'stream': 'rois',
+                                               'location': 'event',
+                                               'field': 'rois'},
+                     ROI_labels_key: {'type': 'linked',
+                                      'stream': 'roi_statistics',
+                                      'location': 'event',
+                                      'field': 'roi_labels'},
+                     ROI_pixel_count_key: {'type': 'linked',
+                                           'stream': 'roi_statistics',
+                                           'location': 'event',
+                                           'field': 'roi_pixel_count'},
+                     ROI_mean_intensity_key: {'type': 'linked',
+                                              'stream': 'roi_statistics',
+                                              'location': 'event',
+                                              'field': 'roi_mean_intensity'},
+                     ROI_contrast_key: {'type': 'linked',
+                                        'stream': 'roi_statistics',
+                                        'location': 'event',
+                                        'field': 'roi_contrast'},
+                     frame_total_intensity_key: {'type': 'linked',
+                                                 'stream': 'frame_screening',
+                                                 'location': 'event',
+                                                 'field': 'frame_total_intensity'},
+                     frame_roi_mean_key: {'type': 'linked',
+                                          'stream': 'frame_screening',
+                                          'location': 'event',
+                                          'field': 'frame_roi_mean'},
+                     frame_similarity_key: {'type': 'linked',
+                                            'stream': 'frame_screening',
+                                            'location': 'event',
+                                            'field': 'frame_similarity'},
+                     frame_outlier_key: {'type': 'linked',
+                                         'stream': 'frame_screening',
+                                         'location': 'event',
+                                         'field': 'frame_outlier'},
                      dqlist_key: {'type': 'linked',
                                          'stream': 'primary',
                                          'location': 'event',
@@ -74,142 +135,412 @@ projections = [{'name': 'nxXPCS',
                 }]
 
 
-def ingest_nxXPCS(paths):
-    assert len(paths) == 1
-    path = paths[0]
+source = 'nxXPCS'
 
-    h5 = h5py.File(path, 'r')
-
-    # Compose run start
-    run_bundle = event_model.compose_run()  # type: event_model.ComposeRunBundle
-    start_doc = run_bundle.start_doc
-    start_doc["sample_name"] = Path(paths[0]).resolve().stem
-    start_doc["projections"] = projections
-    yield 'start', start_doc
-    source = 'nxXPCS'
-
-    #gather data from h5 file
-    g2 = h5[g2_projection_key]
-    tau = h5[tau_projection_key][0]
-    g2_errors = h5[g2_error_projection_key]
-    # masks = h5['entry/XPCS/data/masks']
-    # rois = h5['entry/XPCS/data/rois']
-    dqlist = h5[dqlist_key]
-    # dqlist = list(map(lambda bytestring: bytestring.decode('UTF-8'), h5[dqlist_key][()]))
-    SAXS_2D_I = da.from_array(h5[SAXS_2D_I_projection_key])
-    SAXS_1D_I = h5[SAXS_1D_I_projection_key][0]
-    SAXS_1D_Q = h5[SAXS_1D_Q_projection_key][0]
-    SAXS_1D_I_partial = da.from_array(h5[SAXS_1D_I_partial_projection_key])
-
-    try:
-        raw_data = h5[raw_data_projection_key]
-        raw_data_keys = {'raw': {'source': source,
-                                 'dtype': 'array',
-                                 'dims': ('N', 'q_x', 'q_y'),
-                                 'shape': raw_data.shape}}
-        raw_data_stream_bundle = run_bundle.compose_descriptor(data_keys=raw_data_keys,
-                                                               name='raw'
-                                                               # configuration=_metadata(path)
-                                                               )
-        yield 'descriptor', raw_data_stream_bundle.descriptor_doc
-        t = time.time()
-        yield 'event', raw_data_stream_bundle.compose_event(data={'raw': raw_data},
-                                                            timestamps={'raw': t})
-    except KeyError:
-        pass
+
+def _raw_data_keys(frame_shape) -> dict:
+    return {'raw': {'source': source,
+                    'dtype': 'array',
+                    'dims': ('q_x', 'q_y'),
+                    'shape': frame_shape},
+            'raw_frame_index': {'source': source,
+                                'dtype': 'integer',
+                                'shape': []}}
 
 
-    g2_data_keys = {'g2_curves': {'source': source,
+def _g2_data_keys(num_tau: int, tau_shape, num_dqlist: int) -> dict:
+    return {'g2_curves': {'source': source,
+                          'dtype': 'array',
+                          'dims': ('g2',),
+                          'shape': (num_tau,)},
+            'g2_tau': {'source': source,
+                       'dtype': 'array',
+                       'dims': ('tau',),
+                       'shape': tau_shape},
+            'g2_error_bars': {'source': source,
                               'dtype': 'array',
-                              'dims': ('g2',),
-                              'shape': (g2.shape[0],)},
-                    'g2_tau': {'source': source,
-                               'dtype': 'array',
-                               'dims': ('tau',),
-                               'shape': tau.shape},
-                    'g2_error_bars': {'source': source,
-                                      'dtype': 'array',
-                                      'dims': ('g2_errors',),
-                                      'shape': (g2.shape[0],)},
-                    'g2_dqlist': {'source': source,
-                               'dtype': 'array',
-                               'dims': ('dqlist',),
-                                  #TODO check what shape is needed here?
-                               'shape': (dqlist.shape[0],)},
-                    }
+                              'dims': ('g2_errors',),
+                              'shape': (num_tau,)},
+            'g2_dqlist': {'source': source,
+                          'dtype': 'array',
+                          'dims': ('dqlist',),
+                          #TODO check what shape is needed here?
+                          'shape': (num_dqlist,)},
+            }
 
-    SAXS_2D_keys = {'SAXS_2D': {'source': source,
-                             'dtype': 'array',
-                             'dims': ('q_x', 'q_y'),
-                             'shape': SAXS_2D_I.shape}}
 
-    SAXS_1D_keys = {'SAXS_1D_I': {'source': source,
-                                  'dtype': 'array',
-                                  'dims': ('I',),
-                                  'shape': SAXS_1D_I.shape},
-                    'SAXS_1D_Q': {'source': source,
+def _SAXS_2D_keys(shape) -> dict:
+    return {'SAXS_2D': {'source': source,
+                        'dtype': 'array',
+                        'dims': ('q_x', 'q_y'),
+                        'shape': shape}}
+
+
+def _SAXS_1D_keys(I_shape, Q_shape) -> dict:
+    return {'SAXS_1D_I': {'source': source,
+                          'dtype': 'array',
+                          'dims': ('I',),
+                          'shape': I_shape},
+            'SAXS_1D_Q': {'source': source,
+                          'dtype': 'array',
+                          'dims': ('Q',),
+                          'shape': Q_shape},
+            }
+
+
+def _SAXS_1D_I_partial_keys(shape) -> dict:
+    return {'SAXS_1D_I_partial': {'source': source,
                                   'dtype': 'array',
-                                  'dims': ('Q',),
-                                  'shape': SAXS_1D_Q.shape},
-                    }
+                                  'dims': ('N', 'I'),
+                                  'shape': shape},
+            }
 
-    SAXS_1D_I_partial_keys = {'SAXS_1D_I_partial': {'source': source,
+
+def _roi_keys(shape, mask: bool, rois: bool) -> dict:
+    keys = {}
+    if mask:
+        keys['mask'] = {'source': source,
+                        'dtype': 'array',
+                        'dims': ('q_x', 'q_y'),
+                        'shape': shape}
+    if rois:
+        keys['rois'] = {'source': source,
+                        'dtype': 'array',
+                        'dims': ('q_x', 'q_y'),
+                        'shape': shape}
+    return keys
+
+
+def _roi_statistics_keys(num_frames: int, num_rois: int) -> dict:
+    return {'roi_labels': {'source': source,
+                           'dtype': 'array',
+                           'dims': ('roi',),
+                           'shape': (num_rois,)},
+            'roi_pixel_count': {'source': source,
+                                'dtype': 'array',
+                                'dims': ('roi',),
+                                'shape': (num_rois,)},
+            'roi_mean_intensity': {'source': source,
+                                   'dtype': 'array',
+                                   'dims': ('frame', 'roi'),
+                                   'shape': (num_frames, num_rois)},
+            'roi_contrast': {'source': source,
                              'dtype': 'array',
-                             'dims': ('N', 'I'),
-                             'shape': SAXS_1D_I_partial.shape},
-                    }
-
-
-    #TODO: How to add multiple streams?
-    g2_stream_bundle = run_bundle.compose_descriptor(data_keys=g2_data_keys,
-                                                        name='primary'
-                                                        # configuration=_metadata(path)
-                                                        )
-    SAXS_2D_stream_bundle = run_bundle.compose_descriptor(data_keys=SAXS_2D_keys,
-                                                        name='SAXS_2D'
-                                                        # configuration=_metadata(path)
-                                                        )
-    SAXS_1D_stream_bundle = run_bundle.compose_descriptor(data_keys=SAXS_1D_keys,
-                                                        name='SAXS_1D'
-                                                        # configuration=_metadata(path)
-                                                        )
-    SAXS_1D_I_partial_stream_bundle = run_bundle.compose_descriptor(data_keys=SAXS_1D_I_partial_keys,
-                                                        name='SAXS_1D_I_partial'
-                                                        # configuration=_metadata(path)
-                                                        )
-
-
-    yield 'descriptor', g2_stream_bundle.descriptor_doc
-    yield 'descriptor', SAXS_2D_stream_bundle.descriptor_doc
-    yield 'descriptor', SAXS_1D_stream_bundle.descriptor_doc
-    yield 'descriptor', SAXS_1D_I_partial_stream_bundle.descriptor_doc
-
-
-    num_events = g2.shape[1]
-    for i in range(num_events):
+                             'dims': ('roi',),
+                             'shape': (num_rois,)},
+            }
+
+
+def _frame_screening_keys(num_frames: int, num_rois: int) -> dict:
+    return {'frame_total_intensity': {'source': source,
+                                      'dtype': 'array',
+                                      'dims': ('frame',),
+                                      'shape': (num_frames,)},
+            'frame_roi_mean': {'source': source,
+                               'dtype': 'array',
+                               'dims': ('frame', 'roi'),
+                               'shape': (num_frames, num_rois)},
+            'frame_similarity': {'source': source,
+                                 'dtype': 'array',
+                                 'dims': ('frame',),
+                                 'shape': (num_frames,)},
+            'frame_outlier': {'source': source,
+                              'dtype': 'array',
+                              'dims': ('frame',),
+                              'shape': (num_frames,)},
+            }
+
+
+def _read_mask(dataset) -> np.ndarray:
+    # A stack of masks is valid where all of them are
+    mask = profiling.record_hdf5_read(dataset[()]).astype(bool)
+    return mask.all(axis=0) if mask.ndim == 3 else mask
+
+
+def ingest_nxXPCS(paths,
+                  g2_page_size: int = None,
+                  raw_frame_range: Tuple[int, int] = None,
+                  raw_frame_stride: int = None,
+                  raw_block_size: int = None,
+                  cache: IngestCache = ingest_cache,
+                  use_converted: bool = True,
+                  roi_statistics: bool = False,
+                  frame_screening: bool = False):
+    """Ingest an nxXPCS NeXus file into a stream of bluesky documents.
+
+    The g2 curves of the 'primary' stream are emitted as event pages holding ``g2_page_size`` q-bins each;
+    by default all q-bins are emitted in a single page.
+
+    Raw frames are streamed as one event per frame, grouped into event pages of lazily loaded frame blocks
+    (``raw_block_size`` frames each, or blocks following the on-disk chunking by default). Use
+    ``raw_frame_range`` (start, stop) and ``raw_frame_stride`` to preview a subset of the frames.
+
+    Documents are replayed from ``cache`` when the file was ingested before with the same options;
+    pass ``cache=None`` to always parse the file.
+
+    With ``use_converted``, data are read from the conversion of the file written by ``convert_nxXPCS`` when it is
+    up to date with the file.
+
+    The mask and ROI label map of the file, if any, are emitted once in the 'rois' stream. With ``roi_statistics``,
+    the pixel count, mean intensity per frame and speckle contrast of every ROI are computed in one pass over the
+    streamed raw frames (or from SAXS_2D, without raw frames) and emitted in the 'roi_statistics' stream. This reads
+    the frames while ingesting, so it is off by default; the statistics are cached with the other documents, so the
+    frames are only read on the first ingest.
+
+    With ``frame_screening``, the streamed raw frames are screened for outliers (see ``screen_frames``, using the ROIs
+    of the file) in one more pass, and their total intensity, ROI means, similarity to a running reference and outlier
+    flags are emitted in the 'frame_screening' stream.
+    """
+    assert len(paths) == 1
+    path = paths[0]
+    ingest_kwargs = dict(g2_page_size=g2_page_size,
+                         raw_frame_range=raw_frame_range,
+                         raw_frame_stride=raw_frame_stride,
+                         raw_block_size=raw_block_size,
+                         roi_statistics=roi_statistics,
+                         frame_screening=frame_screening)
+
+    converted = find_converted(path) if use_converted else None
+    # Documents composed from a conversion reference it instead of the file
+    # Options left at their defaults keep the keys of entries written before the options existed
+    cache_kwargs = dict(ingest_kwargs, roi_statistics=roi_statistics or None,
+                        frame_screening=frame_screening or None, converted=str(converted) if converted else None)
+
+    with profiling.stage('ingest.cache_lookup', path=str(path)):
+        documents = cache.get(path, **cache_kwargs) if cache is not None else None
+    if documents is not None:
+        yield from profiling.trace_documents(documents, 'ingest.cached')
+        return
+
+    documents = []
+    for name, doc in profiling.trace_documents(_compose_nxXPCS(converted or path, **ingest_kwargs),
+                                               'ingest.compose'):
+        documents.append((name, doc))
+        yield name, doc
+
+    if cache is not None:
+        with profiling.stage('ingest.cache_store', path=str(path)):
+            cache.put(path, documents, **cache_kwargs)
+
+
+def _compose_nxXPCS(path,
+                    g2_page_size: int = None,
+                    raw_frame_range: Tuple[int, int] = None,
+                    raw_frame_stride: int = None,
+                    raw_block_size: int = None,
+                    roi_statistics: bool = False,
+                    frame_screening: bool = False,
+                    reduction=None,
+                    screening=None):
+    # ``reduction`` (a FrameReduction) replaces the precomputed SAXS_2D, SAXS_1D and I_partial datasets;
+    # ``screening`` (a FrameScreen) is emitted as it is rather than computed
+    with handle_pool.open(path) as h5:
+        # Compose run start
+        run_bundle = event_model.compose_run()  # type: event_model.ComposeRunBundle
+        start_doc = run_bundle.start_doc
+        # Converted files carry the name of the file they were converted from
+        start_doc["sample_name"] = h5.attrs.get(sample_name_attribute, Path(path).resolve().stem)
+        start_doc["projections"] = projections
+        yield 'start', start_doc
+
+        #gather data from h5 file
+        g2 = h5[g2_projection_key]
+        tau = profiling.record_hdf5_read(h5[tau_projection_key][0])
+        g2_errors = h5[g2_error_projection_key]
+        mask = _read_mask(h5[XPCS_mask_projection_key]) if XPCS_mask_projection_key in h5 else None
+        rois = profiling.record_hdf5_read(h5[XPCS_roi_projection_key][()]) \
+            if XPCS_roi_projection_key in h5 else None
+        dqlist = h5[dqlist_key]
+        # dqlist = list(map(lambda bytestring: bytestring.decode('UTF-8'), h5[dqlist_key][()]))
+        if reduction is None:
+            with profiling.stage('ingest.dask_graph'):
+                SAXS_2D_I = lazy_array(path, SAXS_2D_I_projection_key)
+                SAXS_1D_I_partial = lazy_array(path, SAXS_1D_I_partial_projection_key)
+            with profiling.stage('ingest.hdf5_read'):
+                SAXS_1D_I = profiling.record_hdf5_read(h5[SAXS_1D_I_projection_key][0])
+                SAXS_1D_Q = profiling.record_hdf5_read(h5[SAXS_1D_Q_projection_key][0])
+        else:
+            SAXS_2D_I, SAXS_1D_I = reduction.mean_image, reduction.I
+            SAXS_1D_Q, SAXS_1D_I_partial = reduction.q, reduction.I_partial
+
+        sparse_frames = None
+        # The streamed frames, which the ROI statistics and the frame screening are computed over
+        selected_frames = None
+        try:
+            with profiling.stage('ingest.dask_graph'):
+                raw_data = lazy_array(path, raw_data_projection_key)
+        except KeyError:
+            if raw_sparse_projection_key in h5:
+                # Frames are densified chunk by chunk, only when displayed or computed
+                sparse_frames = SparseFrames.from_hdf5(path, raw_sparse_projection_key)
+                raw_data = sparse_frames.to_dask(raw_block_size or 64)
+            else:
+                raw_data = None
+
+        if raw_data is not None:
+            # Stream the (optionally sub-sampled) frames as event pages of lazily loaded frame blocks
+            frame_start, frame_stop = raw_frame_range or (0, raw_data.shape[0])
+            frame_indices = np.arange(raw_data.shape[0])[frame_start:frame_stop:raw_frame_stride]
+            frames = raw_data[frame_start:frame_stop:raw_frame_stride]
+            if raw_block_size:
+                frames = frames.rechunk({0: raw_block_size})
+            # Sparse frames are reduced without densifying, unless only some of them are streamed
+            selected_frames = sparse_frames if sparse_frames is not None and not raw_frame_range \
+                and not raw_frame_stride else frames
+
+            raw_data_stream_bundle = run_bundle.compose_descriptor(data_keys=_raw_data_keys(frames.shape[1:]),
+                                                                   name='raw'
+                                                                   # configuration=_metadata(path)
+                                                                   )
+            yield 'descriptor', raw_data_stream_bundle.descriptor_doc
+
+            block_start = 0
+            for block_size in frames.chunks[0]:
+                block_stop = block_start + block_size
+                t = np.full(block_size, time.time())
+                yield 'event_page', raw_data_stream_bundle.compose_event_page(
+                    data={'raw': frames[block_start:block_stop],
+                          'raw_frame_index': frame_indices[block_start:block_stop]},
+                    timestamps={'raw': t,
+                                'raw_frame_index': t},
+                    seq_num=list(range(block_start + 1, block_stop + 1)))
+                block_start = block_stop
+
+
+        g2_data_keys = _g2_data_keys(g2.shape[0], tau.shape, dqlist.shape[0])
+        SAXS_2D_keys = _SAXS_2D_keys(SAXS_2D_I.shape)
+        SAXS_1D_keys = _SAXS_1D_keys(SAXS_1D_I.shape, SAXS_1D_Q.shape)
+        SAXS_1D_I_partial_keys = _SAXS_1D_I_partial_keys(SAXS_1D_I_partial.shape)
+
+
+        #TODO: How to add multiple streams?
+        g2_stream_bundle = run_bundle.compose_descriptor(data_keys=g2_data_keys,
+                                                            name='primary'
+                                                            # configuration=_metadata(path)
+                                                            )
+        SAXS_2D_stream_bundle = run_bundle.compose_descriptor(data_keys=SAXS_2D_keys,
+                                                            name='SAXS_2D'
+                                                            # configuration=_metadata(path)
+                                                            )
+        SAXS_1D_stream_bundle = run_bundle.compose_descriptor(data_keys=SAXS_1D_keys,
+                                                            name='SAXS_1D'
+                                                            # configuration=_metadata(path)
+                                                            )
+        SAXS_1D_I_partial_stream_bundle = run_bundle.compose_descriptor(data_keys=SAXS_1D_I_partial_keys,
+                                                            name='SAXS_1D_I_partial'
+                                                            # configuration=_metadata(path)
+                                                            )
+
+
+        yield 'descriptor', g2_stream_bundle.descriptor_doc
+        yield 'descriptor', SAXS_2D_stream_bundle.descriptor_doc
+        yield 'descriptor', SAXS_1D_stream_bundle.descriptor_doc
+        yield 'descriptor', SAXS_1D_I_partial_stream_bundle.descriptor_doc
+
+
+        # Read each g2 dataset once and emit the q-bins as event pages, rather than one strided read per event
+        with profiling.stage('ingest.hdf5_read'):
+            g2_curves = profiling.record_hdf5_read(g2[()]).T
+            g2_error_bars = profiling.record_hdf5_read(g2_errors[()]).T
+            g2_dqlist = profiling.record_hdf5_read(dqlist[()]).T
+        num_events = g2_curves.shape[0]
+        page_size = g2_page_size or max(num_events, 1)
+        for start in range(0, num_events, page_size):
+            stop = min(start + page_size, num_events)
+            t = np.full(stop - start, time.time())
+            yield 'event_page', g2_stream_bundle.compose_event_page(data={'g2_curves': g2_curves[start:stop],
+                                                                          'g2_tau': np.broadcast_to(tau, (stop - start, *tau.shape)),
+                                                                          'g2_error_bars': g2_error_bars[start:stop],
+                                                                          'g2_dqlist': g2_dqlist[start:stop]
+                                                                          },
+                                                                    timestamps={'g2_curves': t,
+                                                                                'g2_tau': t,
+                                                                                'g2_error_bars': t,
+                                                                                'g2_dqlist': t
+                                                                                },
+                                                                    seq_num=list(range(start + 1, stop + 1)))
         t = time.time()
-        yield 'event', g2_stream_bundle.compose_event(data={'g2_curves': g2[:, i],
-                                                             'g2_tau': tau,
-                                                             'g2_error_bars': g2_errors[:, i],
-                                                             'g2_dqlist': dqlist[:, i]
-                                                            },
-                                                      timestamps={'g2_curves': t,
-                                                                  'g2_tau': t,
-                                                                  'g2_error_bars': t,
-                                                                  'g2_dqlist': t
-                                                                  })
-    t = time.time()
-    yield 'event', SAXS_2D_stream_bundle.compose_event(data={'SAXS_2D': SAXS_2D_I},
-                                                       timestamps={'SAXS_2D': t})
+        yield 'event', SAXS_2D_stream_bundle.compose_event(data={'SAXS_2D': SAXS_2D_I},
+                                                           timestamps={'SAXS_2D': t})
+        t = time.time()
+        yield 'event', SAXS_1D_stream_bundle.compose_event(data={'SAXS_1D_I': SAXS_1D_I,
+                                                                 'SAXS_1D_Q': SAXS_1D_Q},
+                                                           timestamps={'SAXS_1D_I': t,
+                                                                       'SAXS_1D_Q': t})
+        # num_curves = SAXS_1D_I_partial.shape[1]
+        # for i in range(num_curves):
+        t = time.time()
+        yield 'event', SAXS_1D_I_partial_stream_bundle.compose_event(data={'SAXS_1D_I_partial': SAXS_1D_I_partial},
+                                                                     timestamps={'SAXS_1D_I_partial': t})
+
+        if mask is not None or rois is not None:
+            yield from _compose_rois(run_bundle, mask, rois)
+        if roi_statistics and rois is not None:
+            yield from _compose_roi_statistics(run_bundle, roi_labels(rois, mask), SAXS_2D_I, frames=selected_frames)
+
+        if screening is None and frame_screening and selected_frames is not None:
+            index = QROIIndex.from_labels(roi_labels(rois, mask)) if rois is not None else None
+            with profiling.stage('ingest.frame_screening'):
+                screening = screen_frames(selected_frames, index if index is not None and index.num_bins else None)
+        if screening is not None:
+            yield from _compose_screening(run_bundle, screening)
+
+        yield 'stop', run_bundle.compose_stop()
+
+
+def _roi_data(mask, rois) -> dict:
+    # Event data of the 'rois' stream: the compact mask and the ROI labels combined with it
+    data = {}
+    if mask is not None:
+        data['mask'] = compact_labels(mask)
+    if rois is not None:
+        data['rois'] = roi_labels(rois, mask)
+    return data
+
+
+def _compose_rois(run_bundle, mask, rois):
+    # The mask and ROI label map are emitted once, in a stream of their own, rather than with every frame
+    data = _roi_data(mask, rois)
+    shape = next(iter(data.values())).shape
+    rois_bundle = run_bundle.compose_descriptor(data_keys=_roi_keys(shape, 'mask' in data, 'rois' in data),
+                                                name='rois')
+    yield 'descriptor', rois_bundle.descriptor_doc
     t = time.time()
-    yield 'event', SAXS_1D_stream_bundle.compose_event(data={'SAXS_1D_I': SAXS_1D_I,
-                                                             'SAXS_1D_Q': SAXS_1D_Q},
-                                                       timestamps={'SAXS_1D_I': t,
-                                                                   'SAXS_1D_Q': t})
-    # num_curves = SAXS_1D_I_partial.shape[1]
-    # for i in range(num_curves):
+    yield 'event', rois_bundle.compose_event(data=data, timestamps={key: t for key in data})
+
+
+def _compose_roi_statistics(run_bundle, labels, SAXS_2D_I, frames=None):
+    # Statistics over the frames when there are any, otherwise over SAXS_2D
+    index = QROIIndex.from_labels(labels)
+    if not index.num_bins:
+        return
+    with profiling.stage('ingest.roi_statistics', rois=index.num_bins):
+        if frames is not None:
+            stats = compute_roi_statistics(frames, index)
+        else:
+            stats = image_roi_statistics(np.squeeze(np.asarray(SAXS_2D_I)), index)
+
+    statistics_bundle = run_bundle.compose_descriptor(data_keys=_roi_statistics_keys(stats.num_frames,
+                                                                                     index.num_bins),
+                                                      name='roi_statistics')
+    yield 'descriptor', statistics_bundle.descriptor_doc
+    data = {'roi_labels': stats.labels,
+            'roi_pixel_count': stats.pixel_count,
+            'roi_mean_intensity': stats.mean_intensity,
+            'roi_contrast': stats.contrast}
     t = time.time()
-    yield 'event', SAXS_1D_I_partial_stream_bundle.compose_event(data={'SAXS_1D_I_partial': SAXS_1D_I_partial},
-                                                                 timestamps={'SAXS_1D_I_partial': t})
+    yield 'event', statistics_bundle.compose_event(data=data, timestamps={key: t for key in data})
 
-    yield 'stop', run_bundle.compose_stop()
+
+def _compose_screening(run_bundle, screening):
+    # One event holding the statistics of all frames
+    screening_bundle = run_bundle.compose_descriptor(data_keys=_frame_screening_keys(screening.num_frames,
+                                                                                     screening.roi_mean.shape[1]),
+                                                     name='frame_screening')
+    yield 'descriptor', screening_bundle.descriptor_doc
+    data = {'frame_total_intensity': screening.total_intensity,
+            'frame_roi_mean': screening.roi_mean,
+            'frame_similarity': screening.similarity,
+            'frame_outlier': screening.outliers}
+    t = time.time()
+    yield 'event', screening_bundle.compose_event(data=data, timestamps={key: t for key in data})
@@ -0,0 +1,114 @@
+import os
+import pickle
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from typing import Iterable, List, Tuple
+
+from . import ingest_nxXPCS
+from ..transport import attach_documents, share_documents
+
+
+@dataclass
+class IngestResult:
+    """Documents (or the error) produced by ingesting a single file."""
+    path: str
+    documents: List[Tuple[str, dict]] = None
+    error: Exception = None
+    traceback: str = None
+    nbytes: int = 0
+    elapsed: float = 0.
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+@dataclass
+class BatchIngestReport:
+    """Ordered per-file results of a batch ingestion, with throughput statistics."""
+    results: List[IngestResult] = field(default_factory=list)
+    elapsed: float = 0.
+
+    @property
+    def nbytes(self) -> int:
+        return sum(result.nbytes for result in self.results)
+
+    @property
+    def failed(self) -> List[IngestResult]:
+        return [result for result in self.results if not result.ok]
+
+    @property
+    def files_per_second(self) -> float:
+        return len(self.results) / self.elapsed if self.elapsed else float('inf')
+
+    @property
+    def megabytes_per_second(self) -> float:
+        return self.nbytes / 1e6 / self.elapsed if self.elapsed else float('inf')
+
+    def __str__(self):
+        return (f"Ingested {len(self.results) - len(self.failed)}/{len(self.results)} files "
+                f"({self.nbytes / 1e6:.1f} MB) in {self.elapsed:.2f} s: "
+                f"{self.files_per_second:.1f} files/s, {self.megabytes_per_second:.1f} MB/s")
+
+
+def _ingest_one(path, ingest_kwargs, share_min_bytes: int = None, portable: bool = False) -> IngestResult:
+    start = time.perf_counter()
+    result = IngestResult(path=str(path))
+    try:
+        result.nbytes = os.path.getsize(path)
+        result.documents = list(ingest_nxXPCS([path], **ingest_kwargs))
+        if share_min_bytes is not None:
+            result.documents = share_documents(result.documents, min_bytes=share_min_bytes)
+    except Exception as ex:
+        result.error = _portable_error(ex) if portable else ex
+        result.traceback = traceback.format_exc()
+    result.elapsed = time.perf_counter() - start
+    return result
+
+
+def _portable_error(ex: Exception) -> Exception:
+    # An exception that can't make the round trip back from a worker would break the whole pool
+    try:
+        pickle.loads(pickle.dumps(ex))
+        return ex
+    except Exception:
+        return RuntimeError(f"{type(ex).__name__}: {ex}")
+
+
+def ingest_nxXPCS_batch(paths: Iterable,
+                        max_workers: int = None,
+                        mp_context=None,
+                        share_min_bytes: int = None,
+                        **ingest_kwargs) -> BatchIngestReport:
+    """Ingest many nxXPCS files, parsing them in a pool of ``max_workers`` processes.
+
+    Results are returned in the order of ``paths``; a file that fails to ingest is reported in its own
+    IngestResult and does not affect the others. If a worker dies (e.g. in a crashing HDF5 filter), the files it
+    and the other workers had not finished are reported as failed with a BrokenProcessPool error. Large datasets come back as lazy references into the
+    original files. Extra keyword arguments are passed to ``ingest_nxXPCS``.
+
+    With ``share_min_bytes``, NumPy arrays of at least that size read by the workers come back through shared
+    memory instead of being pickled, as dask arrays wrapping the shared buffers (see ``xicam.XPCS.transport``).
+    """
+    paths = list(paths)
+    start = time.perf_counter()
+    if max_workers == 1:
+        results = [_ingest_one(path, ingest_kwargs) for path in paths]
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers, mp_context=mp_context) as executor:
+            futures = [executor.submit(_ingest_one, path, ingest_kwargs, share_min_bytes, portable=True)
+                       for path in paths]
+            results = []
+            for path, future in zip(paths, futures):
+                try:
+                    results.append(future.result())
+                except Exception as ex:
+                    # The worker died, or its result couldn't be pickled
+                    results.append(IngestResult(path=str(path), error=ex, traceback=traceback.format_exc()))
+        if share_min_bytes is not None:
+            for result in results:
+                if result.ok:
+                    result.documents = attach_documents(result.documents)
+    return BatchIngestReport(results=results, elapsed=time.perf_counter() - start)
@@ -0,0 +1,125 @@
+import hashlib
+import os
+import pickle
+import tempfile
+import threading
+from pathlib import Path
+from typing import List, Tuple
+
+from xicam.core.paths import user_cache_dir
+
+# Bump when the layout of the ingested documents changes, so stale entries are never replayed
+# 2: the mask and ROIs are emitted in the 'rois' stream
+CACHE_VERSION = 2
+
+
+def _file_digest(path, block_size: int = 2 ** 20) -> str:
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class IngestCache:
+    """Persistent on-disk cache of ingested document streams.
+
+    Entries are keyed by the file's resolved path, size and mtime (and optionally a hash of its contents),
+    together with the ingestion options. Only small arrays are stored; large datasets are pickled as lazy
+    references into the original file. The least recently used entries are evicted once the cache grows
+    beyond ``max_bytes``.
+    """
+
+    suffix = '.pkl'
+
+    def __init__(self, directory=None, max_bytes: int = 2 ** 30, content_hash: bool = False, enabled: bool = True):
+        self.directory = Path(directory or os.path.join(user_cache_dir, 'XPCS', 'ingest'))
+        self.max_bytes = max_bytes
+        self.content_hash = content_hash
+        self.enabled = enabled
+        self._lock = threading.Lock()
+
+    def key(self, path, **ingest_kwargs) -> str:
+        path = Path(path).resolve()
+        stat = path.stat()
+        options = sorted((name, value) for name, value in ingest_kwargs.items() if value is not None)
+        identity = [CACHE_VERSION, str(path), stat.st_size, stat.st_mtime_ns, options]
+        if self.content_hash:
+            identity.append(_file_digest(path))
+        return hashlib.blake2b(repr(identity).encode(), digest_size=16).hexdigest()
+
+    def _entry(self, key: str) -> Path:
+        return self.directory / f'{key}{self.suffix}'
+
+    def get(self, path, **ingest_kwargs) -> List[Tuple[str, dict]]:
+        if not self.enabled:
+            return None
+        entry = self._entry(self.key(path, **ingest_kwargs))
+        try:
+            with open(entry, 'rb') as f:
+                documents = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception:
+            # Unreadable or stale entry (e.g. the file it references moved); drop it
+            entry.unlink(missing_ok=True)
+            return None
+        # Mark as recently used
+        os.utime(entry)
+        return documents
+
+    def put(self, path, documents: List[Tuple[str, dict]], **ingest_kwargs):
+        if not self.enabled:
+            return
+        self.directory.mkdir(parents=True, exist_ok=True)
+        entry = self._entry(self.key(path, **ingest_kwargs))
+        # Write atomically so concurrent readers (e.g. batch ingestion workers) never see partial entries
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(documents, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, entry)
+        except Exception:
+            os.unlink(tmp)
+            raise
+        self.evict()
+
+    def entries(self) -> List[Path]:
+        if not self.directory.is_dir():
+            return []
+        return list(self.directory.glob(f'*{self.suffix}'))
+
+    @property
+    def nbytes(self) -> int:
+        return sum(entry.stat().st_size for entry in self.entries())
+
+    def evict(self):
+        with self._lock:
+            entries = []
+            for entry in self.entries():
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry))
+            entries.sort()
+            total = sum(size for _, size, _ in entries)
+            for _, size, entry in entries:
+                if total <= self.max_bytes:
+                    break
+                if self._in_use(entry):
+                    continue
+                entry.unlink(missing_ok=True)
+                total -= size
+
+    def _in_use(self, entry: Path) -> bool:
+        # Entries that eviction must leave alone
+        return False
+
+    def clear(self):
+        for entry in self.entries():
+            entry.unlink(missing_ok=True)
+
+
+ingest_cache = IngestCache(directory=os.environ.get('XICAM_XPCS_CACHE_DIR'),
+                           enabled=os.environ.get('XICAM_XPCS_INGEST_CACHE', '1') != '0')
@@ -0,0 +1,314 @@
+"""Header-only scanning of nxXPCS files into a searchable SQLite index.
+
+``header_documents`` reads only the attributes and the shapes and dtypes of the datasets referenced by the nxXPCS
+projection (plus the q values of the dqlist), so a file is summarized without reading any frames or curves.
+``CatalogIndex`` keeps these summaries in a SQLite database, rescanning only files whose size or mtime changed,
+searches them by sample name, q range and frame count, and builds catalogs whose runs are fully ingested (with
+``ingest_nxXPCS``) only when their events are first read.
+"""
+import json
+import os
+import sqlite3
+import time
+import traceback
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Iterable, List, Tuple
+
+import event_model
+import h5py
+import numpy as np
+from xicam.core.paths import user_cache_dir
+
+from . import _g2_data_keys, _raw_data_keys, _roi_keys, _SAXS_1D_I_partial_keys, _SAXS_1D_keys, _SAXS_2D_keys, \
+              dqlist_key, g2_projection_key, ingest_nxXPCS, projections, raw_data_projection_key, \
+              raw_sparse_projection_key, SAXS_1D_I_partial_projection_key, SAXS_1D_I_projection_key, \
+              SAXS_1D_Q_projection_key, SAXS_2D_I_projection_key, tau_projection_key, XPCS_mask_projection_key, \
+              XPCS_roi_projection_key
+from .convert import sample_name_attribute
+
+# Bump when the scanned summary or documents change, so indexes are rebuilt
+SCAN_VERSION = 2
+
+# Default location of the index
+index_path = Path(os.environ.get('XICAM_XPCS_CATALOG_INDEX', os.path.join(user_cache_dir, 'XPCS', 'catalog.sqlite')))
+
+
+def _run_uid(path: Path, stat: os.stat_result) -> str:
+    # Stable across scans of an unchanged file, so indexed runs keep their uid
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, f'{path}:{stat.st_size}:{stat.st_mtime_ns}'))
+
+
+def header_documents(path) -> List[Tuple[str, dict]]:
+    """Return the start, descriptor and stop documents of an nxXPCS file without any events, reading only its
+    headers. The start document holds an ``nxXPCS`` summary: path, number of q-bins, q range, number of tau and
+    number and shape of raw frames."""
+    path = Path(path).resolve()
+    stat = path.stat()
+    with h5py.File(path, 'r') as h5:
+        # Shared with the composers; set below to the events the file holds, as none are composed here
+        event_counters = {}
+        run_bundle = event_model.compose_run(uid=_run_uid(path, stat), event_counters=event_counters)
+        start_doc = run_bundle.start_doc
+        start_doc['sample_name'] = h5.attrs.get(sample_name_attribute, path.stem)
+        start_doc['projections'] = projections
+
+        g2 = h5[g2_projection_key]
+        tau_shape = h5[tau_projection_key].shape[1:]
+        # The only values read: a few q per q-bin, for searching by q
+        dqlist = h5[dqlist_key][()]
+        descriptors = {'primary': _g2_data_keys(g2.shape[0], tau_shape, dqlist.shape[0]),
+                       'SAXS_2D': _SAXS_2D_keys(h5[SAXS_2D_I_projection_key].shape),
+                       'SAXS_1D': _SAXS_1D_keys(h5[SAXS_1D_I_projection_key].shape[1:],
+                                                h5[SAXS_1D_Q_projection_key].shape[1:]),
+                       'SAXS_1D_I_partial': _SAXS_1D_I_partial_keys(h5[SAXS_1D_I_partial_projection_key].shape)}
+        num_events = {'primary': g2.shape[1], 'SAXS_2D': 1, 'SAXS_1D': 1, 'SAXS_1D_I_partial': 1}
+
+        num_frames, frame_shape = 0, None
+        if raw_data_projection_key in h5:
+            num_frames, *frame_shape = h5[raw_data_projection_key].shape
+        elif raw_sparse_projection_key in h5:
+            group = h5[raw_sparse_projection_key]
+            num_frames, frame_shape = group['indptr'].shape[0] - 1, group.attrs['frame_shape'].tolist()
+        if frame_shape is not None:
+            descriptors = dict(raw=_raw_data_keys(tuple(frame_shape)), **descriptors)
+            num_events['raw'] = num_frames
+
+        # The ROI statistics stream needs the ROI labels, so it only appears on the full ingest
+        has_mask, has_rois = XPCS_mask_projection_key in h5, XPCS_roi_projection_key in h5
+        if has_mask or has_rois:
+            label_shape = h5[XPCS_mask_projection_key if has_mask else XPCS_roi_projection_key].shape[-2:]
+            descriptors['rois'] = _roi_keys(label_shape, has_mask, has_rois)
+            num_events['rois'] = 1
+
+        start_doc['nxXPCS'] = {'path': str(path),
+                               'num_q': int(g2.shape[1]),
+                               'q_range': [float(np.min(dqlist)), float(np.max(dqlist))] if dqlist.size else None,
+                               'num_tau': int(g2.shape[0]),
+                               'num_frames': int(num_frames),
+                               'frame_shape': [int(size) for size in frame_shape] if frame_shape is not None else None}
+
+    documents = [('start', start_doc)]
+    for name, data_keys in descriptors.items():
+        documents.append(('descriptor', run_bundle.compose_descriptor(data_keys=data_keys, name=name).descriptor_doc))
+    # Counters hold the next seq_num of each stream; compose_stop validates the document it builds from them
+    event_counters.update({name: count + 1 for name, count in num_events.items()})
+    documents.append(('stop', run_bundle.compose_stop()))
+    return documents
+
+
+def ingest_nxXPCS_header(paths):
+    """Ingest only the start, descriptor and stop documents of an nxXPCS file (see ``header_documents``)."""
+    assert len(paths) == 1
+    yield from header_documents(paths[0])
+
+
+def lazy_documents(path, uid: str, **ingest_kwargs):
+    """Fully ingest ``path`` with ``ingest_nxXPCS``, relabelled as the run ``uid`` of its header documents."""
+    for name, doc in ingest_nxXPCS([path], **ingest_kwargs):
+        if name == 'start':
+            doc = dict(doc, uid=uid)
+        elif name in ('descriptor', 'stop'):
+            doc = dict(doc, run_start=uid)
+        yield name, doc
+
+
+@dataclass
+class IndexEntry:
+    """The indexed summary of one nxXPCS file."""
+    path: str
+    uid: str
+    sample_name: str
+    num_q: int
+    q_min: float
+    q_max: float
+    num_tau: int
+    num_frames: int
+    documents: List[Tuple[str, dict]] = field(repr=False)
+
+    @property
+    def start(self) -> dict:
+        return self.documents[0][1]
+
+    @property
+    def stop(self) -> dict:
+        return self.documents[-1][1]
+
+
+@dataclass
+class ScanReport:
+    """What an index update scanned, skipped and failed on, with its throughput."""
+    scanned: int = 0
+    unchanged: int = 0
+    removed: int = 0
+    failed: List[Tuple[str, str]] = field(default_factory=list)
+    elapsed: float = 0.
+
+    @property
+    def files_per_second(self) -> float:
+        total = self.scanned + self.unchanged + len(self.failed)
+        return total / self.elapsed if self.elapsed else float('inf')
+
+    def __str__(self):
+        return (f"Scanned {self.scanned} files ({self.unchanged} unchanged, {len(self.failed)} failed, "
+                f"{self.removed} removed) in {self.elapsed:.2f} s: {self.files_per_second:.1f} files/s")
+
+
+def _json_default(value):
+    if isinstance(value, (np.generic, np.ndarray)):
+        return value.tolist()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def _scan_one(path: str):
+    try:
+        stat = os.stat(path)
+        documents = header_documents(path)
+        return path, stat.st_size, stat.st_mtime_ns, documents, None
+    except Exception:
+        return path, None, None, None, traceback.format_exc(limit=1)
+
+
+class CatalogIndex:
+    """SQLite index of the headers of many nxXPCS files.
+
+    ``update`` scans files (or directories, recursively for ``pattern``) in ``max_workers`` processes and stores one
+    row per file; files whose size and mtime are unchanged are not reopened. ``search`` filters the rows and
+    ``catalog`` turns them into a BlueskyInMemoryCatalog whose runs ingest their files on first access.
+    """
+
+    columns = ('path', 'size', 'mtime_ns', 'uid', 'sample_name', 'num_q', 'q_min', 'q_max', 'num_tau', 'num_frames',
+               'documents')
+
+    def __init__(self, path=None):
+        self.path = Path(path or index_path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._connection = sqlite3.connect(str(self.path), check_same_thread=False)
+        with self._connection as connection:
+            if connection.execute('PRAGMA user_version').fetchone()[0] != SCAN_VERSION:
+                connection.execute('DROP TABLE IF EXISTS files')
+                connection.execute(f'PRAGMA user_version = {SCAN_VERSION}')
+            connection.execute('CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, size INTEGER, '
+                               'mtime_ns INTEGER, uid TEXT, sample_name TEXT, num_q INTEGER, q_min REAL, '
+                               'q_max REAL, num_tau INTEGER, num_frames INTEGER, documents TEXT)')
+            connection.execute('CREATE INDEX IF NOT EXISTS files_sample_name ON files (sample_name)')
+
+    def __len__(self):
+        return self._connection.execute('SELECT COUNT(*) FROM files').fetchone()[0]
+
+    def close(self):
+        self._connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @staticmethod
+    def _files(paths: Iterable, pattern: str) -> Tuple[List[str], List[Path]]:
+        files, directories = [], []
+        for path in paths:
+            path = Path(path).resolve()
+            if path.is_dir():
+                directories.append(path)
+                files.extend(str(file) for file in sorted(path.rglob(pattern)) if file.is_file())
+            else:
+                files.append(str(path))
+        return files, directories
+
+    def update(self, paths: Iterable, pattern: str = '*.nxs', max_workers: int = None, mp_context=None) -> ScanReport:
+        """Scan new and changed files among ``paths`` (files or directories) and drop indexed files that are gone
+        from the scanned directories."""
+        start = time.perf_counter()
+        report = ScanReport()
+        if isinstance(paths, (str, os.PathLike)):
+            paths = [paths]
+        files, directories = self._files(paths, pattern)
+
+        known = dict((path, (size, mtime_ns)) for path, size, mtime_ns
+                     in self._connection.execute('SELECT path, size, mtime_ns FROM files'))
+        changed = []
+        for file in files:
+            stat = os.stat(file)
+            if known.get(file) == (stat.st_size, stat.st_mtime_ns):
+                report.unchanged += 1
+            else:
+                changed.append(file)
+
+        if max_workers == 1 or len(changed) < 2:
+            results = [_scan_one(file) for file in changed]
+        else:
+            # Files are scanned in chunks, so the per-file overhead of the pool stays small for many small files
+            chunksize = max(1, min(64, len(changed) // (4 * (max_workers or os.cpu_count()))))
+            with ProcessPoolExecutor(max_workers=max_workers, mp_context=mp_context) as executor:
+                results = list(executor.map(_scan_one, changed, chunksize=chunksize))
+
+        rows = []
+        for path, size, mtime_ns, documents, error in results:
+            if error is not None:
+                report.failed.append((path, error))
+                continue
+            summary = documents[0][1]['nxXPCS']
+            q_min, q_max = summary['q_range'] or (None, None)
+            rows.append((path, size, mtime_ns, documents[0][1]['uid'], documents[0][1]['sample_name'],
+                         summary['num_q'], q_min, q_max, summary['num_tau'], summary['num_frames'],
+                         json.dumps(documents, default=_json_default)))
+        report.scanned = len(rows)
+
+        scanned = set(files)
+        missing = [path for path in known if path not in scanned
+                   and any(Path(path).is_relative_to(directory) for directory in directories)
+                   and not os.path.exists(path)]
+        with self._connection as connection:
+            connection.executemany(f'INSERT OR REPLACE INTO files VALUES ({", ".join("?" * len(self.columns))})', rows)
+            connection.executemany('DELETE FROM files WHERE path = ?', [(path,) for path in missing])
+        report.removed = len(missing)
+        report.elapsed = time.perf_counter() - start
+        return report
+
+    def search(self,
+               sample_name: str = None,
+               q: float = None,
+               q_range: Tuple[float, float] = None,
+               min_frames: int = None,
+               max_frames: int = None) -> List[IndexEntry]:
+        """Return the indexed files matching all given criteria, ordered by path.
+
+        ``sample_name`` is an SQL LIKE pattern (e.g. 'Aerogel%'); ``q`` must lie within the q range of a file and
+        ``q_range`` (min, max) must overlap it; ``min_frames`` and ``max_frames`` bound the number of raw frames.
+        """
+        conditions, values = [], []
+        if sample_name is not None:
+            conditions.append('sample_name LIKE ?')
+            values.append(sample_name)
+        if q is not None:
+            conditions.append('q_min <= ? AND ? <= q_max')
+            values.extend([q, q])
+        if q_range is not None:
+            conditions.append('q_min <= ? AND ? <= q_max')
+            values.extend([q_range[1], q_range[0]])
+        if min_frames is not None:
+            conditions.append('num_frames >= ?')
+            values.append(min_frames)
+        if max_frames is not None:
+            conditions.append('num_frames <= ?')
+            values.append(max_frames)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+        rows = self._connection.execute(f'SELECT path, uid, sample_name, num_q, q_min, q_max, num_tau, num_frames, '
+                                        f'documents FROM files {where} ORDER BY path', values)
+        return [IndexEntry(*row[:-1], documents=[tuple(document) for document in json.loads(row[-1])])
+                for row in rows]
+
+    def catalog(self, entries: List[IndexEntry] = None, **search):
+        """Return a BlueskyInMemoryCatalog of ``entries`` (or of the files matching ``search``); each run is
+        ingested only when its events are first read, with ``ingest_nxXPCS``."""
+        from databroker.in_memory import BlueskyInMemoryCatalog
+
+        entries = self.search(**search) if entries is None else entries
+        catalog = BlueskyInMemoryCatalog()
+        for entry in entries:
+            catalog.upsert(entry.start, entry.stop, lazy_documents, [entry.path, entry.uid], {})
+        return catalog
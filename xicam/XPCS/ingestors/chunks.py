@@ -0,0 +1,231 @@
+"""Reading compressed HDF5 datasets chunk by chunk, decompressing the chunks in parallel.
+
+h5py decompresses the chunks of a selection one after the other, inside one call that holds the library lock, so a
+read of a compressed frame stack runs on a single core. ``ChunkReader`` instead reads the raw, still-compressed
+chunks with ``read_direct_chunk`` and undoes the filter pipeline itself on a thread pool; the decoders of the
+built-in filters (zlib, LZ4, bitshuffle) release the GIL, so the decompression scales with the number of cores.
+
+Decoders are looked up by HDF5 filter id in ``decoders`` and can be added with ``register_decoder``. Datasets with a
+filter that has no decoder (e.g. LZF or szip), unchunked datasets and fancy indexing are read with h5py as usual.
+"""
+import os
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from itertools import product
+from typing import Callable, Dict, Tuple
+
+import numpy as np
+
+try:
+    # Registers the plugin filters (LZ4, bitshuffle, ...) for the h5py fallback
+    import hdf5plugin
+except ImportError:
+    hdf5plugin = None
+
+try:
+    import lz4.block
+except ImportError:
+    lz4 = None
+
+try:
+    import bitshuffle
+except ImportError:
+    bitshuffle = None
+
+# 'parallel' reads compressed datasets through ChunkReader, 'h5py' always reads through h5py
+read_backend = os.environ.get('XICAM_XPCS_READ_BACKEND', 'parallel')
+
+# Threads decompressing chunks; shared by all readers
+decompression_workers = int(os.environ.get('XICAM_XPCS_DECOMPRESSION_WORKERS', 0)) or os.cpu_count()
+
+# Selections of fewer chunks are read with h5py, for which the thread pool is not worth it
+min_parallel_chunks = 2
+
+FILTER_DEFLATE = 1
+FILTER_SHUFFLE = 2
+FILTER_FLETCHER32 = 3
+FILTER_LZ4 = 32004
+FILTER_BITSHUFFLE = 32008
+
+# filter id -> decoder(data: bytes, filter values, dtype, chunk shape) -> bytes
+decoders: Dict[int, Callable[[bytes, Tuple[int, ...], np.dtype, Tuple[int, ...]], bytes]] = {}
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def register_decoder(filter_id: int, decoder: Callable[[bytes, Tuple[int, ...], np.dtype, Tuple[int, ...]], bytes]):
+    """Decode chunks compressed by the HDF5 filter ``filter_id`` with ``decoder``, called with the chunk bytes, the
+    filter's client values, the dtype and the chunk shape, and returning the bytes before the filter."""
+    decoders[filter_id] = decoder
+
+
+def _deflate(data, values, dtype, shape):
+    return zlib.decompress(data)
+
+
+def _unshuffle(data, values, dtype, shape):
+    itemsize = dtype.itemsize
+    if itemsize == 1:
+        return data
+    # Bytes past the last whole element are left as they are by the filter
+    num_items = len(data) // itemsize
+    planes = np.frombuffer(data, dtype=np.uint8, count=num_items * itemsize).reshape(itemsize, num_items)
+    return planes.T.tobytes() + bytes(data[num_items * itemsize:])
+
+
+def _fletcher32(data, values, dtype, shape):
+    # The checksum is appended to the chunk; h5py verifies it on the fallback path
+    return data[:-4]
+
+
+def _lz4(data, values, dtype, shape):
+    # HDF5 LZ4 filter layout: total size (8 bytes), block size (4 bytes), then (compressed size, block) pairs
+    data = memoryview(data)
+    total = int.from_bytes(data[:8], 'big')
+    block_size = int.from_bytes(data[8:12], 'big') or total
+    output, position = bytearray(), 12
+    while len(output) < total:
+        expected = min(block_size, total - len(output))
+        compressed_size = int.from_bytes(data[position:position + 4], 'big')
+        block = data[position + 4:position + 4 + compressed_size]
+        output += block if compressed_size == expected else lz4.block.decompress(block, uncompressed_size=expected)
+        position += 4 + compressed_size
+    return bytes(output)
+
+
+def _bitshuffle(data, values, dtype, shape):
+    # Filter values: major and minor version, element size, block size, compression (0 none, 2 LZ4)
+    if len(values) > 4 and values[4] not in (0, 2):
+        raise NotImplementedError(f"Unsupported bitshuffle compression {values[4]}")
+    block_size = values[3] if len(values) > 3 else 0
+    element_size = values[2] if len(values) > 2 and values[2] else dtype.itemsize
+    elements = np.frombuffer(data, dtype=np.uint8)
+    if len(values) > 4 and values[4] == 2:
+        decoded = bitshuffle.decompress_lz4(elements[12:], (int(np.prod(shape)) * dtype.itemsize // element_size,),
+                                            np.dtype(f'V{element_size}'), block_size)
+    else:
+        decoded = bitshuffle.bitunshuffle(elements.view(f'V{element_size}'), block_size)
+    return decoded.tobytes()
+
+
+register_decoder(FILTER_DEFLATE, _deflate)
+register_decoder(FILTER_SHUFFLE, _unshuffle)
+register_decoder(FILTER_FLETCHER32, _fletcher32)
+if lz4 is not None:
+    register_decoder(FILTER_LZ4, _lz4)
+if bitshuffle is not None:
+    register_decoder(FILTER_BITSHUFFLE, _bitshuffle)
+
+
+def decompression_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=decompression_workers,
+                                           thread_name_prefix='xicam-XPCS-decompress')
+        return _executor
+
+
+def filter_pipeline(dataset) -> Tuple[Tuple[int, Tuple[int, ...]], ...]:
+    """Return the (filter id, client values) of the filters of an h5py dataset, in the order they are applied."""
+    plist = dataset.id.get_create_plist()
+    return tuple((code, tuple(values)) for code, _, values, _ in
+                 (plist.get_filter(i) for i in range(plist.get_nfilters())))
+
+
+def supported(dataset) -> bool:
+    """Whether ``ChunkReader`` can decompress ``dataset`` itself (it is chunked and all its filters are decodable)."""
+    return dataset.chunks is not None and all(code in decoders for code, _ in filter_pipeline(dataset))
+
+
+def _selection(item, shape) -> Tuple[Tuple[slice, ...], Tuple[int, ...]]:
+    # Normalize to one unit-stride slice per dimension and the integer-indexed axes to squeeze, or None when h5py
+    # has to handle the selection
+    item = item if isinstance(item, tuple) else (item,)
+    if any(index is Ellipsis for index in item):
+        position = item.index(Ellipsis)
+        item = item[:position] + (slice(None),) * (len(shape) - len(item) + 1) + item[position + 1:]
+    item = item + (slice(None),) * (len(shape) - len(item))
+    if len(item) != len(shape):
+        return None
+    selection, squeeze = [], []
+    for axis, (index, size) in enumerate(zip(item, shape)):
+        if isinstance(index, (int, np.integer)):
+            squeeze.append(axis)
+            index = int(index) + size if index < 0 else int(index)
+            if not 0 <= index < size:
+                raise IndexError(f"Index {index} is out of range for an axis of size {size}")
+            selection.append(slice(index, index + 1))
+        elif isinstance(index, slice):
+            start, stop, step = index.indices(size)
+            if step != 1:
+                return None
+            selection.append(slice(start, max(start, stop)))
+        else:
+            return None
+    return tuple(selection), tuple(squeeze)
+
+
+class ChunkReader:
+    """Reads selections of a chunked, compressed h5py dataset, decompressing the chunks on a thread pool.
+
+    ``read(item)`` accepts integers and unit-stride slices, like h5py, and falls back to h5py for anything else and
+    for datasets ``supported`` rejects.
+    """
+
+    def __init__(self, dataset, executor: ThreadPoolExecutor = None):
+        self.dataset = dataset
+        self.shape = dataset.shape
+        self.dtype = dataset.dtype
+        self.chunks = dataset.chunks
+        self.filters = filter_pipeline(dataset)
+        self.supported = supported(dataset)
+        self._executor = executor
+
+    def _decode(self, filter_mask: int, data: bytes) -> np.ndarray:
+        # Filters are undone in the reverse order of the pipeline; bit i of filter_mask marks filter i as skipped
+        for i, (code, values) in reversed(list(enumerate(self.filters))):
+            if not filter_mask & (1 << i):
+                data = decoders[code](data, values, self.dtype, self.chunks)
+        return np.frombuffer(data, dtype=self.dtype, count=int(np.prod(self.chunks))).reshape(self.chunks)
+
+    def read(self, item=()) -> np.ndarray:
+        normalized = _selection(item, self.shape) if self.supported else None
+        if normalized is None:
+            return self.dataset[item]
+        selection, squeeze = normalized
+
+        out = np.empty(tuple(s.stop - s.start for s in selection), dtype=self.dtype)
+        grid = [range(s.start // c * c, s.stop, c) for s, c in zip(selection, self.chunks)]
+        offsets = list(product(*grid)) if out.size else []
+        if len(offsets) < min_parallel_chunks:
+            return self.dataset[item]
+
+        def place(offset, filter_mask, data):
+            chunk = self._decode(filter_mask, data)
+            source, target = [], []
+            for start, size, s in zip(offset, self.chunks, selection):
+                first, last = max(start, s.start), min(start + size, s.stop)
+                source.append(slice(first - start, last - start))
+                target.append(slice(first - s.start, last - s.start))
+            out[tuple(target)] = chunk[tuple(source)]
+
+        # Raw chunks are read here, in order; each is decompressed and copied into place on the pool while the
+        # next ones are read
+        executor = self._executor or decompression_executor()
+        dsid = self.dataset.id
+        futures = []
+        try:
+            for offset in offsets:
+                filter_mask, data = dsid.read_direct_chunk(offset)
+                futures.append(executor.submit(place, offset, filter_mask, data))
+        except Exception:
+            # E.g. chunks that were never written, which h5py fills with the fill value
+            for future in futures:
+                future.cancel()
+            return self.dataset[item]
+        for future in futures:
+            future.result()
+        return out.squeeze(axis=squeeze) if squeeze else out
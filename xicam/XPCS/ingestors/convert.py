@@ -0,0 +1,140 @@
+import hashlib
+import os
+import tempfile
+from pathlib import Path
+
+import h5py
+import numpy as np
+from xicam.core.paths import user_cache_dir
+
+from ..sparse import write_sparse_hdf5
+
+# Bump when the converted layout changes, so older conversions are redone
+CONVERT_VERSION = 1
+
+# Root attributes of converted files
+converted_attribute = 'xicam_XPCS_converted'
+source_path_attribute = 'xicam_XPCS_source_path'
+source_stat_attribute = 'xicam_XPCS_source_stat'
+sample_name_attribute = 'xicam_XPCS_sample_name'
+
+# Default location of converted files; ingest_nxXPCS reads from here when an up-to-date conversion exists
+converted_directory = Path(os.environ.get('XICAM_XPCS_CONVERTED_DIR',
+                                          os.path.join(user_cache_dir, 'XPCS', 'converted')))
+
+
+def _source_stat(path) -> np.ndarray:
+    stat = Path(path).stat()
+    return np.array([stat.st_size, stat.st_mtime_ns], dtype=np.int64)
+
+
+def converted_path(path) -> Path:
+    """Return where ``convert_nxXPCS`` writes the conversion of ``path`` by default."""
+    path = Path(path).resolve()
+    digest = hashlib.blake2b(str(path).encode(), digest_size=8).hexdigest()
+    return converted_directory / f'{path.stem}-{digest}.h5'
+
+
+def find_converted(path) -> Path:
+    """Return the default conversion of ``path`` if it exists and is up to date with the file, else None."""
+    converted = converted_path(path)
+    if not converted.is_file():
+        return None
+    try:
+        with h5py.File(converted, 'r') as h5:
+            if h5.attrs.get(converted_attribute) != CONVERT_VERSION:
+                return None
+            if not np.array_equal(h5.attrs.get(source_stat_attribute), _source_stat(path)):
+                return None
+    except OSError:
+        return None
+    return converted
+
+
+def _chunks(shape, itemsize: int, target_bytes: int, axis: int = 0):
+    # Whole slices along every axis but ``axis``, as many of them per chunk as fit in target_bytes
+    if not shape or not np.prod(shape):
+        return None
+    slice_bytes = itemsize * int(np.prod(shape)) // shape[axis]
+    per_chunk = int(min(shape[axis], max(1, target_bytes // max(slice_bytes, 1))))
+    return tuple(per_chunk if i == axis else size for i, size in enumerate(shape))
+
+
+def convert_nxXPCS(path,
+                   output=None,
+                   compression: str = 'gzip',
+                   compression_opts=4,
+                   shuffle: bool = True,
+                   target_chunk_bytes: int = 4 * 2 ** 20,
+                   page_size: int = 2 ** 20,
+                   min_chunked_bytes: int = 2 ** 16,
+                   sparse_raw: bool = False) -> Path:
+    """Rewrite an nxXPCS file into a compact HDF5 file that ingests and reads faster, and return its path.
+
+    The converted file keeps the layout of the original, so ``ingest_nxXPCS`` reads it like any nxXPCS file, and by
+    default (``output`` None) it is written where ``ingest_nxXPCS`` looks for conversions of ``path``. Datasets of
+    at least ``min_chunked_bytes`` are compressed (``compression``, ``compression_opts``, ``shuffle``) and chunked
+    into about ``target_chunk_bytes``: whole frames for raw frame stacks, whole g2 curves for g2 datasets (which
+    are stored as (tau, q)) and whole rows otherwise. File metadata is aggregated into ``page_size`` pages, so a
+    file is opened with a few large reads instead of many small ones, which matters on network filesystems.
+
+    With ``sparse_raw``, raw frames are stored as photon events (see ``xicam.XPCS.sparse``), which for low count
+    rates is many times smaller and correlates faster.
+
+    Frames are copied one chunk at a time, so files larger than memory can be converted.
+    """
+    from . import raw_data_projection_key, raw_sparse_projection_key
+
+    path = Path(path)
+    output = Path(output) if output else converted_path(path)
+    output.parent.mkdir(parents=True, exist_ok=True)
+
+    fd, tmp = tempfile.mkstemp(dir=output.parent, suffix='.tmp')
+    os.close(fd)
+    try:
+        with h5py.File(path, 'r') as source, \
+                h5py.File(tmp, 'w', libver='latest', fs_strategy='page', fs_page_size=page_size) as target:
+
+            def copy_attributes(source_object, target_object):
+                for name, value in source_object.attrs.items():
+                    target_object.attrs[name] = value
+
+            def copy(name, item):
+                if isinstance(item, h5py.Group):
+                    copy_attributes(item, target.require_group(name))
+                    return
+                if not isinstance(item, h5py.Dataset):
+                    return
+                if sparse_raw and f'/{name}' == raw_data_projection_key and item.ndim == 3:
+                    group = target.create_group(raw_sparse_projection_key)
+                    block_size = _chunks(item.shape, item.dtype.itemsize, target_chunk_bytes)[0] if item.size else 1
+                    write_sparse_hdf5(group, item, block_size=block_size, compression=compression,
+                                      compression_opts=compression_opts, shuffle=shuffle)
+                    copy_attributes(item, group)
+                    return
+                if item.shape is None or item.nbytes < min_chunked_bytes or item.dtype.kind in 'OSUV':
+                    dataset = target.create_dataset(name, data=item[()])
+                else:
+                    # g2 datasets hold one curve per column
+                    axis = item.ndim - 1 if '/XPCS/' in f'/{name}' and item.ndim == 2 else 0
+                    chunks = _chunks(item.shape, item.dtype.itemsize, target_chunk_bytes, axis=axis)
+                    dataset = target.create_dataset(name, shape=item.shape, dtype=item.dtype, chunks=chunks,
+                                                    compression=compression, compression_opts=compression_opts,
+                                                    shuffle=shuffle)
+                    # Copy in blocks of whole chunks along the first axis
+                    block = chunks[0] if axis == 0 else item.shape[0]
+                    for start in range(0, item.shape[0], block):
+                        dataset[start:start + block] = item[start:start + block]
+                copy_attributes(item, dataset)
+
+            copy_attributes(source, target)
+            source.visititems(copy)
+            target.attrs[converted_attribute] = CONVERT_VERSION
+            target.attrs[source_path_attribute] = str(path.resolve())
+            target.attrs[source_stat_attribute] = _source_stat(path)
+            target.attrs[sample_name_attribute] = path.resolve().stem
+        os.replace(tmp, output)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+    return output
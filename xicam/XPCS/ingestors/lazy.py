@@ -0,0 +1,116 @@
+import os
+import threading
+import weakref
+from contextlib import contextmanager
+from pathlib import Path
+
+import h5py
+import dask.array as da
+from dask.base import tokenize
+
+from .. import profiling
+from . import chunks as chunk_reading
+
+
+class HDF5HandlePool:
+    """Shares one read-only h5py.File per path, reference-counted and closed as soon as nothing uses it."""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._handles = {}  # path -> [h5py.File, reference count]
+
+    @staticmethod
+    def _normalize(path) -> str:
+        return str(Path(path).resolve())
+
+    def acquire(self, path) -> h5py.File:
+        path = self._normalize(path)
+        with self._lock:
+            entry = self._handles.get(path)
+            if entry is None:
+                entry = self._handles[path] = [h5py.File(path, 'r'), 0]
+            entry[1] += 1
+            return entry[0]
+
+    def release(self, path):
+        path = self._normalize(path)
+        with self._lock:
+            entry = self._handles.get(path)
+            if entry is None:
+                return
+            entry[1] -= 1
+            if entry[1] <= 0:
+                del self._handles[path]
+                entry[0].close()
+
+    @contextmanager
+    def open(self, path):
+        h5 = self.acquire(path)
+        try:
+            yield h5
+        finally:
+            self.release(path)
+
+    def refcount(self, path) -> int:
+        with self._lock:
+            entry = self._handles.get(self._normalize(path))
+            return entry[1] if entry else 0
+
+    def __len__(self):
+        with self._lock:
+            return len(self._handles)
+
+
+handle_pool = HDF5HandlePool()
+
+
+class LazyHDF5Dataset:
+    """Array-like proxy for an HDF5 dataset that keeps the shared file handle alive for as long as it exists.
+
+    Proxies pickle as (path, key), so they can be rebuilt in another process.
+    """
+
+    def __init__(self, path, key: str, pool: HDF5HandlePool = handle_pool):
+        self.path = str(path)
+        self.key = key
+        self._pool = pool
+        h5 = pool.acquire(self.path)
+        try:
+            dataset = h5[key]
+        except Exception:
+            pool.release(self.path)
+            raise
+        self._finalizer = weakref.finalize(self, pool.release, self.path)
+        self.shape = dataset.shape
+        self.dtype = dataset.dtype
+        self.chunks = dataset.chunks
+        self.compression = dataset.compression
+        # Compressed datasets whose filters can be decoded here are decompressed in parallel (see chunks.py)
+        self.parallel = chunk_reading.supported(dataset) and bool(chunk_reading.filter_pipeline(dataset))
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    def __getitem__(self, item):
+        h5 = self._pool.acquire(self.path)
+        try:
+            if self.parallel and chunk_reading.read_backend == 'parallel':
+                return profiling.record_hdf5_read(chunk_reading.ChunkReader(h5[self.key]).read(item))
+            return profiling.record_hdf5_read(h5[self.key][item])
+        finally:
+            self._pool.release(self.path)
+
+    def __reduce__(self):
+        return type(self), (self.path, self.key)
+
+    def __repr__(self):
+        return f"<{type(self).__name__} {self.key!r} in {self.path!r} shape={self.shape} dtype={self.dtype}>"
+
+
+def lazy_array(path, key: str, pool: HDF5HandlePool = handle_pool) -> da.Array:
+    """Wrap an HDF5 dataset in a dask array whose chunks are whole multiples of the on-disk chunk layout."""
+    dataset = LazyHDF5Dataset(path, key, pool)
+    chunks = da.core.normalize_chunks('auto', dataset.shape, dtype=dataset.dtype, previous_chunks=dataset.chunks)
+    name = 'hdf5-' + tokenize(dataset.path, key, os.path.getmtime(dataset.path))
+    return da.from_array(dataset, chunks=chunks, name=name, asarray=True, lock=False)
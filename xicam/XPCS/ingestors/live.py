@@ -0,0 +1,338 @@
+import time
+from pathlib import Path
+from typing import List, Tuple
+
+import dask
+import dask.array as da
+import event_model
+import h5py
+import numpy as np
+from xicam.core import msg
+
+from .. import profiling
+from ..reduction.index import QROIIndex
+from ..reduction.screening import screen_frames
+from . import projections, g2_projection_key, tau_projection_key, g2_error_projection_key, dqlist_key, \
+              SAXS_2D_I_projection_key, SAXS_1D_I_projection_key, SAXS_1D_Q_projection_key, \
+              SAXS_1D_I_partial_projection_key, raw_data_projection_key, XPCS_mask_projection_key, \
+              XPCS_roi_projection_key, _raw_data_keys, _g2_data_keys, _SAXS_2D_keys, _SAXS_1D_keys, \
+              _SAXS_1D_I_partial_keys, _roi_keys, _read_mask, _roi_data, _compose_roi_statistics, _compose_screening
+
+# Written by the acquisition side (NeXus NXentry/end_time) once the run is complete
+end_time_key = '/entry/end_time'
+# Incremented by the acquisition side whenever it rewrites a snapshot dataset (e.g. SAXS_2D) in place
+update_count_attribute = 'update_count'
+
+# Snapshots up to this size without an update count are compared by content on every poll; larger ones are only
+# read again when their shape or update count changes
+snapshot_compare_bytes = 2 ** 20
+
+
+def _read_raw(path, start: int, stop: int, swmr: bool) -> np.ndarray:
+    # Opened for each read, so no handle is held between polls (a writer without SWMR needs the file to itself)
+    with h5py.File(path, 'r', libver='latest', swmr=True) if swmr else h5py.File(path, 'r') as h5:
+        return profiling.record_hdf5_read(h5[raw_data_projection_key][start:stop])
+
+
+def _update_count(dataset):
+    count = dataset.attrs.get(update_count_attribute)
+    return None if count is None else int(count)
+
+
+class NxXPCSFollower:
+    """Incrementally ingest an nxXPCS file that is still being written.
+
+    Each ``poll`` returns only the documents for data written since the previous poll: new raw frames (along the
+    first axis of the raw dataset) and new g2 q-bins (columns of the g2, g2 error and dqlist datasets) are emitted
+    as additional event pages. Raw frames are emitted as lazily read blocks of ``raw_block_size`` frames (all the new
+    frames of a poll by default). The SAXS_2D, SAXS_1D and SAXS_1D_I_partial snapshots are re-emitted as a new event
+    whenever they change; projections use the latest one. Snapshots are not read on every poll: a change is detected
+    from their shape and ``update_count`` attribute, and only snapshots smaller than ``snapshot_compare_bytes``
+    without that attribute are compared by content. The events of a stream share one descriptor, so a snapshot whose
+    shape (or set of datasets) changes after its first event is not emitted again; a warning is logged instead. The
+    stop document is emitted once the writer has finished, i.e. once ``/entry/end_time`` exists.
+
+    The mask and ROIs are emitted in the 'rois' stream as soon as they are written, and re-emitted like the snapshots
+    whenever they are rewritten; ROI statistics use the latest ones. As with ``ingest_nxXPCS``,
+    ``roi_statistics`` and ``frame_screening`` add the 'roi_statistics' and 'frame_screening' streams; they are
+    computed over all the frames once the writer has finished.
+
+    The file is read in SWMR mode when the writer supports it; otherwise it is reopened on every poll, so that a
+    writer in the same process can open it in between.
+    """
+
+    def __init__(self,
+                 path,
+                 raw_block_size: int = None,
+                 swmr: bool = True,
+                 roi_statistics: bool = False,
+                 frame_screening: bool = False):
+        self.path = path
+        self.raw_block_size = raw_block_size
+        self.roi_statistics = roi_statistics
+        self.frame_screening = frame_screening
+        self.finished = False
+        self._swmr_file = None
+        if swmr:
+            try:
+                self._swmr_file = h5py.File(path, 'r', libver='latest', swmr=True)
+            except (OSError, ValueError):
+                pass
+        self._run_bundle = None
+        self._stream_bundles = {}
+        # Number of raw frames and g2 q-bins emitted so far
+        self._num_emitted = {'raw': 0, 'primary': 0}
+        # Signature (shapes and update counts) and data of the latest snapshot of each stream (including 'rois')
+        self._snapshots = {}
+        # Snapshot streams whose shape changed, which were warned about once and are no longer emitted
+        self._reshaped = set()
+        # Combined ROI labels of the latest 'rois' event (None without ROIs)
+        self._roi_labels = None
+
+    @property
+    def swmr(self) -> bool:
+        return self._swmr_file is not None
+
+    def close(self):
+        if self._swmr_file is not None:
+            self._swmr_file.close()
+            self._swmr_file = None
+
+    def _dataset(self, h5: h5py.File, key: str):
+        dataset = h5.get(key)
+        if dataset is not None and self.swmr:
+            dataset.refresh()
+        return dataset
+
+    def poll(self) -> List[Tuple[str, dict]]:
+        """Return the documents for the data written since the last poll."""
+        if self.finished:
+            return []
+        if self.swmr:
+            return self._poll(self._swmr_file)
+        try:
+            h5 = h5py.File(self.path, 'r')
+        except OSError:
+            # Locked by the writer (or not flushed yet); try again on the next poll
+            return []
+        with h5:
+            return self._poll(h5)
+
+    def _poll(self, h5: h5py.File) -> List[Tuple[str, dict]]:
+        documents = []
+        if self._run_bundle is None:
+            self._run_bundle = event_model.compose_run()
+            start_doc = self._run_bundle.start_doc
+            start_doc["sample_name"] = Path(self.path).resolve().stem
+            start_doc["projections"] = projections
+            documents.append(('start', start_doc))
+
+        # Check for the end marker first, so that everything written before it is included in this poll
+        finished = end_time_key in h5
+        documents.extend(self._poll_raw(h5))
+        documents.extend(self._poll_g2(h5))
+        documents.extend(self._poll_snapshots(h5))
+        documents.extend(self._poll_rois(h5))
+
+        if finished:
+            documents.extend(self._compose_statistics(h5))
+            documents.extend(self.stop())
+        return documents
+
+    def stop(self, exit_status: str = 'success', reason: str = '') -> List[Tuple[str, dict]]:
+        """End the run (e.g. when the writer gave up) and return its stop document."""
+        documents = []
+        if self._run_bundle is not None and not self.finished:
+            documents.append(('stop', self._run_bundle.compose_stop(exit_status=exit_status, reason=reason)))
+        self.finished = True
+        self.close()
+        return documents
+
+    def _descriptor(self, name: str, data_keys: dict) -> List[Tuple[str, dict]]:
+        if name in self._stream_bundles:
+            return []
+        self._stream_bundles[name] = self._run_bundle.compose_descriptor(data_keys=data_keys, name=name)
+        return [('descriptor', self._stream_bundles[name].descriptor_doc)]
+
+    def _poll_raw(self, h5: h5py.File) -> List[Tuple[str, dict]]:
+        raw_data = self._dataset(h5, raw_data_projection_key)
+        if raw_data is None or raw_data.shape[0] <= self._num_emitted['raw']:
+            return []
+        documents = self._descriptor('raw', _raw_data_keys(raw_data.shape[1:]))
+        bundle = self._stream_bundles['raw']
+
+        num_frames = raw_data.shape[0]
+        block_size = self.raw_block_size or num_frames
+        for block_start in range(self._num_emitted['raw'], num_frames, block_size):
+            block_stop = min(block_start + block_size, num_frames)
+            t = np.full(block_stop - block_start, time.time())
+            documents.append(('event_page', bundle.compose_event_page(
+                data={'raw': self._lazy_frames(raw_data, block_start, block_stop),
+                      'raw_frame_index': np.arange(block_start, block_stop)},
+                timestamps={'raw': t,
+                            'raw_frame_index': t},
+                seq_num=list(range(block_start + 1, block_stop + 1)))))
+        self._num_emitted['raw'] = num_frames
+        return documents
+
+    def _lazy_frames(self, raw_data, start: int, stop: int) -> da.Array:
+        # Frames [start, stop) of the raw dataset, read when computed, in chunks following its on-disk layout
+        shape = (stop - start, *raw_data.shape[1:])
+        chunks = da.core.normalize_chunks('auto', shape, dtype=raw_data.dtype, previous_chunks=raw_data.chunks)[0]
+        blocks = []
+        for size in chunks:
+            blocks.append(da.from_delayed(dask.delayed(_read_raw)(self.path, start, start + size, self.swmr),
+                                          shape=(size, *shape[1:]), dtype=raw_data.dtype))
+            start += size
+        return da.concatenate(blocks) if len(blocks) > 1 else blocks[0]
+
+    def _poll_g2(self, h5: h5py.File) -> List[Tuple[str, dict]]:
+        g2, tau, g2_errors, dqlist = (self._dataset(h5, key) for key in (g2_projection_key, tau_projection_key,
+                                                                          g2_error_projection_key, dqlist_key))
+        if g2 is None or tau is None or g2_errors is None or dqlist is None:
+            return []
+        # Only emit q-bins whose curve, errors and q value have all been written
+        num_q = min(g2.shape[1], g2_errors.shape[1], dqlist.shape[1])
+        start = self._num_emitted['primary']
+        if num_q <= start:
+            return []
+        tau = tau[0]
+        documents = self._descriptor('primary', _g2_data_keys(g2.shape[0], tau.shape, dqlist.shape[0]))
+
+        t = np.full(num_q - start, time.time())
+        documents.append(('event_page', self._stream_bundles['primary'].compose_event_page(
+            data={'g2_curves': g2[:, start:num_q].T,
+                  'g2_tau': np.broadcast_to(tau, (num_q - start, *tau.shape)),
+                  'g2_error_bars': g2_errors[:, start:num_q].T,
+                  'g2_dqlist': dqlist[:, start:num_q].T},
+            timestamps={'g2_curves': t,
+                        'g2_tau': t,
+                        'g2_error_bars': t,
+                        'g2_dqlist': t},
+            seq_num=list(range(start + 1, num_q + 1)))))
+        self._num_emitted['primary'] = num_q
+        return documents
+
+    def _poll_snapshots(self, h5: h5py.File) -> List[Tuple[str, dict]]:
+        documents = []
+        SAXS_2D_I = self._dataset(h5, SAXS_2D_I_projection_key)
+        if SAXS_2D_I is not None:
+            documents.extend(self._snapshot('SAXS_2D', {'SAXS_2D': SAXS_2D_I},
+                                            lambda data: _SAXS_2D_keys(data['SAXS_2D'].shape)))
+
+        SAXS_1D_I = self._dataset(h5, SAXS_1D_I_projection_key)
+        SAXS_1D_Q = self._dataset(h5, SAXS_1D_Q_projection_key)
+        if SAXS_1D_I is not None and SAXS_1D_Q is not None:
+            documents.extend(self._snapshot('SAXS_1D', {'SAXS_1D_I': SAXS_1D_I, 'SAXS_1D_Q': SAXS_1D_Q},
+                                            lambda data: _SAXS_1D_keys(data['SAXS_1D_I'].shape,
+                                                                       data['SAXS_1D_Q'].shape),
+                                            read=lambda datasets: {key: profiling.record_hdf5_read(dataset[0])
+                                                                   for key, dataset in datasets.items()}))
+
+        SAXS_1D_I_partial = self._dataset(h5, SAXS_1D_I_partial_projection_key)
+        if SAXS_1D_I_partial is not None:
+            documents.extend(self._snapshot('SAXS_1D_I_partial', {'SAXS_1D_I_partial': SAXS_1D_I_partial},
+                                            lambda data: _SAXS_1D_I_partial_keys(data['SAXS_1D_I_partial'].shape)))
+        return documents
+
+    def _snapshot(self, name: str, datasets: dict, data_keys,
+                  read=lambda datasets: {key: profiling.record_hdf5_read(dataset[()])
+                                         for key, dataset in datasets.items()}) \
+            -> List[Tuple[str, dict]]:
+        signature = {key: (dataset.shape, _update_count(dataset)) for key, dataset in datasets.items()}
+        previous_signature, previous = self._snapshots.get(name, (None, None))
+        if previous_signature is not None and \
+                {key: shape for key, (shape, _) in signature.items()} != \
+                {key: shape for key, (shape, _) in previous_signature.items()}:
+            # Events of one stream must match its descriptor, and a run can't describe a stream twice
+            if name not in self._reshaped:
+                msg.logMessage(f"The shape of the {name} snapshot in {self.path} changed; it is no longer followed",
+                               level=msg.WARNING)
+                self._reshaped.add(name)
+            return []
+        unchanged = signature == previous_signature
+        if unchanged and (all(count is not None for _, count in signature.values())
+                          or sum(dataset.nbytes for dataset in datasets.values()) > snapshot_compare_bytes):
+            return []
+        data = read(datasets)
+        if unchanged and all(np.array_equal(previous[key], value) for key, value in data.items()):
+            return []
+        documents = self._descriptor(name, data_keys(data))
+        t = time.time()
+        documents.append(('event', self._stream_bundles[name].compose_event(data=data,
+                                                                            timestamps={key: t for key in data})))
+        self._snapshots[name] = signature, data
+        return documents
+
+    def _poll_rois(self, h5: h5py.File) -> List[Tuple[str, dict]]:
+        # The mask and ROIs are followed like a snapshot, so that they are emitted again when rewritten
+        datasets = {key: dataset for key, dataset in (('mask', self._dataset(h5, XPCS_mask_projection_key)),
+                                                      ('rois', self._dataset(h5, XPCS_roi_projection_key)))
+                    if dataset is not None}
+        if not datasets:
+            return []
+
+        def read(datasets):
+            mask = _read_mask(datasets['mask']) if 'mask' in datasets else None
+            rois = profiling.record_hdf5_read(datasets['rois'][()]) if 'rois' in datasets else None
+            return _roi_data(mask, rois)
+
+        documents = self._snapshot('rois', datasets,
+                                   lambda data: _roi_keys(next(iter(data.values())).shape, 'mask' in data,
+                                                          'rois' in data),
+                                   read=read)
+        if documents:
+            self._roi_labels = self._snapshots['rois'][1].get('rois')
+        return documents
+
+    def _compose_statistics(self, h5: h5py.File) -> List[Tuple[str, dict]]:
+        # ROI statistics and frame screening over all the frames, once the writer has finished
+        if not self.roi_statistics and not self.frame_screening:
+            return []
+        raw_data = self._dataset(h5, raw_data_projection_key)
+        frames = self._lazy_frames(raw_data, 0, raw_data.shape[0]) if raw_data is not None and raw_data.shape[0] \
+            else None
+        documents = []
+        if self.roi_statistics and self._roi_labels is not None:
+            SAXS_2D_I = self._snapshots.get('SAXS_2D', (None, {}))[1].get('SAXS_2D')
+            if frames is not None or SAXS_2D_I is not None:
+                documents.extend(_compose_roi_statistics(self._run_bundle, self._roi_labels, SAXS_2D_I,
+                                                         frames=frames))
+        if self.frame_screening and frames is not None:
+            index = QROIIndex.from_labels(self._roi_labels) if self._roi_labels is not None else None
+            with profiling.stage('ingest.frame_screening'):
+                screening = screen_frames(frames, index if index is not None and index.num_bins else None)
+            documents.extend(_compose_screening(self._run_bundle, screening))
+        return documents
+
+
+def follow_nxXPCS(paths,
+                  poll_interval: float = 1.,
+                  idle_timeout: float = None,
+                  raw_block_size: int = None,
+                  swmr: bool = True,
+                  roi_statistics: bool = False,
+                  frame_screening: bool = False):
+    """Ingest an nxXPCS file while it is being written, yielding documents as new data appears.
+
+    The file is polled every ``poll_interval`` seconds until the writer finishes (see ``NxXPCSFollower``). When
+    nothing new has been written for ``idle_timeout`` seconds, the run is stopped with exit status 'abort'.
+    """
+    assert len(paths) == 1
+    follower = NxXPCSFollower(paths[0], raw_block_size=raw_block_size, swmr=swmr, roi_statistics=roi_statistics,
+                              frame_screening=frame_screening)
+    last_update = time.monotonic()
+    try:
+        while True:
+            documents = follower.poll()
+            yield from documents
+            if follower.finished:
+                return
+            if documents:
+                last_update = time.monotonic()
+            elif idle_timeout is not None and time.monotonic() - last_update > idle_timeout:
+                yield from follower.stop(exit_status='abort', reason=f"No new data for {idle_timeout} s")
+                return
+            time.sleep(poll_interval)
+    finally:
+        follower.close()
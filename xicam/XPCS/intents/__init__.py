@@ -0,0 +1,49 @@
+from typing import Dict, Iterable, Sequence
+
+import numpy as np
+from xicam.core.intents import ErrorBarIntent
+from xicam.SAXS.intents import SAXSImageIntent
+
+
+class MultiErrorBarIntent(ErrorBarIntent):
+    """A family of curves sharing one x axis, carried as a single 2-D array.
+
+    ``y`` and ``height`` have shape (number of curves, len(x)); ``curve_names`` labels each curve and ``visible``
+    selects which curves are initially shown (all by default). The canvas can toggle curves afterwards.
+    """
+
+    canvas = "multi_errorbar_canvas"
+
+    def __init__(self,
+                 name: str,
+                 x,
+                 y,
+                 labels: Dict[str, str],
+                 curve_names: Sequence[str],
+                 height=None,
+                 visible: Iterable[bool] = None,
+                 mixins: Iterable[str] = None,
+                 canvas_name: str = None,
+                 match_key=None,
+                 **kwargs):
+        super(MultiErrorBarIntent, self).__init__(name=name, x=x, y=y, labels=labels, mixins=mixins,
+                                                  canvas_name=canvas_name, match_key=match_key, **kwargs)
+        self.height = height
+        self.curve_names = list(curve_names)
+        if visible is None:
+            visible = np.ones(len(self.curve_names), dtype=bool)
+        self.visible = np.asarray(list(visible), dtype=bool)
+
+
+class PyramidImageIntent(SAXSImageIntent):
+    """A SAXS image (or stack of frames) that carries an ImagePyramid of downsampled copies.
+
+    The canvas displays the coarsest pyramid level that still resolves the current view, so zoomed-out browsing
+    never pulls full-resolution pixels.
+    """
+
+    canvas = "pyramid_image_canvas"
+
+    def __init__(self, name: str, image, *args, pyramid=None, **kwargs):
+        super(PyramidImageIntent, self).__init__(name, image, *args, **kwargs)
+        self.pyramid = pyramid
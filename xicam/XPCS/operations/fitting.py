@@ -0,0 +1,55 @@
+from typing import Tuple
+
+import numpy as np
+from xicam.core.intents import ErrorBarIntent, PlotIntent
+from xicam.plugins.operationplugin import operation, describe_input, describe_output, visible, \
+    input_names, output_names, display_name, intent
+
+from ..fitting.g2 import fit_g2 as _fit_g2
+
+
+@operation
+@display_name('Fit g2')
+@input_names('g2', 'tau', 'g2_errors', 'q', 'model', 'warm_start', 'max_workers')
+@describe_input('g2', 'Normalized g2 data array with shape = (num_rois, len(tau))')
+@describe_input('tau', 'Lag steps')
+@describe_input('g2_errors', 'Standard errors of g2, used as fit weights')
+@describe_input('q', 'q of each ROI; ROI numbers are used when not given')
+@describe_input('model', "Model fit to every curve: 'single', 'stretched' or 'double' exponential")
+@describe_input('warm_start', 'Start each curve from the fit of its nearest neighbour in q')
+@describe_input('max_workers', 'Number of processes fitting batches of curves; 0 for one per core')
+@output_names('relaxation_rates', 'relaxation_rate_errors', 'beta', 'q_squared', 'fit_curve', 'tau')
+@describe_output('relaxation_rates', 'Relaxation rate Γ of each ROI')
+@describe_output('relaxation_rate_errors', 'Standard error of Γ')
+@describe_output('beta', 'Fitted contrast of each ROI')
+@describe_output('q_squared', 'q² of each ROI')
+@describe_output('fit_curve', 'Fitted model of the g2 curves, with the shape of g2')
+@visible('g2', False)
+@visible('tau', False)
+@visible('g2_errors', False)
+@visible('q', False)
+@intent(ErrorBarIntent,
+        canvas_name='Γ vs. q²',
+        match_key='diffusion_coefficient',
+        name='Γ',
+        labels={'bottom': 'q²', 'left': 'Γ'},
+        output_map={'x': 'q_squared', 'y': 'relaxation_rates', 'top': 'relaxation_rate_errors',
+                    'bottom': 'relaxation_rate_errors'},
+        symbol='o')
+@intent(PlotIntent,
+        match_key='1-time Correlation',
+        name='g2 fit',
+        xLogMode=True,
+        labels={"bottom": "𝜏", "left": "g₂"},
+        output_map={'x': 'tau', 'y': 'fit_curve'},
+        mixins=["ToggleSymbols"])
+def fit_g2(g2: np.ndarray,
+           tau: np.ndarray,
+           g2_errors: np.ndarray = None,
+           q: np.ndarray = None,
+           model: str = 'single',
+           warm_start: bool = True,
+           max_workers: int = 1) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    fit = _fit_g2(g2, tau, q=q, model=model, errors=g2_errors, warm_start=warm_start, max_workers=max_workers)
+    return (fit.relaxation_rate, np.nan_to_num(fit.relaxation_rate_error), fit.beta, fit.q ** 2,
+            fit.curves().reshape(np.shape(g2)), fit.tau)
@@ -0,0 +1,60 @@
+from typing import Iterable, Tuple
+
+import numpy as np
+import pyqtgraph as pg
+from xicam.core import msg
+from xicam.core.intents import PlotIntent
+from xicam.SAXS.utils import get_label_array
+from xicam.plugins.operationplugin import operation, describe_input, describe_output, visible, \
+    input_names, output_names, display_name, intent
+
+from ..correlation.multitau import multi_tau_correlation as _multi_tau_correlation
+
+
+@operation
+@display_name('Multi-Tau Correlation')
+@input_names('images', 'labels', 'rois', 'image_item', 'number_of_levels', 'number_of_buffers', 'block_size',
+             'frame_mask')
+@describe_input('images', 'Frame stack of shape (N, q_x, q_y); read lazily, block_size frames at a time')
+@describe_input('labels', 'Labeled array of the shape of one frame. Each ROI is represented by sequential integers '
+                          'starting at one; background is labeled as 0')
+@describe_input('number_of_levels', 'Number of generations of pairwise frame averaging')
+@describe_input('number_of_buffers', 'Number of lags computed per level (must be even)')
+@describe_input('block_size', 'Number of frames read and correlated at once')
+@describe_input('frame_mask', 'Boolean mask of the frames to correlate (e.g. from frame screening); all by default')
+@output_names('g2', 'tau', 'g2_errors', 'images', 'labels')
+@describe_output('g2', 'Normalized g2 data array with shape = (num_rois, len(lag_steps))')
+@describe_output('tau', 'Lag steps, in frames')
+@describe_output('g2_errors', 'Standard error of g2 over the pixels of each ROI')
+@visible('images', False)
+@visible('labels', False)
+@visible('rois', False)
+@visible('image_item', False)
+@visible('frame_mask', False)
+@intent(PlotIntent,
+        match_key='1-time Correlation',
+        name='g2',
+        xLogMode=True,
+        labels={"bottom": "𝜏", "left": "g₂"},
+        output_map={'x': 'tau', 'y': 'g2'},
+        mixins=["ToggleSymbols"])
+def multi_tau_correlation(images: np.ndarray,
+                          labels: np.ndarray = None,
+                          rois: Iterable[pg.ROI] = None,
+                          image_item: pg.ImageItem = None,
+                          num_levels: int = 8,
+                          num_bufs: int = 16,
+                          block_size: int = 256,
+                          frame_mask: np.ndarray = None) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    if images.ndim < 3:
+        raise ValueError(f"Cannot compute correlation on data with {images.ndim} dimensions.")
+
+    if labels is None:
+        labels = np.flipud(get_label_array(images, rois=rois, image_item=image_item))
+        if labels.max() == 0:
+            msg.notifyMessage("Please add an ROI over which to calculate one-time correlation.")
+            raise ValueError("Please add an ROI over which to calculate one-time correlation.")
+
+    g2, tau, g2_errors = _multi_tau_correlation(images, labels, num_levels=num_levels, num_bufs=num_bufs,
+                                                block_size=block_size, frame_mask=frame_mask)
+    return g2.T, tau, g2_errors.T, images, labels
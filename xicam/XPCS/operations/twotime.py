@@ -0,0 +1,67 @@
+from typing import Iterable, Tuple
+
+import numpy as np
+import pyqtgraph as pg
+from xicam.core import msg
+from xicam.core.intents import ImageIntent
+from xicam.SAXS.utils import get_label_array
+from xicam.plugins.operationplugin import operation, describe_input, describe_output, visible, \
+    input_names, output_names, display_name, intent
+
+from ..correlation.twotime import create_two_time_output, two_time_correlation, two_time_preview
+from ..reduction.index import roi_index
+
+
+@operation
+@display_name('Blocked 2-time Correlation')
+@input_names('images', 'labels', 'rois', 'image_item', 'tile_size', 'output_path', 'preview_size', 'max_workers',
+             'frame_mask')
+@describe_input('images', 'Frame stack of shape (N, q_x, q_y); read lazily, tile_size frames at a time')
+@describe_input('labels', 'Labeled array of the shape of one frame. Each ROI is represented by sequential integers '
+                          'starting at one; background is labeled as 0')
+@describe_input('tile_size', 'Number of frames along each side of the tiles computed at once')
+@describe_input('output_path', 'HDF5 (.h5) or NumPy (.npy) file receiving the full-resolution correlation; '
+                               'leave empty to keep it in memory')
+@describe_input('preview_size', 'Maximum number of frames along each side of the displayed (downsampled) correlation')
+@describe_input('max_workers', 'Number of threads computing tiles; defaults to the number of cores')
+@describe_input('frame_mask', 'Boolean mask of the frames to correlate (e.g. from frame screening); all by default')
+@output_names('two_time', 'roi_intensity', 'qs')
+@describe_output('two_time', 'Downsampled correlation with shape (num_rois, preview_size, preview_size)')
+@describe_output('roi_intensity', 'Mean intensity of each ROI per frame, with shape (num_rois, N)')
+@visible('images', False)
+@visible('labels', False)
+@visible('rois', False)
+@visible('image_item', False)
+@visible('frame_mask', False)
+@intent(ImageIntent,
+        name='2-time Correlation',
+        output_map={'image': 'two_time', 'xvals': 'qs'},
+        mixins=["AxesLabels", "XArrayView", "SliceSelector"],
+        labels={"bottom": "𝜏₁", "left": "𝜏₂"})
+def blocked_two_time_correlation(images: np.ndarray,
+                                 labels: np.ndarray = None,
+                                 rois: Iterable[pg.ROI] = None,
+                                 image_item: pg.ImageItem = None,
+                                 tile_size: int = 512,
+                                 output_path: str = '',
+                                 preview_size: int = 512,
+                                 max_workers: int = 0,
+                                 frame_mask: np.ndarray = None) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    if images.ndim < 3:
+        raise ValueError(f"Cannot compute correlation on data with {images.ndim} dimensions.")
+
+    if labels is None:
+        labels = np.flipud(get_label_array(images, rois=rois, image_item=image_item))
+        if labels.max() == 0:
+            msg.notifyMessage("Please add an ROI over which to calculate two-time correlation.")
+            raise ValueError("Please add an ROI over which to calculate two-time correlation.")
+
+    index = roi_index(labels)
+    num_rois = index.num_bins
+    out = create_two_time_output(num_rois, len(images), path=output_path or None, tile_size=tile_size)
+    out, roi_intensity = two_time_correlation(images, index, tile_size=tile_size, out=out,
+                                              max_workers=max_workers or None, frame_mask=frame_mask)
+    preview = two_time_preview(out, max_size=preview_size, tile_size=tile_size)
+    if hasattr(out, 'file'):
+        out.file.close()
+    return preview, roi_intensity, index.labels
@@ -0,0 +1,177 @@
+"""Optional timing instrumentation of the ingest and projection pipeline.
+
+Profiling is off unless the ``XICAM_XPCS_PROFILE`` environment variable is set (to ``1``, or to the path of a
+Chrome-trace JSON file written at exit) or ``enable()`` is called. While it is off, ``stage`` returns a shared no-op
+context manager and ``trace_documents`` returns its argument, so instrumented code pays one flag check per call.
+
+While it is on, every stage records its wall time, the bytes read from HDF5 and the number of dask computes (and
+their task counts) that happened while it was open. Finished stages are logged as JSON to the
+``xicam.XPCS.profiling`` logger at INFO level, summarized by ``summary()``, and written by ``write_chrome_trace()``
+in the Trace Event format read by chrome://tracing and Perfetto.
+"""
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+from typing import Dict, Iterable, Iterator
+
+from dask.callbacks import Callback
+
+logger = logging.getLogger(__name__)
+
+environment_variable = 'XICAM_XPCS_PROFILE'
+
+enabled = False
+
+_lock = threading.Lock()
+_events = []
+_counters = {'hdf5_bytes': 0, 'hdf5_reads': 0, 'dask_computes': 0, 'dask_tasks': 0}
+_null_stage = nullcontext()
+_pid = os.getpid()
+
+
+class _DaskCounter(Callback):
+    def _start(self, dsk):
+        with _lock:
+            _counters['dask_computes'] += 1
+            _counters['dask_tasks'] += len(dsk)
+
+
+_dask_counter = _DaskCounter()
+
+
+def enable(trace_path=None):
+    """Start recording; with ``trace_path``, write a Chrome trace there when the interpreter exits."""
+    global enabled
+    if not enabled:
+        _dask_counter.register()
+        enabled = True
+    if trace_path:
+        atexit.register(write_chrome_trace, trace_path)
+
+
+def disable():
+    global enabled
+    if enabled:
+        _dask_counter.unregister()
+        enabled = False
+
+
+def reset():
+    """Forget all recorded stages and counters."""
+    with _lock:
+        _events.clear()
+        for name in _counters:
+            _counters[name] = 0
+
+
+def counters() -> Dict[str, int]:
+    with _lock:
+        return dict(_counters)
+
+
+def record_hdf5_read(array):
+    """Count the bytes of ``array``, just read from HDF5, and return it."""
+    if enabled:
+        with _lock:
+            _counters['hdf5_bytes'] += getattr(array, 'nbytes', 0)
+            _counters['hdf5_reads'] += 1
+    return array
+
+
+def _now_us() -> float:
+    return time.perf_counter_ns() / 1e3
+
+
+def _record(name: str, start_us: float, start_counters: Dict[str, int], args: dict):
+    end_us = _now_us()
+    with _lock:
+        delta = {key: _counters[key] - start_counters[key] for key in _counters}
+        event = {'name': name,
+                 'cat': name.split('.')[0],
+                 'ph': 'X',
+                 'ts': start_us,
+                 'dur': end_us - start_us,
+                 'pid': _pid,
+                 'tid': threading.get_ident(),
+                 'args': dict(args, **delta)}
+        _events.append(event)
+    if logger.isEnabledFor(logging.INFO):
+        logger.info(json.dumps({'stage': name, 'seconds': event['dur'] / 1e6, **event['args']}, default=str))
+
+
+@contextmanager
+def _stage(name: str, args: dict):
+    start_counters = counters()
+    start_us = _now_us()
+    try:
+        yield
+    finally:
+        _record(name, start_us, start_counters, args)
+
+
+def stage(name: str, **args):
+    """Context manager timing the stage ``name``; ``args`` (e.g. a path) are attached to its record.
+
+    Bytes read and dask computes are those of all threads while the stage is open.
+    """
+    if not enabled:
+        return _null_stage
+    return _stage(name, args)
+
+
+def _trace_documents(documents: Iterable, name: str) -> Iterator:
+    iterator = iter(documents)
+    while True:
+        start_counters = counters()
+        start_us = _now_us()
+        try:
+            document = next(iterator)
+        except StopIteration:
+            return
+        _record(f"{name}.{document[0]}", start_us, start_counters, {})
+        yield document
+
+
+def trace_documents(documents: Iterable, name: str) -> Iterable:
+    """Time the composition of each (name, doc) pair of ``documents`` as the stage '``name``.<document name>'.
+
+    Only the time spent producing each document is recorded, not the time the consumer spends on it.
+    """
+    if not enabled:
+        return documents
+    return _trace_documents(documents, name)
+
+
+def summary() -> Dict[str, dict]:
+    """Totals of every recorded stage: number of calls, seconds, HDF5 bytes and reads, dask computes and tasks."""
+    totals = defaultdict(lambda: defaultdict(float))
+    with _lock:
+        for event in _events:
+            total = totals[event['name']]
+            total['count'] += 1
+            total['seconds'] += event['dur'] / 1e6
+            for key in _counters:
+                total[key] += event['args'].get(key, 0)
+    return {name: dict(total) for name, total in totals.items()}
+
+
+def chrome_trace() -> dict:
+    with _lock:
+        return {'traceEvents': list(_events), 'displayTimeUnit': 'ms'}
+
+
+def write_chrome_trace(path):
+    """Write the recorded stages to ``path`` as a Chrome-trace JSON file."""
+    with open(path, 'w') as f:
+        json.dump(chrome_trace(), f, default=str)
+    return path
+
+
+_setting = os.environ.get(environment_variable, '').strip()
+if _setting and _setting.lower() not in ('0', 'false', 'no', 'off'):
+    enable(trace_path=None if _setting.lower() in ('1', 'true', 'yes', 'on') else _setting)
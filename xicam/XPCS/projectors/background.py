@@ -0,0 +1,149 @@
+"""Projection of runs on a background thread pool, so opening a run never blocks the GUI.
+
+``submit_projection`` returns a ``ProjectionJob`` at once. Its ``placeholder`` intent can be listed under the run
+right away; the intents of the projection are then passed to ``on_intent`` one at a time, on a worker thread, as
+they are produced (lazy images and SAXS curves first, computed g2 curves last), and ``on_done`` is called once the
+job has finished, failed or been cancelled. Cancelling a job stops it before its next intent.
+
+Every job measures its time to first intent (the time until the first plot can be drawn) and its total time, and
+logs both to the ``xicam.XPCS.projectors.background`` logger at INFO level.
+"""
+import logging
+import os
+import threading
+import time
+from concurrent.futures import CancelledError, Future, ThreadPoolExecutor
+from typing import Callable, Iterator, List
+
+import numpy as np
+from databroker.core import BlueskyRun
+from xicam.core.data.bluesky_utils import display_name
+from xicam.core.intents import Intent
+
+from ..intents import MultiErrorBarIntent
+from .nexus import iter_project_nxXPCS
+
+logger = logging.getLogger(__name__)
+
+# Number of runs projected at once
+projection_workers = int(os.environ.get('XICAM_XPCS_PROJECTION_WORKERS', 2))
+
+# Cancel the projections still running when another run is opened
+cancel_superseded = True
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def projection_executor() -> ThreadPoolExecutor:
+    """The thread pool projecting runs, created on first use."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=projection_workers, thread_name_prefix='xicam-XPCS-project')
+        return _executor
+
+
+class PendingIntent(MultiErrorBarIntent):
+    """Empty placeholder listed under a run, in the g₂ canvas, while its projection runs."""
+
+    def __init__(self, name: str):
+        super(PendingIntent, self).__init__(name=name,
+                                            canvas_name='g₂ vs. τ',
+                                            match_key='g₂ vs. τ',
+                                            x=np.zeros(0),
+                                            y=np.zeros((0, 0)),
+                                            curve_names=[],
+                                            xLogMode=True,
+                                            labels={"left": "g₂", "bottom": "τ"})
+
+
+class ProjectionJob:
+    """The projection of one run on the projection thread pool.
+
+    ``intents`` holds the intents produced so far; ``result()`` waits for all of them. ``time_to_first_intent`` and
+    ``duration`` are measured from ``submit()`` (None until known).
+    """
+
+    def __init__(self,
+                 run_catalog: BlueskyRun,
+                 projector: Callable[[BlueskyRun], Iterator[Intent]] = iter_project_nxXPCS,
+                 on_intent: Callable[['ProjectionJob', Intent], None] = None,
+                 on_done: Callable[['ProjectionJob'], None] = None):
+        self.run_catalog = run_catalog
+        self.projector = projector
+        self.on_intent = on_intent
+        self.on_done = on_done
+        self.name = display_name(run_catalog).split(" ")[0]
+        self.placeholder = PendingIntent(f"Loading {self.name}…")
+        self.intents = []
+        self.future = None
+        self.time_to_first_intent = None
+        self.duration = None
+        self._cancelled = threading.Event()
+        self._submitted = None
+
+    def submit(self, executor: ThreadPoolExecutor = None) -> 'ProjectionJob':
+        self._submitted = time.perf_counter()
+        self.future = (executor or projection_executor()).submit(self._run)
+        self.future.add_done_callback(self._finished)
+        return self
+
+    def _run(self) -> List[Intent]:
+        intents = self.projector(self.run_catalog)
+        try:
+            for intent in intents:
+                if self._cancelled.is_set():
+                    raise CancelledError()
+                if self.time_to_first_intent is None:
+                    self.time_to_first_intent = time.perf_counter() - self._submitted
+                self.intents.append(intent)
+                if self.on_intent:
+                    self.on_intent(self, intent)
+        finally:
+            # Stops the projector early when cancelled, so an incomplete projection is never memoized
+            if hasattr(intents, 'close'):
+                intents.close()
+        self.duration = time.perf_counter() - self._submitted
+        return list(self.intents)
+
+    def _finished(self, future: Future):
+        if not self.cancelled and future.exception() is None:
+            logger.info(f"Projected {self.name}: first intent after {self.time_to_first_intent or 0:.3f} s, "
+                        f"{len(self.intents)} intents after {self.duration:.3f} s")
+        if self.on_done:
+            self.on_done(self)
+
+    def cancel(self) -> bool:
+        """Stop the job before its next intent; return False if it had already finished."""
+        if self.done:
+            return False
+        self._cancelled.set()
+        self.future.cancel()
+        return True
+
+    @property
+    def done(self) -> bool:
+        return self.future is not None and self.future.done()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    def exception(self, timeout: float = None):
+        """The exception the projection raised (None if it succeeded); CancelledError if it was cancelled."""
+        try:
+            return self.future.exception(timeout)
+        except CancelledError as ex:
+            return ex
+
+    def result(self, timeout: float = None) -> List[Intent]:
+        return self.future.result(timeout)
+
+
+def submit_projection(run_catalog: BlueskyRun,
+                      on_intent: Callable[[ProjectionJob, Intent], None] = None,
+                      on_done: Callable[[ProjectionJob], None] = None,
+                      projector: Callable[[BlueskyRun], Iterator[Intent]] = iter_project_nxXPCS) -> ProjectionJob:
+    """Start projecting ``run_catalog`` on the projection thread pool and return its job right away."""
+    return ProjectionJob(run_catalog, projector=projector, on_intent=on_intent, on_done=on_done).submit()
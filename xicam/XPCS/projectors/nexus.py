@@ -1,26 +1,128 @@
-from typing import List
+import threading
+from collections import OrderedDict
+from typing import Iterator, List
+import dask
 import numpy as np
 from databroker.core import BlueskyRun
+from xicam.core import msg
 from xicam.core.data.bluesky_utils import display_name
 from xicam.SAXS.intents import SAXSImageIntent
 from xicam.core.data import ProjectionNotFound
 from xicam.core.intents import Intent, PlotIntent, ImageIntent, ErrorBarIntent
+from .. import profiling
+from ..intents import MultiErrorBarIntent, PyramidImageIntent
 from ..ingestors import g2_projection_key, g2_error_projection_key, tau_projection_key, dqlist_key, \
                         SAXS_2D_I_projection_key, SAXS_1D_I_projection_key, SAXS_1D_Q_projection_key, \
-                        SAXS_1D_I_partial_projection_key, raw_data_projection_key
+                        SAXS_1D_I_partial_projection_key, raw_data_projection_key, XPCS_mask_projection_key, \
+                        XPCS_roi_projection_key, ROI_labels_key, ROI_pixel_count_key, ROI_mean_intensity_key, \
+                        ROI_contrast_key, frame_total_intensity_key, frame_roi_mean_key, frame_similarity_key, \
+                        frame_outlier_key
+from ..fitting.g2 import fit_g2, fit_intents
+from ..reduction.pyramid import ImagePyramid, pyramid_cache
+from ..reduction.screening import screening_intents
 
 
-def project_nxXPCS(run_catalog: BlueskyRun) -> List[Intent]:
+# Projected intents of recently projected runs, most recently used last
+_projection_cache = OrderedDict()
+_projection_cache_lock = threading.Lock()
+projection_cache_size = 32
+
+# Number of g2 curves (evenly spaced in q) initially shown; the rest can be toggled on in the canvas
+max_visible_g2_curves = 32
+
+# Downsampling factors (and pooling) of the image pyramids shown while zoomed out; empty to disable pyramids
+image_pyramid_factors = (2, 4, 8)
+image_pyramid_reduction = 'mean'
+
+# Model ('single', 'stretched' or 'double') fit to every g2 curve on projection, adding Γ vs q² and fit intents;
+# None to skip fitting
+g2_fit_model = None
+
+
+def _projection_cache_key(run_catalog: BlueskyRun, projection: dict) -> tuple:
+    # A stop document (or a different event count in it) means the run has changed since it was projected
+    stop_doc = run_catalog.metadata.get('stop') or {}
+    return (run_catalog.metadata['start']['uid'], projection['version'],
+            stop_doc.get('uid'), repr(sorted((stop_doc.get('num_events') or {}).items())))
+
+
+def clear_projection_cache():
+    with _projection_cache_lock:
+        _projection_cache.clear()
+
+
+def find_nxXPCS_projection(run_catalog: BlueskyRun) -> dict:
+    """Return the 'nxXPCS' projection of a run, or raise ProjectionNotFound."""
     projection = next(
         filter(lambda projection: projection['name'] == 'nxXPCS', run_catalog.metadata['start'].get('projections', [])), None)
 
     if not projection:
         raise ProjectionNotFound("Could not find projection named 'nxXPCS'.")
+    return projection
+
+
+def project_nxXPCS(run_catalog: BlueskyRun) -> List[Intent]:
+    return list(iter_project_nxXPCS(run_catalog))
+
+
+def iter_project_nxXPCS(run_catalog: BlueskyRun) -> Iterator[Intent]:
+    """Yield the intents of ``project_nxXPCS`` one at a time, those that need no compute first.
+
+    Images and SAXS curves stay lazy and come out as soon as their streams are converted to dask; the g2 curves
+    (and their fits) follow once computed. A run is only memoized when all of its intents were consumed.
+    """
+    projection = find_nxXPCS_projection(run_catalog)
+
+    # Runs that are still being written (no stop document yet) change between projections; never cache them
+    if not run_catalog.metadata.get('stop'):
+        with profiling.stage('project', uid=run_catalog.metadata['start']['uid']):
+            yield from _project_nxXPCS(run_catalog, projection)
+        return
+
+    key = _projection_cache_key(run_catalog, projection)
+    with _projection_cache_lock:
+        cached = _projection_cache.get(key)
+        if cached is not None:
+            _projection_cache.move_to_end(key)
+    if cached is not None:
+        yield from list(cached)
+        return
 
-    catalog_name = display_name(run_catalog).split(" ")[0]
     intents_list = []
+    with profiling.stage('project', uid=key[0]):
+        for intent in _project_nxXPCS(run_catalog, projection):
+            intents_list.append(intent)
+            yield intent
+
+    with _projection_cache_lock:
+        _projection_cache[key] = intents_list
+        while len(_projection_cache) > projection_cache_size:
+            _projection_cache.popitem(last=False)
+
+
+def _image_intent(run_catalog: BlueskyRun, field: str, image, name: str) -> SAXSImageIntent:
+    if not image_pyramid_factors:
+        return SAXSImageIntent(image=image, name=name, mixins=("SAXSImageIntentBlend",))
+    source = np.squeeze(image).data
+    identity = (run_catalog.metadata['start']['uid'], field, source.shape, image_pyramid_factors,
+                image_pyramid_reduction)
+    pyramid = ImagePyramid(source, factors=image_pyramid_factors, reduction=image_pyramid_reduction,
+                           path=pyramid_cache.path(*identity), token=identity, cache=pyramid_cache)
+    return PyramidImageIntent(image=image, pyramid=pyramid, name=name, mixins=("SAXSImageIntentBlend",))
+
+
+def _project_nxXPCS(run_catalog: BlueskyRun, projection: dict) -> Iterator[Intent]:
+    catalog_name = display_name(run_catalog).split(" ")[0]
+
+    # Convert each stream to dask only once, even when several projected fields live in it
+    streams = {}
+
+    def stream_to_dask(stream):
+        if stream not in streams:
+            with profiling.stage('project.to_dask', stream=stream):
+                streams[stream] = getattr(run_catalog, stream).to_dask()
+        return streams[stream]
 
-    # TODO: project masks, rois
     #gather fields and streams from projections
     g2_stream = projection['projection'][g2_projection_key]['stream']
     g2_field = projection['projection'][g2_projection_key]['field']
@@ -28,71 +130,154 @@ def project_nxXPCS(run_catalog: BlueskyRun) -> List[Intent]:
     g2_error_field = projection['projection'][g2_error_projection_key]['field']
     dqlist_field = projection['projection'][dqlist_key]['field']
     # Use singly-sourced key name
-    g2 = getattr(run_catalog, g2_stream).to_dask().rename({g2_field: g2_projection_key,
-                                                           tau_field: tau_projection_key,
-                                                           g2_error_field: g2_error_projection_key,
-                                                           dqlist_field: dqlist_key
-                                                           })
+    g2 = stream_to_dask(g2_stream).rename({g2_field: g2_projection_key,
+                                           tau_field: tau_projection_key,
+                                           g2_error_field: g2_error_projection_key,
+                                           dqlist_field: dqlist_key
+                                           })
 
     SAXS_2D_I_stream = projection['projection'][SAXS_2D_I_projection_key]['stream']
     SAXS_2D_I_field = projection['projection'][SAXS_2D_I_projection_key]['field']
-    SAXS_2D_I = getattr(run_catalog, SAXS_2D_I_stream).to_dask().\
+    # Snapshot streams get a new event whenever a live file updates them; show the latest one
+    SAXS_2D_I = stream_to_dask(SAXS_2D_I_stream).isel(time=slice(-1, None)).\
                         rename({SAXS_2D_I_field: SAXS_2D_I_projection_key})[SAXS_2D_I_projection_key]
 
     SAXS_1D_I_stream = projection['projection'][SAXS_1D_I_projection_key]['stream']
     SAXS_1D_I_field = projection['projection'][SAXS_1D_I_projection_key]['field']
     SAXS_1D_Q_stream = projection['projection'][SAXS_1D_Q_projection_key]['stream']
     SAXS_1D_Q_field = projection['projection'][SAXS_1D_Q_projection_key]['field']
-    SAXS_1D_I = getattr(run_catalog, SAXS_1D_I_stream).to_dask().rename({SAXS_1D_I_field: SAXS_1D_I_projection_key})
-    SAXS_1D_Q = getattr(run_catalog, SAXS_1D_Q_stream).to_dask().rename({SAXS_1D_Q_field: SAXS_1D_Q_projection_key})
+    SAXS_1D_I = stream_to_dask(SAXS_1D_I_stream).isel(time=slice(-1, None)).rename({SAXS_1D_I_field: SAXS_1D_I_projection_key})
+    SAXS_1D_Q = stream_to_dask(SAXS_1D_Q_stream).isel(time=slice(-1, None)).rename({SAXS_1D_Q_field: SAXS_1D_Q_projection_key})
     SAXS_1D_I = np.squeeze(SAXS_1D_I)
     SAXS_1D_Q = np.squeeze(SAXS_1D_Q)
 
     SAXS_1D_I_partial_stream = projection['projection'][SAXS_1D_I_partial_projection_key]['stream']
     SAXS_1D_I_partial_field = projection['projection'][SAXS_1D_I_partial_projection_key]['field']
-    SAXS_1D_I_partial = getattr(run_catalog, SAXS_1D_I_partial_stream).to_dask().\
+    SAXS_1D_I_partial = stream_to_dask(SAXS_1D_I_partial_stream).isel(time=slice(-1, None)).\
                                 rename({SAXS_1D_I_partial_field: SAXS_1D_I_partial_projection_key})[SAXS_1D_I_partial_projection_key]
     SAXS_1D_I_partial = np.squeeze(SAXS_1D_I_partial)
 
+    # Only a missing raw stream is expected here; failures building the intent are not hidden
     try:
         raw_data_stream = projection['projection'][raw_data_projection_key]['stream']
         raw_data_field = projection['projection'][raw_data_projection_key]['field']
-        raw_data = getattr(run_catalog, raw_data_stream).to_dask().rename({raw_data_field: raw_data_projection_key})[raw_data_projection_key]
-        raw_data = np.squeeze(raw_data)
-        intents_list.append(SAXSImageIntent(image=raw_data, name="Raw frame {}".format(catalog_name), mixins=("SAXSImageIntentBlend",)), )
-    except:
-        print('No raw data available')
-
-
-    for i in range(len(g2[g2_projection_key])):
-        g2_curve = g2[g2_projection_key][i]
-        tau = g2[tau_projection_key][i]
-        error_height = g2[g2_error_projection_key][i]
-        dqlist = g2[dqlist_key]
-        # g2_roi_name = g2[g2_roi_names_key].values[i]  # FIXME: talk to Dan about how to properly define string data keys
-        intents_list.append(ErrorBarIntent(name=f"q={dqlist[i].values[0]:.3}",
-                            canvas_name='g₂ vs. τ',
-                            match_key='g₂ vs. τ',
-                            y=g2_curve,
-                            x=tau,
-                            xLogMode=True,
-                            height=error_height,
-                            mixins=["ToggleSymbols"],
-                            labels={"left": "g₂", "bottom": "τ"}))
-
+        raw_data = stream_to_dask(raw_data_stream).rename({raw_data_field: raw_data_projection_key})
+    except (KeyError, AttributeError):
+        msg.logMessage(f"No raw data available in {catalog_name}", level=msg.WARNING)
+    else:
+        raw_data = np.squeeze(raw_data[raw_data_projection_key])
+        with profiling.stage('project.image_intent', field=raw_data_projection_key):
+            yield _image_intent(run_catalog, raw_data_projection_key, raw_data, f"Raw frame {catalog_name}")
 
+    # Lazy intents first, so they can be shown while the g2 curves are computed
     #intents_list.append(ImageIntent(image=face(True), item_name='SAXS 2D'),)
-    intents_list.append(SAXSImageIntent(image=SAXS_2D_I, name="AVG frame {}".format(catalog_name), mixins=("SAXSImageIntentBlend",)), )
-    intents_list.append(PlotIntent(y=SAXS_1D_I[SAXS_1D_I_projection_key],
-                        x=SAXS_1D_Q[SAXS_1D_Q_projection_key],
-                        labels={"left": "I", "bottom": "Q"},
-                        mixins=["ToggleSymbols"],
-                        name='AVG SAXS curve {}'.format(catalog_name)))
-
-
-    intents_list.append(PlotIntent(y=SAXS_1D_I_partial, x=SAXS_1D_Q[SAXS_1D_Q_projection_key],
-                        labels = {"left": "I", "bottom": "Q"},
-                        mixins=["ToggleSymbols"],
-                        name='Stability Plot {}'.format(catalog_name)))
-    return intents_list
-    # TODO: additionally return intents for masks, rois
+    with profiling.stage('project.image_intent', field=SAXS_2D_I_projection_key):
+        SAXS_2D_intent = _image_intent(run_catalog, SAXS_2D_I_projection_key, SAXS_2D_I, "AVG frame {}".format(catalog_name))
+    yield SAXS_2D_intent
+    yield PlotIntent(y=SAXS_1D_I[SAXS_1D_I_projection_key],
+                     x=SAXS_1D_Q[SAXS_1D_Q_projection_key],
+                     labels={"left": "I", "bottom": "Q"},
+                     mixins=["ToggleSymbols"],
+                     name='AVG SAXS curve {}'.format(catalog_name))
+
+    yield PlotIntent(y=SAXS_1D_I_partial, x=SAXS_1D_Q[SAXS_1D_Q_projection_key],
+                     labels = {"left": "I", "bottom": "Q"},
+                     mixins=["ToggleSymbols"],
+                     name='Stability Plot {}'.format(catalog_name))
+
+    yield from _roi_intents(run_catalog, projection['projection'], stream_to_dask, catalog_name)
+    yield from _screening_intents(run_catalog, projection['projection'], stream_to_dask, catalog_name)
+
+    # Materialize all g2 curves in a single compute and carry them in one multi-curve intent
+    with profiling.stage('project.compute_g2'):
+        g2_curves, tau, error_heights, dqlist = dask.compute(g2[g2_projection_key].data,
+                                                             g2[tau_projection_key].data[0],
+                                                             g2[g2_error_projection_key].data,
+                                                             g2[dqlist_key].data)
+    # g2_roi_name = g2[g2_roi_names_key].values[i]  # FIXME: talk to Dan about how to properly define string data keys
+    qs = np.reshape(dqlist, (len(dqlist), -1))[:, 0]
+    curve_names = [f"q={q:.3}" for q in qs]
+    visible = np.zeros(len(curve_names), dtype=bool)
+    visible[np.unique(np.linspace(0, len(curve_names) - 1, min(len(curve_names), max_visible_g2_curves)).astype(int))] = True
+    yield MultiErrorBarIntent(name=f"g₂ {catalog_name}",
+                              canvas_name='g₂ vs. τ',
+                              match_key='g₂ vs. τ',
+                              y=g2_curves,
+                              x=tau,
+                              height=error_heights,
+                              curve_names=curve_names,
+                              visible=visible,
+                              xLogMode=True,
+                              mixins=["ToggleSymbols"],
+                              labels={"left": "g₂", "bottom": "τ"})
+    if g2_fit_model:
+        with profiling.stage('project.fit_g2', model=g2_fit_model, curves=len(qs)):
+            fit = fit_g2(g2_curves, tau, q=qs, model=g2_fit_model, errors=error_heights)
+        yield from fit_intents(fit, catalog_name, visible=visible)
+
+
+def _optional_field(run_catalog: BlueskyRun, projection: dict, stream_to_dask, key: str):
+    # The latest value of a projected field as a dask array, or None when the run has no such stream or field
+    if key not in projection or projection[key]['stream'] not in run_catalog:
+        return None
+    stream = stream_to_dask(projection[key]['stream'])
+    if projection[key]['field'] not in stream:
+        return None
+    return np.squeeze(stream[projection[key]['field']].isel(time=-1).data)
+
+
+def _roi_intents(run_catalog: BlueskyRun, projection: dict, stream_to_dask, catalog_name: str) -> Iterator[Intent]:
+    # Mask and ROI label images, and the per-ROI statistics precomputed on ingest; runs ingested without them (or
+    # before they were projected) have none of these streams
+    def field(key):
+        return _optional_field(run_catalog, projection, stream_to_dask, key)
+
+    mask, rois = field(XPCS_mask_projection_key), field(XPCS_roi_projection_key)
+    if mask is not None:
+        yield ImageIntent(image=mask, name=f"Mask {catalog_name}")
+    if rois is not None:
+        yield ImageIntent(image=rois, name=f"ROIs {catalog_name}")
+
+    labels = field(ROI_labels_key)
+    if labels is None:
+        return
+    # Only a few numbers per ROI; read them all at once
+    with profiling.stage('project.roi_statistics'):
+        labels, pixel_count, mean_intensity, contrast = dask.compute(labels, field(ROI_pixel_count_key),
+                                                                     field(ROI_mean_intensity_key),
+                                                                     field(ROI_contrast_key))
+    labels = np.atleast_1d(labels)
+    mean_intensity = np.reshape(mean_intensity, (-1, len(labels)))
+    yield PlotIntent(x=labels,
+                     y=np.atleast_1d(pixel_count),
+                     labels={"left": "pixels", "bottom": "ROI"},
+                     mixins=["ToggleSymbols"],
+                     name=f"ROI pixel count {catalog_name}")
+    yield PlotIntent(x=np.arange(len(mean_intensity)),
+                     y=mean_intensity.T,
+                     labels={"left": "⟨I⟩", "bottom": "frame"},
+                     mixins=["ToggleSymbols"],
+                     name=f"ROI intensity {catalog_name}")
+    contrast = np.atleast_1d(contrast)
+    if np.isfinite(contrast).any():
+        yield PlotIntent(x=labels,
+                         y=contrast,
+                         labels={"left": "β", "bottom": "ROI"},
+                         mixins=["ToggleSymbols"],
+                         name=f"ROI speckle contrast {catalog_name}")
+
+
+def _screening_intents(run_catalog: BlueskyRun, projection: dict, stream_to_dask,
+                       catalog_name: str) -> Iterator[Intent]:
+    # Per-frame statistics of runs ingested with frame screening
+    total_intensity = _optional_field(run_catalog, projection, stream_to_dask, frame_total_intensity_key)
+    if total_intensity is None:
+        return
+    with profiling.stage('project.frame_screening'):
+        total_intensity, roi_mean, similarity, outliers = dask.compute(
+            total_intensity,
+            _optional_field(run_catalog, projection, stream_to_dask, frame_roi_mean_key),
+            _optional_field(run_catalog, projection, stream_to_dask, frame_similarity_key),
+            _optional_field(run_catalog, projection, stream_to_dask, frame_outlier_key))
+    yield from screening_intents(np.atleast_1d(total_intensity), roi_mean, np.atleast_1d(similarity),
+                                 np.atleast_1d(outliers), catalog_name)
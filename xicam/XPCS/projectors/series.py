@@ -0,0 +1,231 @@
+"""Projection of a series of nxXPCS runs (e.g. a temperature or time series) onto common q and tau grids.
+
+``project_series`` reads the g2 and stability streams of every run once, as dask arrays, and stacks them into lazy
+xarray DataArrays of shape (run, q, tau): the q-bins of each run are matched to the nearest q of the common grid
+(within ``q_tolerance``) and its g2 curves are interpolated onto the common tau grid in log tau. Points a run does
+not cover are NaN. Computing a series evaluates all runs in parallel on the dask scheduler.
+"""
+from dataclasses import dataclass
+from typing import List, Sequence
+
+import dask
+import dask.array as da
+import numpy as np
+import xarray
+from databroker.core import BlueskyRun
+from xicam.core.data.bluesky_utils import display_name
+from xicam.core.intents import ErrorBarIntent, Intent, PlotIntent
+
+from ..fitting.g2 import fit_g2
+from ..ingestors import g2_projection_key, g2_error_projection_key, tau_projection_key, dqlist_key, \
+                        SAXS_1D_I_partial_projection_key
+from ..intents import MultiErrorBarIntent
+from .nexus import find_nxXPCS_projection
+
+# Largest relative distance |q_run - q| / q at which a q-bin of a run is matched to q of the common grid
+q_tolerance = .05
+
+
+def match_q(run_q: np.ndarray, q: np.ndarray, tolerance: float = None) -> np.ndarray:
+    """Return, for every q of the common grid, the index of the nearest q-bin in ``run_q``, or -1 if none is within
+    ``tolerance`` (relative)."""
+    tolerance = q_tolerance if tolerance is None else tolerance
+    run_q, q = np.asarray(run_q, dtype=float), np.asarray(q, dtype=float)
+    if not len(run_q):
+        return np.full(len(q), -1)
+    nearest = np.abs(run_q[None, :] - q[:, None]).argmin(axis=1)
+    close = np.abs(run_q[nearest] - q) <= tolerance * np.abs(q)
+    return np.where(close, nearest, -1)
+
+
+def _align(curves: np.ndarray, q_index: np.ndarray, run_tau: np.ndarray, tau: np.ndarray) -> np.ndarray:
+    # curves has shape (len(run q), len(run_tau)); returns shape (len(q_index), len(tau))
+    curves = np.asarray(curves, dtype=float)
+    if not len(curves):
+        return np.full((len(q_index), len(tau)), np.nan)
+    selected = np.where((q_index >= 0)[:, None], curves[np.clip(q_index, 0, None)], np.nan)
+    if len(run_tau) == len(tau) and np.allclose(run_tau, tau):
+        return selected
+    # Interpolate in log tau; nothing is extrapolated
+    log_run_tau, log_tau = np.log(run_tau), np.log(tau)
+    return np.stack([np.interp(log_tau, log_run_tau, curve, left=np.nan, right=np.nan) for curve in selected]) \
+        if len(selected) else np.empty((0, len(tau)))
+
+
+def _stability(I_partial: np.ndarray) -> np.ndarray:
+    # Mean over q of the spread of the partial I(q) relative to their mean, as a 0-d array so that dask can stack it
+    I_partial = np.atleast_2d(np.squeeze(np.asarray(I_partial, dtype=float)))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        spread = np.ptp(I_partial, axis=0) / np.abs(I_partial.mean(axis=0))
+    return np.asarray(np.nanmean(spread) if np.isfinite(spread).any() else np.nan, dtype=float)
+
+
+def _read_run(run_catalog: BlueskyRun) -> dict:
+    # Convert the g2 stream (and the stability stream) of a run to dask once
+    projection = find_nxXPCS_projection(run_catalog)['projection']
+    streams = {}
+
+    def field(key):
+        stream = projection[key]['stream']
+        if stream not in streams:
+            streams[stream] = getattr(run_catalog, stream).to_dask()
+        return streams[stream][projection[key]['field']].data
+
+    return {'g2': field(g2_projection_key),
+            'g2_errors': field(g2_error_projection_key),
+            'tau': field(tau_projection_key)[0],
+            'dqlist': field(dqlist_key),
+            'I_partial': field(SAXS_1D_I_partial_projection_key)[-1]}
+
+
+@dataclass
+class G2Series:
+    """g2 of many runs on common q and tau grids.
+
+    ``g2`` and ``g2_errors`` are lazy DataArrays with dims (run, q, tau); ``stability`` is the mean relative spread of
+    the partial SAXS curves of each run (dims (run,)). The run dimension has a ``name`` coordinate and, if a start
+    document key was given to ``project_series``, a ``value`` coordinate holding it (e.g. the temperature).
+    """
+    runs: List[BlueskyRun]
+    g2: xarray.DataArray
+    g2_errors: xarray.DataArray
+    stability: xarray.DataArray
+
+    @property
+    def q(self) -> np.ndarray:
+        return self.g2['q'].values
+
+    @property
+    def tau(self) -> np.ndarray:
+        return self.g2['tau'].values
+
+    @property
+    def run_values(self) -> np.ndarray:
+        """The ``value`` coordinate of the runs, or their position in the series"""
+        if 'value' in self.g2.coords:
+            return self.g2['value'].values
+        return np.arange(len(self.runs))
+
+    def nearest_q(self, q: float) -> int:
+        return int(np.abs(self.q - q).argmin())
+
+    def compute(self) -> 'G2Series':
+        """Evaluate all runs at once and return the series with in-memory arrays."""
+        g2, g2_errors, stability = dask.compute(self.g2, self.g2_errors, self.stability)
+        return G2Series(self.runs, g2, g2_errors, stability)
+
+    def fit(self, model: str = 'single', **kwargs) -> xarray.Dataset:
+        """Fit ``model`` to the g2 curves of every run and q at once, returning Γ, its error and β with dims
+        (run, q). ``kwargs`` are passed to ``fit_g2``."""
+        g2, g2_errors = dask.compute(self.g2.data, self.g2_errors.data)
+        num_runs, num_q, num_tau = g2.shape
+        fit = fit_g2(g2.reshape(-1, num_tau), self.tau, q=np.tile(self.q, num_runs), model=model,
+                     errors=g2_errors.reshape(-1, num_tau), **kwargs)
+        coords = {key: value for key, value in self.g2.coords.items() if key != 'tau'}
+        dims = ('run', 'q')
+        return xarray.Dataset({'relaxation_rate': (dims, fit.relaxation_rate.reshape(num_runs, num_q)),
+                               'relaxation_rate_error': (dims, fit.relaxation_rate_error.reshape(num_runs, num_q)),
+                               'beta': (dims, fit.beta.reshape(num_runs, num_q)),
+                               'chi2': (dims, fit.chi2.reshape(num_runs, num_q))},
+                              coords=coords, attrs={'model': model})
+
+
+def project_series(runs: Sequence[BlueskyRun],
+                   q: np.ndarray = None,
+                   tau: np.ndarray = None,
+                   coordinate: str = None,
+                   tolerance: float = None) -> G2Series:
+    """Stack the g2 curves of nxXPCS ``runs`` into a lazy G2Series on common q and tau grids.
+
+    The grids default to the q-bins and tau of the first run. ``coordinate`` names a start document key (e.g.
+    'temperature') whose value labels each run. Only q and tau of each run are read here, in one compute; the g2
+    curves are read when the series is computed.
+    """
+    runs = list(runs)
+    if not runs:
+        raise ValueError("A series needs at least one run.")
+    arrays = [_read_run(run) for run in runs]
+    run_grids = dask.compute(*[(array['dqlist'], array['tau']) for array in arrays])
+    run_qs = [np.reshape(dqlist, (len(dqlist), -1))[:, 0].astype(float) for dqlist, _ in run_grids]
+    run_taus = [np.asarray(run_tau, dtype=float) for _, run_tau in run_grids]
+    q = run_qs[0] if q is None else np.asarray(q, dtype=float)
+    tau = run_taus[0] if tau is None else np.asarray(tau, dtype=float)
+
+    def aligned(key):
+        stacked = []
+        for array, run_q, run_tau in zip(arrays, run_qs, run_taus):
+            curves = da.from_delayed(dask.delayed(_align)(array[key], match_q(run_q, q, tolerance), run_tau, tau),
+                                     shape=(len(q), len(tau)), dtype=float)
+            stacked.append(curves)
+        return da.stack(stacked)
+
+    coords = {'q': q, 'tau': tau, 'name': ('run', [display_name(run).split(" ")[0] for run in runs])}
+    if coordinate:
+        coords['value'] = ('run', [run.metadata['start'].get(coordinate, np.nan) for run in runs])
+    g2 = xarray.DataArray(aligned('g2'), dims=('run', 'q', 'tau'), coords=coords, name='g2')
+    g2_errors = xarray.DataArray(aligned('g2_errors'), dims=('run', 'q', 'tau'), coords=coords, name='g2_errors')
+    stability = da.stack([da.from_delayed(dask.delayed(_stability)(array['I_partial']), shape=(), dtype=float)
+                          for array in arrays])
+    stability = xarray.DataArray(stability, dims=('run',),
+                                 coords={key: value for key, value in coords.items() if key not in ('q', 'tau')},
+                                 name='stability')
+    return G2Series(runs, g2, g2_errors, stability)
+
+
+def series_g2_intent(series: G2Series, q: float) -> MultiErrorBarIntent:
+    """g2 of every run at the common q nearest ``q``, one curve per run."""
+    index = series.nearest_q(q)
+    g2, g2_errors = dask.compute(series.g2.data[:, index], series.g2_errors.data[:, index])
+    return MultiErrorBarIntent(name=f"g₂ at q={series.q[index]:.3} ({len(series.runs)} runs)",
+                               canvas_name='g₂ vs. τ (series)',
+                               match_key='g₂ vs. τ (series)',
+                               x=series.tau,
+                               y=g2,
+                               height=g2_errors,
+                               curve_names=list(series.g2['name'].values),
+                               xLogMode=True,
+                               mixins=["ToggleSymbols"],
+                               labels={"left": "g₂", "bottom": "τ"})
+
+
+def series_rate_intent(series: G2Series, q: float, model: str = 'single', fit: xarray.Dataset = None) -> ErrorBarIntent:
+    """Γ at the common q nearest ``q`` against the runs (``fit`` is a previous ``G2Series.fit`` result)."""
+    fit = series.fit(model) if fit is None else fit
+    index = series.nearest_q(q)
+    rate_errors = np.nan_to_num(fit['relaxation_rate_error'].values[:, index])
+    run_label = 'value' if 'value' in series.g2.coords else 'run'
+    return ErrorBarIntent(name=f"Γ ({fit.attrs['model']}) at q={series.q[index]:.3}",
+                          canvas_name='Γ vs. run',
+                          match_key='Γ vs. run',
+                          x=series.run_values,
+                          y=fit['relaxation_rate'].values[:, index],
+                          top=rate_errors,
+                          bottom=rate_errors,
+                          symbol='o',
+                          labels={'bottom': run_label, 'left': 'Γ'})
+
+
+def series_stability_intent(series: G2Series) -> PlotIntent:
+    """Relative spread of the partial SAXS curves of each run against the runs."""
+    return PlotIntent(name=f"Stability ({len(series.runs)} runs)",
+                      canvas_name='Stability vs. run',
+                      match_key='Stability vs. run',
+                      x=series.run_values,
+                      y=series.stability.values,
+                      symbol='o',
+                      labels={'bottom': 'value' if 'value' in series.g2.coords else 'run', 'left': 'ΔI / I'})
+
+
+def project_nxXPCS_series(runs: Sequence[BlueskyRun],
+                          q: float = None,
+                          model: str = None,
+                          coordinate: str = None,
+                          **kwargs) -> List[Intent]:
+    """Return the series intents of ``runs``: g2 of every run at ``q`` (the middle of the common q grid by default),
+    their stability and, with a fit ``model``, Γ at ``q`` against the runs. ``kwargs`` go to ``project_series``."""
+    series = project_series(runs, coordinate=coordinate, **kwargs).compute()
+    q = series.q[len(series.q) // 2] if q is None else q
+    intents = [series_g2_intent(series, q), series_stability_intent(series)]
+    if model:
+        intents.append(series_rate_intent(series, q, model=model))
+    return intents
@@ -0,0 +1,137 @@
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Tuple
+
+import numpy as np
+
+from ..ingestors import _compose_nxXPCS, raw_data_projection_key, raw_sparse_projection_key
+from ..ingestors.lazy import handle_pool
+from ..sparse import SparseFrames, read_frames
+from .index import QROIIndex
+from .screening import screen_frames
+
+
+@dataclass
+class FrameReduction:
+    """Averages of a frame stack: the mean image, I(Q) and I(Q) per partition of consecutive frames."""
+    mean_image: np.ndarray
+    q: np.ndarray
+    I: np.ndarray
+    I_partial: np.ndarray
+    num_frames: int
+
+
+class StreamingFrameReducer:
+    """Accumulates the mean image, the per-bin I(Q) and the per-partition I(Q) of a frame stack in one pass.
+
+    Frames are split into ``num_partitions`` partitions of consecutive frames, as for the stability plot. Blocks can
+    be reduced in any order (and concurrently, with ``reduce_block``); only sums are kept, so memory does not grow
+    with the number of frames.
+
+    Frames left out by ``frame_mask`` (e.g. ``FrameScreen.keep``) are not averaged; they still count towards the
+    partition boundaries, so partitions keep covering the same stretches of time.
+    """
+
+    def __init__(self, index: QROIIndex, num_frames: int, num_partitions: int = 10, frame_mask: np.ndarray = None):
+        self.index = index
+        self.num_frames = num_frames
+        self.frame_mask = None if frame_mask is None else np.asarray(frame_mask, dtype=bool)
+        self.num_partitions = min(num_partitions, num_frames)
+        self._image_sum = np.zeros(index.shape)
+        self._partition_sums = np.zeros((self.num_partitions, index.num_bins))
+        self._partition_counts = np.zeros(self.num_partitions, dtype=np.int64)
+
+    def reduce_block(self, frames: np.ndarray, start: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Return the (image sum, per-partition I(Q) sums, per-partition frame counts) of frames start, start + 1, ..."""
+        if not isinstance(frames, SparseFrames):
+            frames = np.asarray(frames)
+        partitions = np.arange(start, start + len(frames)) * self.num_partitions // self.num_frames
+        if self.frame_mask is not None:
+            keep = self.frame_mask[start:start + len(frames)]
+            if not keep.all():
+                frames = frames.take(keep) if isinstance(frames, SparseFrames) else frames[keep]
+                partitions = partitions[keep]
+        partition_sums = np.zeros_like(self._partition_sums)
+        np.add.at(partition_sums, partitions, self.index.mean(frames))
+        return (frames.sum(axis=0, dtype=np.float64), partition_sums,
+                np.bincount(partitions, minlength=self.num_partitions))
+
+    def add(self, sums: Tuple[np.ndarray, np.ndarray, np.ndarray]):
+        image_sum, partition_sums, partition_counts = sums
+        self._image_sum += image_sum
+        self._partition_sums += partition_sums
+        self._partition_counts += partition_counts
+
+    def update(self, frames: np.ndarray, start: int):
+        self.add(self.reduce_block(frames, start))
+
+    def result(self) -> FrameReduction:
+        num_frames = self._partition_counts.sum()
+        q = self.index.q if self.index.q is not None else self.index.labels.astype(float)
+        with np.errstate(invalid='ignore'):
+            return FrameReduction(mean_image=self._image_sum / num_frames,
+                                  q=q,
+                                  I=self._partition_sums.sum(axis=0) / num_frames,
+                                  I_partial=self._partition_sums / self._partition_counts[:, None],
+                                  num_frames=int(num_frames))
+
+
+def reduce_frames(frames,
+                  index: QROIIndex,
+                  num_partitions: int = 10,
+                  block_size: int = 64,
+                  max_workers: int = None,
+                  frame_mask: np.ndarray = None) -> FrameReduction:
+    """Reduce a (N, q_x, q_y) frame stack (NumPy, h5py, dask or SparseFrames) into its mean image, I(Q) and
+    per-partition I(Q).
+
+    Blocks of ``block_size`` frames are read in order while up to ``max_workers`` threads reduce the previous
+    ones, so at most about 2 x max_workers blocks are in memory at once. Only the frames in ``frame_mask`` (all by
+    default) are averaged.
+    """
+    max_workers = max_workers or os.cpu_count()
+    reducer = StreamingFrameReducer(index, len(frames), num_partitions=num_partitions, frame_mask=frame_mask)
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for start in range(0, len(frames), block_size):
+            block = read_frames(frames, start, start + block_size)
+            pending.append(executor.submit(reducer.reduce_block, block, start))
+            while len(pending) > 2 * max_workers:
+                reducer.add(pending.popleft().result())
+        while pending:
+            reducer.add(pending.popleft().result())
+    return reducer.result()
+
+
+def reduce_nxXPCS(paths,
+                  index: QROIIndex,
+                  num_partitions: int = 10,
+                  block_size: int = 64,
+                  max_workers: int = None,
+                  screen: bool = False,
+                  screening_threshold: float = None,
+                  **ingest_kwargs):
+    """Ingest an nxXPCS file like ``ingest_nxXPCS``, recomputing SAXS_2D, SAXS_1D and SAXS_1D_I_partial from the
+    raw frames.
+
+    ``index`` defines the q-bins (and, through the pixels it leaves out, the mask); see ``geometry_index`` and
+    ``QROIIndex.from_labels``. The emitted streams are the same as those of ``ingest_nxXPCS``, so the result
+    projects with ``project_nxXPCS``.
+
+    With ``screen``, the frames are first screened per q-bin of ``index`` (see ``screen_frames``); outliers are
+    left out of the averages and the screening is emitted in the 'frame_screening' stream.
+    """
+    assert len(paths) == 1
+    path = paths[0]
+    with handle_pool.open(path) as h5:
+        if raw_data_projection_key in h5:
+            frames = h5[raw_data_projection_key]
+        else:
+            frames = SparseFrames.from_hdf5(path, raw_sparse_projection_key)
+        screening = screen_frames(frames, index, block_size=block_size, threshold=screening_threshold) \
+            if screen else None
+        reduction = reduce_frames(frames, index, num_partitions=num_partitions, block_size=block_size,
+                                  max_workers=max_workers, frame_mask=screening.keep if screen else None)
+    yield from _compose_nxXPCS(path, reduction=reduction, screening=screening, **ingest_kwargs)
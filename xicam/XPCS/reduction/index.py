@@ -0,0 +1,151 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from scipy import sparse
+
+from ..sparse import SparseFrames
+
+# Indices of recently used label arrays and geometries, most recently used last
+_index_cache = OrderedDict()
+_index_cache_lock = threading.Lock()
+index_cache_size = 16
+
+
+def _array_digest(array: np.ndarray) -> str:
+    array = np.ascontiguousarray(array)
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(repr((array.shape, array.dtype.str)).encode())
+    digest.update(array.data)
+    return digest.hexdigest()
+
+
+class QROIIndex:
+    """CSR-style index of the detector pixels belonging to each q-bin (or ROI).
+
+    ``pixel_index`` holds the flat indices of all binned pixels, sorted by bin, so that the pixels of bin i are
+    ``pixel_index[offsets[i]:offsets[i] + sizes[i]]``. Per-bin reductions of a frame (or a block of frames) are then a
+    single gather followed by one ``np.add.reduceat`` pass instead of one boolean mask per bin. Only non-empty bins
+    are indexed; ``labels`` holds their (1-based) bin numbers and ``q`` their mean q, when known.
+    """
+
+    def __init__(self, pixel_index: np.ndarray, labels: np.ndarray, offsets: np.ndarray, shape, q: np.ndarray = None):
+        self.pixel_index = pixel_index
+        self.labels = labels
+        self.offsets = offsets
+        self.sizes = np.diff(np.append(offsets, len(pixel_index)))
+        self.shape = tuple(shape)
+        self.q = q
+        self._bin_matrix = None
+
+    @classmethod
+    def from_labels(cls, labels: np.ndarray, q: np.ndarray = None) -> 'QROIIndex':
+        """Index a label array with ROIs numbered from 1 and 0 for background."""
+        labels = np.asarray(labels)
+        flat = labels.ravel()
+        pixels = np.flatnonzero(flat > 0)
+        pixels = pixels[np.argsort(flat[pixels], kind='stable')]
+        roi_labels, offsets = np.unique(flat[pixels], return_index=True)
+        return cls(pixels, roi_labels, offsets, labels.shape, q=q)
+
+    @classmethod
+    def from_qmap(cls, qmap: np.ndarray, bins=100, mask: np.ndarray = None) -> 'QROIIndex':
+        """Index a q-map into ``bins`` (a number of linear bins or the bin edges); masked pixels (True) are skipped."""
+        qmap = np.asarray(qmap)
+        valid = np.isfinite(qmap) if mask is None else np.isfinite(qmap) & ~np.asarray(mask, dtype=bool)
+        if np.isscalar(bins):
+            bins = np.linspace(qmap[valid].min(), qmap[valid].max(), int(bins) + 1)
+        labels = np.digitize(qmap, bins)
+        # Pixels on the last edge belong to the last bin; everything outside the edges is background
+        labels[qmap == bins[-1]] = len(bins) - 1
+        labels[~valid | (labels > len(bins) - 1)] = 0
+        index = cls.from_labels(labels)
+        index.q = index.mean(qmap)
+        return index
+
+    @property
+    def num_bins(self) -> int:
+        return len(self.labels)
+
+    def label_array(self) -> np.ndarray:
+        """Return the label array (0 for unindexed pixels) described by this index."""
+        labels = np.zeros(int(np.prod(self.shape)), dtype=self.labels.dtype)
+        labels[self.pixel_index] = np.repeat(self.labels, self.sizes)
+        return labels.reshape(self.shape)
+
+    def gather(self, frames, dtype=np.float64) -> np.ndarray:
+        """Return the binned pixels of a frame or a block of frames, sorted by bin, with shape (..., num_pixels)."""
+        frames = np.asarray(frames)
+        leading = frames.shape[:frames.ndim - len(self.shape)]
+        # np.take keeps the result C-contiguous (unlike fancy indexing), which makes the reduceat passes fast
+        return np.take(frames.reshape(*leading, -1), self.pixel_index, axis=-1).astype(dtype, copy=False)
+
+    def gather_sparse(self, frames: SparseFrames, dtype=np.float64) -> sparse.csr_matrix:
+        """Return the binned pixels of sparse frames, sorted by bin, as a (num_frames, num_pixels) CSR matrix."""
+        return frames.csr(dtype=dtype)[:, self.pixel_index]
+
+    def reduce(self, values) -> np.ndarray:
+        """Sum gathered ``values`` of shape (..., num_pixels) per bin, giving shape (..., num_bins).
+
+        Sparse ``values`` (from ``gather_sparse``) are reduced with one sparse product.
+        """
+        if sparse.issparse(values):
+            if self._bin_matrix is None:
+                bins = np.repeat(np.arange(self.num_bins), self.sizes)
+                self._bin_matrix = sparse.csr_matrix((np.ones(len(bins)), (np.arange(len(bins)), bins)),
+                                                     shape=(len(bins), self.num_bins))
+            return np.asarray((values @ self._bin_matrix).todense())
+        return np.add.reduceat(values, self.offsets, axis=-1)
+
+    def segments(self, values: np.ndarray):
+        """Yield the per-bin views of gathered ``values``."""
+        for offset, size in zip(self.offsets, self.sizes):
+            yield values[..., offset:offset + size]
+
+    def sum(self, frames) -> np.ndarray:
+        if isinstance(frames, SparseFrames):
+            return self.reduce(self.gather_sparse(frames))
+        return self.reduce(self.gather(frames))
+
+    def mean(self, frames) -> np.ndarray:
+        return self.sum(frames) / self.sizes
+
+    def variance(self, frames) -> np.ndarray:
+        values = self.gather(frames)
+        mean = self.reduce(values) / self.sizes
+        return np.clip(self.reduce(values ** 2) / self.sizes - mean ** 2, 0, None)
+
+
+def _cached(key, build) -> QROIIndex:
+    with _index_cache_lock:
+        if key in _index_cache:
+            _index_cache.move_to_end(key)
+            return _index_cache[key]
+    index = build()
+    with _index_cache_lock:
+        _index_cache[key] = index
+        while len(_index_cache) > index_cache_size:
+            _index_cache.popitem(last=False)
+    return index
+
+
+def roi_index(labels: np.ndarray) -> QROIIndex:
+    """Return the (cached) index of a label array."""
+    labels = np.asarray(labels)
+    return _cached(('labels', _array_digest(labels)), lambda: QROIIndex.from_labels(labels))
+
+
+def geometry_index(geometry, shape, bins=100, mask: np.ndarray = None) -> QROIIndex:
+    """Return the (cached) q-bin index of a detector of ``shape`` for a pyFAI ``geometry``.
+
+    The index is rebuilt only when the geometry, shape, binning or mask change.
+    """
+    key = ('geometry', repr(sorted(geometry.get_config().items())), geometry.wavelength, tuple(shape),
+           repr(np.asarray(bins).tolist()), None if mask is None else _array_digest(mask))
+    return _cached(key, lambda: QROIIndex.from_qmap(geometry.qArray(tuple(shape)), bins=bins, mask=mask))
+
+
+def clear_index_cache():
+    with _index_cache_lock:
+        _index_cache.clear()
@@ -0,0 +1,254 @@
+import hashlib
+import os
+import threading
+import weakref
+from collections import Counter
+from pathlib import Path
+from typing import Sequence
+
+import dask.array as da
+import h5py
+import numpy as np
+from dask.base import tokenize
+from xicam.core.paths import user_cache_dir
+
+from ..ingestors.cache import IngestCache
+
+
+class PyramidCache(IngestCache):
+    """Directory of HDF5 files holding image pyramids, evicted least recently used first like the ingest cache."""
+
+    suffix = '.h5'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Pyramid files held open in this process (by resolved path); eviction leaves them alone
+        self.open_files = Counter()
+
+    def _in_use(self, entry: Path) -> bool:
+        return self.open_files[str(Path(entry).resolve())] > 0
+
+    def path(self, *identity) -> Path:
+        """Return the pyramid file for ``identity`` (e.g. a run uid and field), or None when disabled.
+
+        Nothing is created here; the directory is made and the cache trimmed when an ImagePyramid writes a new file.
+        """
+        if not self.enabled:
+            return None
+        return self._entry(hashlib.blake2b(repr(identity).encode(), digest_size=16).hexdigest())
+
+
+pyramid_cache = PyramidCache(directory=os.environ.get('XICAM_XPCS_PYRAMID_DIR',
+                                                      os.path.join(user_cache_dir, 'XPCS', 'pyramid')),
+                             max_bytes=2 ** 32,
+                             enabled=os.environ.get('XICAM_XPCS_PYRAMID_CACHE', '1') != '0')
+
+
+def _close_file(file: h5py.File, cache: PyramidCache, key: str):
+    file.close()
+    if cache is not None:
+        cache.open_files[key] -= 1
+        if cache.open_files[key] <= 0:
+            del cache.open_files[key]
+
+
+def _pool(block: np.ndarray, factor: int, reduction: str) -> np.ndarray:
+    num_frames, height, width = block.shape
+    height, width = height // factor, width // factor
+    # Edge pixels that do not fill a whole factor x factor cell are dropped
+    block = block[:, :height * factor, :width * factor].reshape(num_frames, height, factor, width, factor)
+    if reduction == 'max':
+        return block.max(axis=(2, 4))
+    return block.mean(axis=(2, 4), dtype=np.float64).astype(np.float32)
+
+
+class PyramidLevel:
+    """Array-like view of one pyramid level; reading a slice only loads (or pools) the blocks of frames it touches.
+
+    Unlike the dask arrays in ``ImagePyramid.levels``, reads carry no graph overhead, which matters when a viewer
+    fetches one frame at a time.
+    """
+
+    def __init__(self, pyramid: 'ImagePyramid', level: int, dtype):
+        self._pyramid = pyramid
+        self._level = level
+        self.shape = pyramid._shape(level)
+        self.dtype = np.dtype(dtype)
+        self.ndim = len(self.shape)
+
+    @property
+    def size(self) -> int:
+        return int(np.prod(self.shape))
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, key):
+        key = key if isinstance(key, tuple) else (key,)
+        if any(item is Ellipsis for item in key):
+            return np.asarray(self)[key]
+        if not self._pyramid.stacked:
+            return self._pyramid._block(self._level, 0)[0][key]
+
+        frames = np.arange(self.shape[0])[key[0]] if key else np.arange(self.shape[0])
+        frames_per_block = self._pyramid.frames_per_block
+        blocks = {block: self._pyramid._block(self._level, block)
+                  for block in np.unique(np.atleast_1d(frames) // frames_per_block)}
+        if np.ndim(frames) == 0:
+            return blocks[frames // frames_per_block][frames % frames_per_block][key[1:]]
+        stack = np.stack([blocks[frame // frames_per_block][frame % frames_per_block] for frame in frames])
+        return stack[(slice(None), *key[1:])].astype(self.dtype, copy=False)
+
+    def __array__(self, dtype=None, copy=None):
+        array = self[:] if self._pyramid.stacked else self[()]
+        return array if dtype is None else array.astype(dtype)
+
+    def min(self, *args, **kwargs):
+        return np.asarray(self).min(*args, **kwargs)
+
+    def max(self, *args, **kwargs):
+        return np.asarray(self).max(*args, **kwargs)
+
+    def squeeze(self):
+        return self[0] if self._pyramid.stacked and self.shape[0] == 1 else self
+
+
+class ImagePyramid:
+    """Downsampled copies of an image, or of a stack of frames, at increasing ``factors``.
+
+    ``levels[0]`` is the source and ``levels[i]`` is pooled (``reduction`` is 'mean' or 'max') over factors[i - 1]
+    x factors[i - 1] pixel cells. Levels are lazy dask arrays: a block of ``frames_per_block`` frames is only pooled
+    when it is first read, from the next finer level, and is then stored in the HDF5 file ``path`` (if given) so
+    that it is never computed again. ``arrays`` holds the same levels as PyramidLevel array-likes for viewers.
+
+    ``cache`` (a PyramidCache holding ``path``) is trimmed when the file is first created. The file is open from
+    the first cached read or write until ``close()`` or until the pyramid is garbage collected (e.g. with its
+    intent); meanwhile ``cache`` does not evict it.
+    """
+
+    def __init__(self,
+                 source,
+                 factors: Sequence[int] = (2, 4, 8),
+                 reduction: str = 'mean',
+                 path=None,
+                 frames_per_block: int = None,
+                 token=None,
+                 cache: PyramidCache = None):
+        if reduction not in ('mean', 'max'):
+            raise ValueError(f"reduction must be 'mean' or 'max', got {reduction!r}.")
+        self.factors = (1, *factors)
+        if any(coarse % fine for fine, coarse in zip(self.factors, self.factors[1:])):
+            raise ValueError(f"Each factor must be a multiple of the previous one, got {factors}.")
+        self.source = source
+        self.reduction = reduction
+        self.path = path
+        self.cache = cache
+        self.stacked = len(source.shape) == 3
+        num_frames = source.shape[0] if self.stacked else 1
+        # Follow the on-disk (or dask) chunking of the source, so that reading one frame reads one source chunk
+        frame_chunks = (getattr(source, 'chunks', None) or (16,))[0] if self.stacked else 1
+        self.frames_per_block = frames_per_block or min(np.max(frame_chunks), num_frames)
+        self.token = token if token is not None else tokenize(source)
+        self._group = tokenize(self.token, reduction)
+        self._lock = threading.Lock()
+        self._file = None
+        self._finalizer = None
+        self._cached = {}
+
+        self._block_starts = list(range(0, num_frames, self.frames_per_block))
+        dtype = source.dtype if reduction == 'max' else np.dtype(np.float32)
+        self.arrays = [source] + [PyramidLevel(self, level, dtype) for level in range(1, len(self.factors))]
+        self.levels = [source if isinstance(source, da.Array) else da.from_array(source, chunks=self._chunks(0))]
+        self.levels.extend(da.from_array(array, chunks=self._chunks(level), asarray=True, lock=False,
+                                         name=f'pyramid-{factor}-' + tokenize(self.token, reduction))
+                           for level, (array, factor) in enumerate(zip(self.arrays, self.factors)) if level)
+
+    def _shape(self, level: int) -> tuple:
+        height, width = self.source.shape[-2:]
+        factor = self.factors[level]
+        return (*self.source.shape[:-2], height // factor, width // factor)
+
+    def _chunks(self, level: int) -> tuple:
+        frame_chunks = ((self.frames_per_block,) * (len(self._block_starts) - 1)
+                        + (self.source.shape[0] - self._block_starts[-1],),) if self.stacked else ()
+        return (*frame_chunks, *((size,) for size in self._shape(level)[-2:]))
+
+    def _read_source(self, block: int) -> np.ndarray:
+        start = self._block_starts[block]
+        if not self.stacked:
+            return np.asarray(self.source)[None]
+        return np.asarray(self.source[start:start + self.frames_per_block])
+
+    def _block(self, level: int, block: int) -> np.ndarray:
+        if level == 0:
+            return self._read_source(block)
+        cached = self._read_cached(level, block)
+        if cached is not None:
+            return cached
+        pooled = _pool(self._block(level - 1, block), self.factors[level] // self.factors[level - 1], self.reduction)
+        self._write_cached(level, block, pooled)
+        return pooled
+
+    def _h5(self) -> h5py.File:
+        if self._file is None:
+            created = not Path(self.path).exists()
+            Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+            self._file = h5py.File(self.path, 'a')
+            key = str(Path(self.path).resolve())
+            if self.cache is not None:
+                self.cache.open_files[key] += 1
+            # Closes the file when the pyramid goes away without close(), so dropped intents do not leak handles
+            self._finalizer = weakref.finalize(self, _close_file, self._file, self.cache, key)
+            if created and self.cache is not None:
+                self.cache.evict()
+        return self._file
+
+    def _cached_level(self, level: int, create_dtype=None):
+        # (dataset, filled flags per block) of a level, looked up in the file once and then kept in memory
+        if level not in self._cached:
+            group = self._h5().get(self._group)
+            name = f'level_{self.factors[level]}'
+            if group is not None and name in group:
+                self._cached[level] = (group[name], group[f'{name}_filled'][()])
+            elif create_dtype is not None:
+                group = self._h5().require_group(self._group)
+                shape = (self.source.shape[0] if self.stacked else 1, *self._shape(level)[-2:])
+                dataset = group.create_dataset(name, shape=shape, dtype=create_dtype, chunks=(1, *shape[1:]))
+                group.create_dataset(f'{name}_filled', data=np.zeros(len(self._block_starts), dtype=bool))
+                self._cached[level] = (dataset, np.zeros(len(self._block_starts), dtype=bool))
+            else:
+                return None, None
+        return self._cached[level]
+
+    def _read_cached(self, level: int, block: int):
+        if self.path is None:
+            return None
+        with self._lock:
+            dataset, filled = self._cached_level(level)
+            if dataset is None or not filled[block]:
+                return None
+            start = self._block_starts[block]
+            return dataset[start:start + self.frames_per_block]
+
+    def _write_cached(self, level: int, block: int, pooled: np.ndarray):
+        if self.path is None:
+            return
+        with self._lock:
+            dataset, filled = self._cached_level(level, create_dtype=pooled.dtype)
+            start = self._block_starts[block]
+            dataset[start:start + len(pooled)] = pooled
+            dataset.parent[f'{dataset.name}_filled'][block] = True
+            filled[block] = True
+            self._file.flush()
+
+    def level_for_scale(self, scale: float) -> int:
+        """Return the coarsest level that still has at least one pixel per screen pixel, when one screen pixel
+        covers ``scale`` source pixels."""
+        return max(level for level, factor in enumerate(self.factors) if factor <= max(scale, 1))
+
+    def close(self):
+        with self._lock:
+            self._cached.clear()
+            if self._file is not None:
+                self._finalizer()
+                self._file = None
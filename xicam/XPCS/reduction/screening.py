@@ -0,0 +1,193 @@
+"""Screening of raw frames for beam dumps, detector glitches and sample shifts before correlation.
+
+``screen_frames`` makes one streaming pass over a frame stack, in blocks, and records for every frame its total
+intensity, the mean intensity of every ROI and its Pearson correlation with a running reference (an exponential
+average of the preceding blocks), so a frame that looks different from its predecessors, e.g. after a sample shift,
+scores low. Frames whose statistics lie more than ``screening_threshold`` robust standard deviations (scaled median
+absolute deviations) from the median are flagged as outliers. ``FrameScreen.keep`` is the frame mask taken by
+``reduce_frames``, ``multi_tau_correlation`` and ``two_time_correlation``.
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import List
+
+import numpy as np
+from scipy import sparse
+from xicam.core.intents import Intent, PlotIntent
+
+from ..sparse import SparseFrames, read_frames
+from .index import QROIIndex
+
+# Robust z-score beyond which a frame is an outlier
+screening_threshold = float(os.environ.get('XICAM_XPCS_SCREENING_THRESHOLD', 6))
+
+# Weight of the previous reference when a block is folded into the running reference
+reference_decay = .8
+
+
+@dataclass
+class FrameScreen:
+    """Per-frame statistics of a frame stack and the frames flagged as outliers.
+
+    ``roi_mean`` has shape (num_frames, num_rois); ``similarity`` is the Pearson correlation of each frame with the
+    running reference, over the pixels of the ROIs.
+    """
+    total_intensity: np.ndarray
+    roi_mean: np.ndarray
+    similarity: np.ndarray
+    outliers: np.ndarray
+    threshold: float
+
+    @property
+    def keep(self) -> np.ndarray:
+        """Boolean mask of the frames to correlate and average"""
+        return ~self.outliers
+
+    @property
+    def num_frames(self) -> int:
+        return len(self.total_intensity)
+
+    def rethreshold(self, threshold: float) -> 'FrameScreen':
+        """Flag outliers again at another ``threshold``, without reading the frames."""
+        return FrameScreen(self.total_intensity, self.roi_mean, self.similarity,
+                           flag_outliers(self.total_intensity, self.roi_mean, self.similarity, threshold), threshold)
+
+
+def robust_zscore(values: np.ndarray, axis: int = 0) -> np.ndarray:
+    """Distance of ``values`` from their median in units of 1.4826 x their median absolute deviation.
+
+    Where the deviation is 0, values equal to the median score 0 and any other value scores infinity.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    median = np.nanmedian(values, axis=axis, keepdims=True)
+    scale = 1.4826 * np.nanmedian(np.abs(values - median), axis=axis, keepdims=True)
+    deviation = values - median
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(scale > 0, deviation / scale, np.where(deviation == 0, 0, np.sign(deviation) * np.inf))
+
+
+def flag_outliers(total_intensity: np.ndarray,
+                  roi_mean: np.ndarray,
+                  similarity: np.ndarray,
+                  threshold: float = None) -> np.ndarray:
+    """Flag frames whose total intensity or any ROI mean is more than ``threshold`` robust standard deviations from
+    the median, or whose similarity to the reference is that far below it."""
+    threshold = screening_threshold if threshold is None else threshold
+    outliers = np.abs(robust_zscore(total_intensity)) > threshold
+    if roi_mean.size:
+        outliers |= (np.abs(robust_zscore(roi_mean)) > threshold).any(axis=1)
+    outliers |= robust_zscore(similarity) < -threshold
+    # Frames without a defined similarity (e.g. blank frames) are outliers
+    return outliers | ~np.isfinite(similarity)
+
+
+def _block_statistics(block, index: QROIIndex):
+    # Total intensity, ROI sums, and the pixels of the ROIs as a (frames, pixels) matrix
+    if isinstance(block, SparseFrames):
+        total = np.asarray(block.csr(dtype=np.float64).sum(axis=1)).ravel()
+        pixels = index.gather_sparse(block)
+    else:
+        block = np.asarray(block)
+        total = block.reshape(len(block), -1).sum(axis=1, dtype=np.float64)
+        pixels = index.gather(block)
+    return total, index.reduce(pixels), pixels
+
+
+def _similarity(pixels, reference: np.ndarray) -> np.ndarray:
+    # Pearson correlation of every row of ``pixels`` (dense or sparse) with ``reference``, from dot products only
+    num_pixels = reference.size
+    means = np.asarray(pixels.sum(axis=1)).ravel() / num_pixels
+    squares = np.asarray(pixels.multiply(pixels).sum(axis=1)).ravel() if sparse.issparse(pixels) \
+        else np.einsum('ij,ij->i', pixels, pixels)
+    reference_mean = reference.mean()
+    covariance = np.asarray(pixels @ reference).ravel() / num_pixels - means * reference_mean
+    variance = squares / num_pixels - means ** 2
+    reference_variance = reference @ reference / num_pixels - reference_mean ** 2
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return covariance / np.sqrt(np.clip(variance, 0, None) * max(reference_variance, 0))
+
+
+def _rows_mean(pixels, rows: np.ndarray) -> np.ndarray:
+    # Mean of the selected rows of ``pixels`` (dense or sparse), or None when no row is selected
+    if not rows.any():
+        return None
+    return np.asarray(pixels[np.flatnonzero(rows)].mean(axis=0)).ravel()
+
+
+def screen_frames(frames,
+                  index: QROIIndex = None,
+                  block_size: int = 64,
+                  threshold: float = None,
+                  decay: float = None) -> FrameScreen:
+    """Screen a (N, q_x, q_y) frame stack (NumPy, h5py, dask or SparseFrames) for outlier frames in one pass.
+
+    ``index`` defines the ROIs (the whole frame is one ROI by default). Blocks of ``block_size`` frames are read on a
+    background thread while the previous one is screened; only the per-frame statistics and one reference frame are
+    kept, so memory does not depend on the number of frames. Each block is compared with the reference built from
+    the blocks before it (the first block with its own mean); ``decay`` is the weight of the old reference when a
+    block mean is folded in. Frames that already stand out within their block (by total intensity or similarity,
+    or with no defined similarity) are left out of the block mean, so a glitch does not skew the reference.
+    """
+    decay = reference_decay if decay is None else decay
+    threshold = screening_threshold if threshold is None else threshold
+    num_frames = len(frames)
+    if index is None:
+        index = QROIIndex.from_labels(np.ones(np.shape(frames)[1:], dtype=np.uint8))
+    total_intensity = np.empty(num_frames)
+    roi_mean = np.empty((num_frames, index.num_bins))
+    similarity = np.empty(num_frames)
+
+    reference = None
+    starts = range(0, num_frames, block_size)
+    with ThreadPoolExecutor(max_workers=1) as reader:
+        pending = reader.submit(read_frames, frames, 0, block_size) if num_frames else None
+        for start in starts:
+            block = pending.result()
+            if start + block_size < num_frames:
+                pending = reader.submit(read_frames, frames, start + block_size, start + 2 * block_size)
+            stop = start + len(block)
+            total, roi_sums, pixels = _block_statistics(block, index)
+            typical = (np.abs(robust_zscore(total)) <= threshold) & (total > 0)
+            if reference is None:
+                reference = _rows_mean(pixels, typical)
+                if reference is None:
+                    reference = np.asarray(pixels.mean(axis=0)).ravel()
+            block_similarity = _similarity(pixels, reference)
+            total_intensity[start:stop] = total
+            roi_mean[start:stop] = roi_sums / index.sizes
+            similarity[start:stop] = block_similarity
+            typical &= np.isfinite(block_similarity)
+            typical[typical] &= robust_zscore(block_similarity[typical]) >= -threshold
+            block_mean = _rows_mean(pixels, typical)
+            if block_mean is not None:
+                reference = decay * reference + (1 - decay) * block_mean
+
+    return FrameScreen(total_intensity=total_intensity, roi_mean=roi_mean, similarity=similarity,
+                       outliers=flag_outliers(total_intensity, roi_mean, similarity, threshold), threshold=threshold)
+
+
+def screening_intents(total_intensity: np.ndarray,
+                      roi_mean: np.ndarray,
+                      similarity: np.ndarray,
+                      outliers: np.ndarray,
+                      catalog_name: str,
+                      frame_index: np.ndarray = None) -> List[Intent]:
+    """Plot intents of per-frame screening statistics: the total intensity and ROI means relative to their medians,
+    and the similarity to the reference, against the frame number."""
+    frame_index = np.arange(len(total_intensity)) if frame_index is None else frame_index
+    roi_mean = np.reshape(roi_mean, (len(frame_index), -1))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        relative = np.vstack([total_intensity / np.nanmedian(total_intensity),
+                              (roi_mean / np.nanmedian(roi_mean, axis=0)).T])
+    num_outliers = int(np.count_nonzero(outliers))
+    return [PlotIntent(x=frame_index,
+                       y=relative,
+                       labels={"left": "I / median(I)", "bottom": "frame"},
+                       mixins=["ToggleSymbols"],
+                       name=f"Frame intensity {catalog_name}"),
+            PlotIntent(x=frame_index,
+                       y=similarity,
+                       labels={"left": "similarity", "bottom": "frame"},
+                       mixins=["ToggleSymbols"],
+                       name=f"Frame similarity {catalog_name} ({num_outliers} outliers)")]
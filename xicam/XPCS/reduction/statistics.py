@@ -0,0 +1,112 @@
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Tuple
+
+import numpy as np
+
+from ..sparse import SparseFrames, read_frames
+from .index import QROIIndex
+
+
+def compact_labels(labels) -> np.ndarray:
+    """Return an integer label array in the smallest unsigned dtype that holds its largest label."""
+    labels = np.asarray(labels)
+    if labels.dtype == bool:
+        return labels.astype(np.uint8)
+    labels = np.clip(labels, 0, None)
+    return labels.astype(np.min_scalar_type(int(labels.max()) if labels.size else 0))
+
+
+def roi_labels(rois, mask=None) -> np.ndarray:
+    """Combine ROIs and a mask into one compact label array (0 for background and masked pixels).
+
+    ``rois`` is either a label array (ROIs numbered from 1) or a (num_rois, q_x, q_y) stack of boolean ROI masks,
+    numbered in order (a pixel in several ROIs belongs to the first). ``mask`` marks the valid pixels with nonzero
+    values.
+    """
+    rois = np.asarray(rois)
+    if rois.ndim == 3:
+        inside = rois.astype(bool)
+        labels = np.where(inside.any(axis=0), inside.argmax(axis=0) + 1, 0)
+    else:
+        labels = rois
+    if mask is not None:
+        labels = np.where(np.asarray(mask, dtype=bool), labels, 0)
+    return compact_labels(labels)
+
+
+@dataclass
+class ROIStatistics:
+    """Per-ROI statistics of a frame stack.
+
+    ``mean_intensity`` has shape (num_frames, num_rois); ``contrast`` is the speckle contrast (the variance of the
+    pixel intensities of an ROI over their squared mean, less the Poisson term 1 / mean) averaged over frames. It is
+    NaN when the statistics come from an averaged image rather than from frames.
+    """
+    labels: np.ndarray
+    pixel_count: np.ndarray
+    mean_intensity: np.ndarray
+    contrast: np.ndarray
+    num_frames: int
+
+
+def _block_statistics(frames, index: QROIIndex, start: int) -> Tuple[int, np.ndarray, np.ndarray]:
+    # Per-frame ROI means and contrasts of a block, from one gather of its pixels
+    if isinstance(frames, SparseFrames):
+        values = index.gather_sparse(frames)
+        sums, squares = index.reduce(values), index.reduce(values.multiply(values))
+    else:
+        values = index.gather(np.asarray(frames))
+        sums, squares = index.reduce(values), index.reduce(values ** 2)
+    mean = sums / index.sizes
+    with np.errstate(divide='ignore', invalid='ignore'):
+        contrast = (squares / index.sizes - mean ** 2) / mean ** 2 - 1 / mean
+    return start, mean, contrast
+
+
+def roi_statistics(frames,
+                   index: QROIIndex,
+                   block_size: int = 64,
+                   max_workers: int = None) -> ROIStatistics:
+    """Compute the pixel count, the mean intensity per frame and the speckle contrast of every ROI of ``index`` over
+    a (N, q_x, q_y) frame stack (NumPy, h5py, dask or SparseFrames), in one pass.
+
+    Blocks are read and reduced as in ``reduce_frames``; apart from the (num_frames, num_rois) mean intensities,
+    memory does not grow with the number of frames.
+    """
+    max_workers = max_workers or os.cpu_count()
+    num_frames = len(frames)
+    mean_intensity = np.empty((num_frames, index.num_bins))
+    contrast_sum = np.zeros(index.num_bins)
+    contrast_count = np.zeros(index.num_bins, dtype=np.int64)
+
+    def add(result):
+        start, mean, contrast = result
+        mean_intensity[start:start + len(mean)] = mean
+        finite = np.isfinite(contrast)
+        contrast_sum[:] += np.where(finite, contrast, 0).sum(axis=0)
+        contrast_count[:] += finite.sum(axis=0)
+
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for start in range(0, num_frames, block_size):
+            block = read_frames(frames, start, start + block_size)
+            pending.append(executor.submit(_block_statistics, block, index, start))
+            while len(pending) > 2 * max_workers:
+                add(pending.popleft().result())
+        while pending:
+            add(pending.popleft().result())
+
+    with np.errstate(invalid='ignore'):
+        contrast = contrast_sum / contrast_count
+    return ROIStatistics(labels=index.labels, pixel_count=index.sizes, mean_intensity=mean_intensity,
+                         contrast=contrast, num_frames=num_frames)
+
+
+def image_roi_statistics(image, index: QROIIndex) -> ROIStatistics:
+    """Per-ROI pixel count and mean intensity of an averaged image (e.g. SAXS_2D), for runs without raw frames."""
+    mean = index.mean(np.asarray(image, dtype=np.float64))
+    return ROIStatistics(labels=index.labels, pixel_count=index.sizes, mean_intensity=mean[None, :],
+                         contrast=np.full(index.num_bins, np.nan), num_frames=1)
@@ -0,0 +1,187 @@
+"""Sparse photon-event representation of low-count raw frame stacks.
+
+At high frame rates most pixels record no photon in most frames. ``SparseFrames`` stores a (N, q_x, q_y) stack as
+one CSR row per frame: the flat indices of the pixels that recorded photons and their counts. In a file the same
+layout is a group holding ``indptr`` (N + 1 frame offsets), ``indices`` and ``data`` datasets and a ``frame_shape``
+attribute (see ``write_sparse_hdf5``).
+"""
+import os
+import uuid
+
+import dask.array as da
+import numpy as np
+from scipy import sparse
+
+
+class SparseFrames:
+    """CSR-per-frame representation of a (N, q_x, q_y) stack of photon counts.
+
+    Frame i holds counts ``data[indptr[i]:indptr[i + 1]]`` at the flat pixel indices
+    ``indices[indptr[i]:indptr[i + 1]]``; all other pixels are 0. ``indices`` and ``data`` may be any sliceable
+    arrays (e.g. lazily loaded HDF5 datasets), so only the frames in use are read.
+
+    Indexing returns dense arrays, like indexing the (N, q_x, q_y) array it represents, so a SparseFrames can be
+    displayed or wrapped in dask (``to_dask``) as it is. ``frames(start, stop)`` returns frames as a SparseFrames,
+    which the correlators and ``reduce_frames`` process without densifying.
+    """
+
+    ndim = 3
+
+    def __init__(self, indptr, indices, data, frame_shape, token=None):
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.indices = indices
+        self.data = data
+        self.frame_shape = tuple(int(size) for size in frame_shape)
+        self.shape = (len(self.indptr) - 1, *self.frame_shape)
+        self.dtype = np.dtype(data.dtype)
+        self._token = token or uuid.uuid4().hex
+
+    @classmethod
+    def from_dense(cls, frames, block_size: int = 64) -> 'SparseFrames':
+        """Convert a dense frame stack (NumPy, h5py or dask), reading ``block_size`` frames at a time."""
+        indptr, indices, data = [np.zeros(1, dtype=np.int64)], [], []
+        for start in range(0, len(frames), block_size):
+            block = np.asarray(frames[start:start + block_size])
+            flat = block.reshape(len(block), -1)
+            rows, columns = np.nonzero(flat)
+            indices.append(columns.astype(np.int32))
+            data.append(flat[rows, columns])
+            indptr.append(indptr[-1][-1] + np.cumsum(np.bincount(rows, minlength=len(block))))
+        dtype = np.asarray(frames[:0]).dtype
+        return cls(np.concatenate(indptr),
+                   np.concatenate(indices) if indices else np.zeros(0, dtype=np.int32),
+                   np.concatenate(data) if data else np.zeros(0, dtype=dtype),
+                   np.shape(frames)[1:])
+
+    @classmethod
+    def from_hdf5(cls, path, key: str) -> 'SparseFrames':
+        """Open the sparse layout in group ``key`` of ``path``; counts and pixel indices are read lazily."""
+        from .ingestors.lazy import LazyHDF5Dataset, handle_pool
+
+        with handle_pool.open(path) as h5:
+            group = h5[key]
+            indptr = group['indptr'][()]
+            frame_shape = tuple(group.attrs['frame_shape'])
+        return cls(indptr, LazyHDF5Dataset(path, f'{key}/indices'), LazyHDF5Dataset(path, f'{key}/data'),
+                   frame_shape, token=(str(path), key, os.path.getmtime(path)))
+
+    @property
+    def nnz(self) -> int:
+        return int(self.indptr[-1])
+
+    @property
+    def density(self) -> float:
+        """Fraction of pixels with counts over all frames"""
+        return self.nnz / max(int(np.prod(self.shape)), 1)
+
+    @property
+    def nbytes(self) -> int:
+        return self.indptr.nbytes + self.nnz * (np.dtype(self.indices.dtype).itemsize + self.dtype.itemsize)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def frames(self, start: int = 0, stop: int = None, step: int = None) -> 'SparseFrames':
+        """Return frames ``start:stop:step`` as an in-memory SparseFrames."""
+        start, stop, step = slice(start, stop, step).indices(len(self))
+        if step == 1:
+            first, last = self.indptr[start], self.indptr[max(start, stop)]
+            indptr = self.indptr[start:max(start, stop) + 1] - first
+            return SparseFrames(indptr, np.asarray(self.indices[first:last]), np.asarray(self.data[first:last]),
+                                self.frame_shape)
+        blocks = [self.frames(frame, frame + 1) for frame in range(start, stop, step)]
+        lengths = [block.nnz for block in blocks]
+        return SparseFrames(np.concatenate([[0], np.cumsum(lengths, dtype=np.int64)]),
+                            np.concatenate([block.indices for block in blocks] or [np.zeros(0, np.int32)]),
+                            np.concatenate([block.data for block in blocks] or [np.zeros(0, self.dtype)]),
+                            self.frame_shape)
+
+    def take(self, indices) -> 'SparseFrames':
+        """Return the frames at ``indices`` (or where a boolean mask is True) as an in-memory SparseFrames."""
+        indices = np.asarray(indices)
+        if indices.dtype == bool:
+            indices = np.flatnonzero(indices)
+        rows = self.csr()[indices]
+        return SparseFrames(rows.indptr, rows.indices, rows.data, self.frame_shape)
+
+    def csr(self, dtype=None) -> sparse.csr_matrix:
+        """Return the in-memory frames as a (num_frames, num_pixels) CSR matrix."""
+        block = self if isinstance(self.indices, np.ndarray) and isinstance(self.data, np.ndarray) else self.frames()
+        return sparse.csr_matrix((np.asarray(block.data, dtype=dtype), block.indices, block.indptr),
+                                 shape=(len(block), int(np.prod(self.frame_shape))))
+
+    def to_dense(self) -> np.ndarray:
+        return self.csr().toarray().reshape(self.shape)
+
+    def __array__(self, dtype=None, copy=None):
+        dense = self.to_dense()
+        return dense if dtype is None else dense.astype(dtype, copy=False)
+
+    def __getitem__(self, item):
+        item = item if isinstance(item, tuple) else (item,)
+        first, rest = item[0], item[1:]
+        if isinstance(first, (int, np.integer)):
+            frame = int(first) + len(self) if first < 0 else int(first)
+            return self.frames(frame, frame + 1).to_dense()[0][rest]
+        if isinstance(first, slice):
+            return self.frames(first.start, first.stop, first.step).to_dense()[(slice(None), *rest)]
+        frames = [self.frames(frame, frame + 1).to_dense()[0] for frame in np.arange(len(self))[first]]
+        return np.stack(frames).reshape(-1, *self.frame_shape)[(slice(None), *rest)]
+
+    def sum(self, axis=None, dtype=None):
+        """Sum over all frames (``axis`` 0, giving an image) or over everything (``axis`` None)."""
+        block = self.frames()
+        image = np.bincount(block.indices, weights=np.asarray(block.data, dtype=np.float64),
+                            minlength=int(np.prod(self.frame_shape))).reshape(self.frame_shape)
+        if axis is None:
+            return image.sum(dtype=dtype)
+        if axis != 0:
+            raise ValueError(f"SparseFrames can only be summed over frames (axis 0), not axis {axis}.")
+        return image.astype(dtype or self.dtype, copy=False)
+
+    def mean(self, axis=None):
+        return self.sum(axis=axis, dtype=np.float64) / (len(self) if axis == 0 else np.prod(self.shape))
+
+    def __dask_tokenize__(self):
+        return self._token, self.shape
+
+    def to_dask(self, frames_per_chunk: int = 64) -> da.Array:
+        """Wrap the frames in a dense dask array; each chunk is densified only when it is computed."""
+        return da.from_array(self, chunks=(frames_per_chunk, *self.frame_shape), asarray=False, lock=False,
+                             meta=np.empty((0, 0, 0), dtype=self.dtype))
+
+    def __repr__(self):
+        return f"<{type(self).__name__} shape={self.shape} dtype={self.dtype} density={self.density:.2%}>"
+
+
+def read_frames(frames, start: int, stop: int):
+    """Read frames ``start:stop`` of a stack, keeping a SparseFrames sparse and materializing anything else."""
+    if isinstance(frames, SparseFrames):
+        return frames.frames(start, stop)
+    return np.asarray(frames[start:stop])
+
+
+def write_sparse_hdf5(group, frames, block_size: int = 64, **dataset_kwargs):
+    """Write a frame stack (dense or sparse) into the sparse layout in h5py ``group``, ``block_size`` frames at a
+    time; ``dataset_kwargs`` (e.g. compression) apply to the indices and data datasets."""
+    num_pixels = int(np.prod(frames.shape[1:]))
+    dtype = frames.dtype
+    indices = group.create_dataset('indices', shape=(0,), maxshape=(None,),
+                                   dtype=np.int32 if num_pixels < 2 ** 31 else np.int64, chunks=(2 ** 16,),
+                                   **dataset_kwargs)
+    data = group.create_dataset('data', shape=(0,), maxshape=(None,), dtype=dtype, chunks=(2 ** 16,),
+                                **dataset_kwargs)
+    indptr = [np.zeros(1, dtype=np.int64)]
+    for start in range(0, len(frames), block_size):
+        block = read_frames(frames, start, start + block_size)
+        if not isinstance(block, SparseFrames):
+            block = SparseFrames.from_dense(block, block_size=block_size)
+        size = len(indices)
+        indices.resize((size + block.nnz,))
+        data.resize((size + block.nnz,))
+        indices[size:] = block.indices
+        data[size:] = block.data
+        indptr.append(size + block.indptr[1:])
+    group.create_dataset('indptr', data=np.concatenate(indptr))
+    group.attrs['frame_shape'] = np.asarray(frames.shape[1:], dtype=np.int64)
+    return group
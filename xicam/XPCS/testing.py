@@ -0,0 +1,116 @@
+from functools import partial
+
+import numpy as np
+import h5py
+
+from .ingestors import ingest_nxXPCS, g2_projection_key, tau_projection_key, g2_error_projection_key, dqlist_key, \
+                       SAXS_2D_I_projection_key, SAXS_1D_I_projection_key, SAXS_1D_Q_projection_key, \
+                       SAXS_1D_I_partial_projection_key, raw_data_projection_key, XPCS_mask_projection_key, \
+                       XPCS_roi_projection_key
+
+
+def write_synthetic_nxXPCS(path,
+                           num_q: int = 20,
+                           num_tau: int = 64,
+                           detector_shape=(128, 128),
+                           num_saxs_q: int = 256,
+                           num_partitions: int = 10,
+                           num_frames: int = 0,
+                           resizable: bool = False,
+                           frame_chunks: int = None,
+                           compression: str = None,
+                           compression_opts=None,
+                           num_rois: int = 0,
+                           seed: int = 0):
+    """Write a small nxXPCS file with the layout expected by ``ingest_nxXPCS``.
+
+    g2 curves are single exponential decays with q-dependent relaxation rates; raw frames (only written when
+    ``num_frames`` > 0) are Poisson noise around the average SAXS image. With ``resizable``, the g2 datasets can
+    grow along q and the raw frames along time, as in a file that is still being written.
+
+    Raw frames are chunked ``frame_chunks`` whole frames at a time (one by default when chunked). ``compression``
+    and ``compression_opts`` (e.g. 'gzip' and 4, or 'lzf') are applied to the g2, SAXS_2D and raw datasets.
+
+    With ``num_rois``, a mask hiding a central beamstop and the first detector column and a label map of
+    ``num_rois`` concentric rings are written as well.
+    """
+    rng = np.random.default_rng(seed)
+
+    tau = np.logspace(-5, 1, num_tau)
+    qs = np.linspace(0.001, 0.05, num_q)
+    rates = 1e3 * qs ** 2
+    g2 = 1 + 0.2 * np.exp(-2 * rates[None, :] * tau[:, None])
+    g2_errors = np.full_like(g2, 1e-3)
+    g2 += rng.normal(scale=1e-3, size=g2.shape)
+
+    yy, xx = np.indices(detector_shape)
+    r = np.hypot(yy - detector_shape[0] / 2, xx - detector_shape[1] / 2)
+    saxs_2d = 100 / (1 + r) + 1
+
+    saxs_q = np.linspace(0.001, 0.1, num_saxs_q)
+    saxs_i = 1 / (1 + (saxs_q / 0.01) ** 2)
+    saxs_i_partial = saxs_i[None, :] * (1 + rng.normal(scale=0.01, size=(num_partitions, num_saxs_q)))
+
+    compressed = dict(compression=compression, compression_opts=compression_opts)
+    with h5py.File(path, 'w') as h5:
+        h5.create_dataset(g2_projection_key, data=g2, maxshape=(num_tau, None) if resizable else None, **compressed)
+        h5[tau_projection_key] = tau[None, :]
+        h5.create_dataset(g2_error_projection_key, data=g2_errors, maxshape=(num_tau, None) if resizable else None,
+                          **compressed)
+        h5.create_dataset(dqlist_key, data=qs[None, :], maxshape=(1, None) if resizable else None)
+        h5.create_dataset(SAXS_2D_I_projection_key, data=saxs_2d, **compressed)
+        h5[SAXS_1D_I_projection_key] = saxs_i[None, :]
+        h5[SAXS_1D_Q_projection_key] = saxs_q[None, :]
+        h5[SAXS_1D_I_partial_projection_key] = saxs_i_partial
+        if num_rois:
+            mask = (r > 4).astype(np.uint8)
+            mask[:, 0] = 0
+            ring_edges = np.linspace(0, r.max() + 1e-9, num_rois + 1)
+            h5[XPCS_mask_projection_key] = mask
+            h5[XPCS_roi_projection_key] = np.digitize(r, ring_edges).astype(np.uint16)
+        if num_frames or resizable:
+            if frame_chunks or resizable or compression:
+                chunks = (max(1, min(frame_chunks or 1, num_frames)), *detector_shape)
+            else:
+                chunks = None
+            raw = h5.create_dataset(raw_data_projection_key, shape=(num_frames, *detector_shape), dtype=np.uint16,
+                                    maxshape=(None, *detector_shape) if resizable else None,
+                                    chunks=chunks, **compressed)
+            # Write whole chunks at once so compressed chunks are only encoded once
+            block_size = chunks[0] if chunks else 1
+            for start in range(0, num_frames, block_size):
+                stop = min(start + block_size, num_frames)
+                raw[start:stop] = rng.poisson(saxs_2d, size=(stop - start, *detector_shape))
+
+    return path
+
+
+def load_run(path, **ingest_kwargs):
+    """Ingest ``path`` into an in-memory catalog and return its BlueskyRun."""
+    from databroker.in_memory import BlueskyInMemoryCatalog
+
+    documents = list(ingest_nxXPCS([path], **ingest_kwargs))
+    catalog = BlueskyInMemoryCatalog()
+    catalog.upsert(documents[0][1], documents[-1][1], partial(iter, documents), [], {})
+    return catalog[documents[0][1]['uid']]
+
+
+def synthetic_speckle(num_frames: int = 1000,
+                      shape=(32, 32),
+                      correlation_time: float = 10.,
+                      intensity: float = 100.,
+                      seed: int = 0) -> np.ndarray:
+    """Generate fully developed speckle frames with g2(tau) = 1 + exp(-2 tau / correlation_time).
+
+    The complex field of each pixel follows a unit-variance AR(1) process, so its intensity is exponentially
+    distributed with mean ``intensity``.
+    """
+    rng = np.random.default_rng(seed)
+    decay = np.exp(-1 / correlation_time)
+    innovation = np.sqrt((1 - decay ** 2) / 2)
+    field = (rng.normal(size=shape) + 1j * rng.normal(size=shape)) / np.sqrt(2)
+    frames = np.empty((num_frames, *shape))
+    for i in range(num_frames):
+        field = decay * field + innovation * (rng.normal(size=shape) + 1j * rng.normal(size=shape))
+        frames[i] = intensity * np.abs(field) ** 2
+    return frames
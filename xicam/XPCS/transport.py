@@ -0,0 +1,235 @@
+"""Zero-copy handoff of large arrays between worker processes and the GUI.
+
+A ``SharedArray`` keeps its data in a ``multiprocessing.shared_memory`` block or a memory-mapped file and pickles as
+a small ``SharedArrayDescriptor``, so sending it to another process copies no data. The process that owns a block
+unlinks it when its ``SharedArray`` is closed, garbage collected or the interpreter exits. A worker passes ownership
+on with ``handoff()``: the next time the array is pickled, the receiving process becomes the owner and the worker
+only drops its own mapping.
+
+``SharedArray.to_dask()`` wraps the buffer in a dask array whose chunks are views into it; the dask graph keeps the
+array alive for as long as it is used (e.g. by a SAXSImageIntent).
+"""
+import mmap
+import os
+import tempfile
+import uuid
+import weakref
+from dataclasses import dataclass, replace
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+from typing import Tuple
+
+import dask.array as da
+import numpy as np
+
+# 'shared_memory' (POSIX/Windows shared memory) or 'memmap' (files in memmap_directory, for small /dev/shm mounts)
+default_backend = 'shared_memory'
+memmap_directory = None
+
+# Smaller arrays are cheaper to pickle than to map
+min_shared_bytes = 2 ** 20
+
+
+@dataclass(frozen=True)
+class SharedArrayDescriptor:
+    """Everything needed to map a shared array in another process."""
+    backend: str
+    name: str
+    shape: Tuple[int, ...]
+    dtype: str
+    owner: bool = False
+
+
+def _open_shared_memory(name: str, size: int = 0) -> SharedMemory:
+    create = bool(size)
+    try:
+        return SharedMemory(name=name, create=create, size=size, track=False)
+    except TypeError:
+        # Before Python 3.13 the resource tracker unlinks every block a process touched when it exits, including
+        # blocks handed off to another process; lifetimes are managed here instead
+        shm = SharedMemory(name=name, create=create, size=size)
+        resource_tracker.unregister(shm._name, 'shared_memory')
+        return shm
+
+
+def _open_memmap(path: str, size: int = 0) -> mmap.mmap:
+    with open(path, 'w+b' if size else 'r+b') as f:
+        if size:
+            f.truncate(size)
+        return mmap.mmap(f.fileno(), 0)
+
+
+class _Mapping:
+    """The mapped buffer of a shared array, and whether this process unlinks it."""
+
+    def __init__(self, descriptor: SharedArrayDescriptor, create: bool):
+        self.backend = descriptor.backend
+        self.name = descriptor.name
+        size = max(int(np.prod(descriptor.shape)) * np.dtype(descriptor.dtype).itemsize, 1) if create else 0
+        if self.backend == 'shared_memory':
+            self._handle = _open_shared_memory(self.name, size)
+            self.buffer = self._handle.buf
+        elif self.backend == 'memmap':
+            self._handle = _open_memmap(self.name, size)
+            self.buffer = self._handle
+        else:
+            raise ValueError(f"Unknown shared array backend {self.backend!r}")
+        self.owner = create or descriptor.owner
+
+    def release(self):
+        self.buffer = None
+        try:
+            self._handle.close()
+        except BufferError:
+            # Views of the buffer are still alive; the mapping goes away with them
+            pass
+        if self.owner:
+            self.owner = False
+            try:
+                if self.backend == 'shared_memory':
+                    self._handle.unlink()
+                else:
+                    os.unlink(self.name)
+            except FileNotFoundError:
+                pass
+
+
+class SharedArray:
+    """A NumPy array in shared memory (or a memory-mapped file) that pickles without copying its data.
+
+    Create one with ``empty`` or ``from_array``, fill ``array`` in place, and return it from a worker after calling
+    ``handoff()``. Index it like an array; indexing returns views.
+    """
+
+    def __init__(self, descriptor: SharedArrayDescriptor, create: bool = False):
+        self._mapping = _Mapping(descriptor, create)
+        self._finalizer = weakref.finalize(self, self._mapping.release)
+        self.descriptor = replace(descriptor, owner=False)
+        self.array = np.ndarray(descriptor.shape, dtype=descriptor.dtype, buffer=self._mapping.buffer)
+        self._handed_off = False
+
+    @classmethod
+    def empty(cls, shape, dtype=np.float64, backend: str = None) -> 'SharedArray':
+        backend = backend or default_backend
+        if backend == 'memmap':
+            directory = memmap_directory or os.path.join(tempfile.gettempdir(), 'xicam-XPCS-shared')
+            os.makedirs(directory, exist_ok=True)
+            name = os.path.join(directory, f'{uuid.uuid4().hex}.bin')
+        else:
+            # Short enough for the 31 character limit on macOS
+            name = f'xpcs_{uuid.uuid4().hex[:20]}'
+        shape = tuple(int(size) for size in np.atleast_1d(shape))
+        return cls(SharedArrayDescriptor(backend, name, shape, np.dtype(dtype).str), create=True)
+
+    @classmethod
+    def from_array(cls, array, backend: str = None) -> 'SharedArray':
+        array = np.asarray(array)
+        shared = cls.empty(array.shape, array.dtype, backend=backend)
+        shared.array[...] = array
+        return shared
+
+    @classmethod
+    def attach(cls, descriptor: SharedArrayDescriptor) -> 'SharedArray':
+        """Map an existing block; with ``descriptor.owner``, this process takes over unlinking it."""
+        return cls(descriptor)
+
+    @property
+    def owner(self) -> bool:
+        return self._mapping.owner
+
+    @property
+    def shape(self):
+        return self.array.shape
+
+    @property
+    def dtype(self):
+        return self.array.dtype
+
+    @property
+    def ndim(self):
+        return self.array.ndim
+
+    @property
+    def nbytes(self):
+        return self.array.nbytes
+
+    @property
+    def closed(self) -> bool:
+        return not self._finalizer.alive
+
+    def __len__(self):
+        return len(self.array)
+
+    def __getitem__(self, item):
+        return self.array[item]
+
+    def __setitem__(self, item, value):
+        self.array[item] = value
+
+    def __array__(self, dtype=None, copy=None):
+        return self.array if dtype is None else self.array.astype(dtype, copy=False)
+
+    def handoff(self) -> 'SharedArray':
+        """Pass ownership to the process that unpickles this array next; it must be pickled exactly once."""
+        self._handed_off = True
+        return self
+
+    def __reduce__(self):
+        descriptor = self.descriptor
+        if self._handed_off:
+            descriptor = replace(descriptor, owner=True)
+            self._mapping.owner = False
+            self._handed_off = False
+        return type(self).attach, (descriptor,)
+
+    def to_dask(self, chunks='auto') -> da.Array:
+        """Wrap the buffer in a dask array without copying; its chunks are views into this array.
+
+        Tasks of the graph operate on the views; ``compute()`` still returns a copy, as dask copies its result.
+        """
+        return da.from_array(self, chunks=chunks, name=f'shared-{self.descriptor.name}', asarray=False, lock=False,
+                             meta=np.empty((0,) * self.ndim, dtype=self.dtype))
+
+    def close(self):
+        """Unmap the buffer (once no views of it remain) and, if this process owns it, unlink it."""
+        self.array = None
+        self._finalizer()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __repr__(self):
+        return (f"<{type(self).__name__} {self.descriptor.name!r} ({self.descriptor.backend}) shape={self.shape} "
+                f"dtype={self.dtype}{' owner' if self.owner else ''}>")
+
+
+def share(array, min_bytes: int = None, backend: str = None):
+    """Copy a NumPy ``array`` of at least ``min_bytes`` into a handed-off SharedArray; return others unchanged."""
+    min_bytes = min_shared_bytes if min_bytes is None else min_bytes
+    if isinstance(array, np.ndarray) and array.nbytes >= min_bytes:
+        return SharedArray.from_array(array, backend=backend).handoff()
+    return array
+
+
+def share_documents(documents, min_bytes: int = None, backend: str = None) -> list:
+    """Move the large NumPy arrays in the data of (name, doc) event and event_page documents into shared memory."""
+    shared = []
+    for name, doc in documents:
+        if name in ('event', 'event_page'):
+            doc = dict(doc, data={key: share(value, min_bytes, backend) for key, value in doc['data'].items()})
+        shared.append((name, doc))
+    return shared
+
+
+def attach_documents(documents) -> list:
+    """Replace the SharedArrays in the data of received documents by dask arrays wrapping their buffers."""
+    attached = []
+    for name, doc in documents:
+        if name in ('event', 'event_page'):
+            doc = dict(doc, data={key: value.to_dask() if isinstance(value, SharedArray) else value
+                                  for key, value in doc['data'].items()})
+        attached.append((name, doc))
+    return attached
@@ -0,0 +1,36 @@
+from xicam.core.execution import Workflow
+
+from ..operations.fitting import fit_g2
+from ..operations.multitau import multi_tau_correlation
+from ..operations.twotime import blocked_two_time_correlation
+
+
+class MultiTauOneTime(Workflow):
+    name = 'Multi-Tau 1-Time Correlation'
+
+    def __init__(self):
+        super(MultiTauOneTime, self).__init__()
+        self.correlation = multi_tau_correlation()
+        self.add_operation(self.correlation)
+
+
+class BlockedTwoTime(Workflow):
+    name = 'Blocked 2-Time Correlation'
+
+    def __init__(self):
+        super(BlockedTwoTime, self).__init__()
+        self.correlation = blocked_two_time_correlation()
+        self.add_operation(self.correlation)
+
+
+class MultiTauFit(Workflow):
+    name = 'Multi-Tau 1-Time Correlation + g2 Fit'
+
+    def __init__(self):
+        super(MultiTauFit, self).__init__()
+        self.correlation = multi_tau_correlation()
+        self.fitting = fit_g2()
+        self.add_operations(self.correlation, self.fitting)
+        self.add_link(self.correlation, self.fitting, 'g2', 'g2')
+        self.add_link(self.correlation, self.fitting, 'tau', 'tau')
+        self.add_link(self.correlation, self.fitting, 'g2_errors', 'g2_errors')